@@ -0,0 +1,131 @@
+# api/abbyy_auth.py
+import hashlib
+import threading
+import time
+from .caching import get_redis_client
+from . import json_codec
+
+
+class AbbyyTokenManager:
+    """
+    Caches the ABBYY access token until shortly before it expires, in process
+    and in Redis, and refreshes it under a lock so workers share one exchange.
+    """
+    def __init__(self, fetch_token, cache_key, refresh_margin=60, redis_url=None, share_via_redis=True):
+        """
+        Args:
+            fetch_token (callable): Performs the token exchange and returns (access_token, expires_in).
+            cache_key (str): Identifies the ABBYY tenant/credentials the token belongs to.
+            refresh_margin (int): Seconds before expiry at which the token is considered stale.
+        """
+        self.fetch_token = fetch_token
+        self.cache_key = cache_key
+        self.refresh_margin = refresh_margin
+        self.redis_url = redis_url
+        self.share_via_redis = share_via_redis
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _redis(self):
+        if not self.share_via_redis:
+            return None
+        try:
+            return get_redis_client(self.redis_url)
+        except Exception as e:
+            print(f"WARNING: Redis unavailable for ABBYY token sharing: {e}")
+            return None
+
+    def _local_token(self):
+        if self._token and time.time() < self._expires_at:
+            return self._token
+        return None
+
+    def _shared_token(self, redis_client):
+        try:
+            value = redis_client.get(self.cache_key)
+        except Exception as e:
+            print(f"WARNING: Could not read shared ABBYY token: {e}")
+            return None
+        if not value:
+            return None
+        entry = json_codec.loads(value)
+        self._token, self._expires_at = entry['access_token'], entry['expires_at']
+        return self._local_token()
+
+    def get_token(self):
+        token = self._local_token()
+        if token:
+            return token
+
+        with self._lock:
+            token = self._local_token()
+            if token:
+                return token
+
+            redis_client = self._redis()
+            if redis_client is None:
+                return self._refresh(None)
+
+            token = self._shared_token(redis_client)
+            if token:
+                return token
+            try:
+                with redis_client.lock(f"{self.cache_key}:lock", timeout=30, blocking_timeout=30):
+                    # Another worker may have refreshed while we waited for the lock
+                    return self._shared_token(redis_client) or self._refresh(redis_client)
+            except Exception as e:
+                if not self._local_token():
+                    print(f"WARNING: Shared ABBYY token refresh failed, refreshing locally: {e}")
+                    return self._refresh(None)
+                return self._token
+
+    def _refresh(self, redis_client):
+        access_token, expires_in = self.fetch_token()
+        lifetime = max(int(expires_in) - self.refresh_margin, 1)
+        self._token, self._expires_at = access_token, time.time() + lifetime
+        if redis_client is not None:
+            entry = json_codec.dumps_bytes({'access_token': access_token, 'expires_at': self._expires_at})
+            redis_client.set(self.cache_key, entry, ex=lifetime)
+        return access_token
+
+    def invalidate(self, token):
+        """Forgets `token` (e.g. after ABBYY answered 401) so the next call fetches a new one."""
+        with self._lock:
+            if self._token == token:
+                self._token, self._expires_at = None, 0
+            redis_client = self._redis()
+            if redis_client is None:
+                return
+            try:
+                value = redis_client.get(self.cache_key)
+                if value and json_codec.loads(value)['access_token'] == token:
+                    redis_client.delete(self.cache_key)
+            except Exception as e:
+                print(f"WARNING: Could not invalidate shared ABBYY token: {e}")
+
+
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+
+def get_token_manager(auth_url, credential_id, fetch_token, secret_config):
+    """
+    Returns the process-wide token manager for one ABBYY auth endpoint and
+    credential set, creating it on first use.
+    """
+    cache_key = "docanalyzer:abbyy-token:" + hashlib.sha256(f"{auth_url}|{credential_id}".encode('utf-8')).hexdigest()
+    with _token_managers_lock:
+        manager = _token_managers.get(cache_key)
+        if manager is None:
+            manager = AbbyyTokenManager(
+                fetch_token,
+                cache_key,
+                refresh_margin=secret_config.get('token_refresh_margin_seconds', 60),
+                share_via_redis=secret_config.get('share_token_via_redis', True),
+            )
+            _token_managers[cache_key] = manager
+        else:
+            # Always fetch with the newest provider so rotated config is picked up
+            manager.fetch_token = fetch_token
+        return manager
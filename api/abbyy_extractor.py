@@ -0,0 +1,317 @@
+# api/abbyy_extractor.py
+"""
+Streams ABBYY Vantage results (with ijson, if installed) and builds only the
+fields named in a document type's `abbyy_fields`:
+
+    customer: "customer"                # First value of a field
+    supplierName: "supplier.name"       # A field inside a group
+    techSpecs: {table: "techSpecs", fields: {parameter: "parameter"}}  # One row per entry
+
+Without a spec (or with "*") every field is kept.
+"""
+import hashlib
+import io
+import json
+from . import json_codec
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+KEEP_ALL = '*'
+
+
+class AbbyyFormatError(ValueError):
+    """Raised when an ABBYY result doesn't have the expected structure."""
+
+
+class _Group:
+    """What to keep from one ABBYY `Fields` array, by field name."""
+    def __init__(self, keep_all=False):
+        self.keep_all = keep_all
+        self.rules = {}
+
+    def rule_for(self, name):
+        rule = self.rules.get(name)
+        if rule is None and self.keep_all:
+            return _FieldRule(auto_key=name)
+        return rule
+
+
+class _FieldRule:
+    """What to keep from one field's `List` of entries."""
+    def __init__(self, auto_key=None):
+        self.scalar_keys = []   # Output keys that receive the first entry's value
+        self.group = None       # _Group applied to the first entry's fields, writing into the same output
+        self.table_key = None   # Output key that receives one row per entry
+        self.table_group = None
+        self.auto_key = auto_key  # Keep-all mode: a table for repeating groups, else the first value
+
+
+def compile_spec(spec):
+    """Compiles an `abbyy_fields` spec into a _Group. Raises ValueError for invalid specs."""
+    if spec is None or spec == KEEP_ALL:
+        return _Group(keep_all=True)
+    if not isinstance(spec, dict):
+        raise ValueError(f"abbyy_fields must be a mapping or '{KEEP_ALL}', got {spec!r}")
+
+    group = _Group()
+    for out_key, field_spec in spec.items():
+        if isinstance(field_spec, str):
+            path, columns = field_spec, None
+        elif isinstance(field_spec, dict) and isinstance(field_spec.get('table'), str):
+            path, columns = field_spec['table'], field_spec.get('fields', KEEP_ALL)
+        else:
+            raise ValueError(f"Invalid abbyy_fields entry '{out_key}': {field_spec!r}")
+
+        *parents, name = path.split('.')
+        target = group
+        for parent in parents:
+            rule = target.rules.setdefault(parent, _FieldRule())
+            if rule.table_key or rule.scalar_keys:
+                raise ValueError(f"ABBYY field '{parent}' is used both as a value and as a group in abbyy_fields.")
+            rule.group = rule.group or _Group()
+            target = rule.group
+
+        rule = target.rules.setdefault(name, _FieldRule())
+        if columns is None:
+            rule.scalar_keys.append(out_key)
+        elif rule.table_key:
+            raise ValueError(f"ABBYY field '{path}' is used for two tables in abbyy_fields.")
+        else:
+            rule.table_key, rule.table_group = out_key, compile_spec(columns)
+        if sum(bool(part) for part in (rule.scalar_keys, rule.group, rule.table_key)) > 1:
+            raise ValueError(f"ABBYY field '{path}' is used in more than one way in abbyy_fields.")
+    return group
+
+
+# --- Event helpers. `events` is an iterator of (event, value) pairs as produced by ijson.basic_parse ---
+
+def _events_from_object(value):
+    """Produces the parse events for an already-loaded JSON value."""
+    if isinstance(value, dict):
+        yield 'start_map', None
+        for key, item in value.items():
+            yield 'map_key', key
+            yield from _events_from_object(item)
+        yield 'end_map', None
+    elif isinstance(value, list):
+        yield 'start_array', None
+        for item in value:
+            yield from _events_from_object(item)
+        yield 'end_array', None
+    else:
+        yield 'scalar', value
+
+
+def _skip(events, event):
+    """Skips the value that started with `event`."""
+    if event not in ('start_map', 'start_array'):
+        return
+    depth = 1
+    for event, _ in events:
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+            if not depth:
+                return
+
+
+def _build(events, event, value):
+    """Builds the whole value that started with (event, value)."""
+    if event == 'start_map':
+        built = {}
+        for key in _iter_map(events):
+            built[key] = _build(events, *next(events))
+        return built
+    if event == 'start_array':
+        return [_build(events, event, value) for event, value in _iter_array(events)]
+    return value
+
+
+def _iter_map(events):
+    """Yields the keys of the current map; the caller consumes each value before asking for the next key."""
+    for event, value in events:
+        if event == 'end_map':
+            return
+        if event != 'map_key':
+            raise AbbyyFormatError(f"Unexpected '{event}' inside an object.")
+        yield value
+
+
+def _iter_array(events):
+    """Yields the first event of each item of the current array; the caller consumes the rest of the item."""
+    for event, value in events:
+        if event == 'end_array':
+            return
+        yield event, value
+
+
+def _walk(events, path, handle):
+    """Consumes the current map, calling handle(event, value) for the value at `path` and skipping the rest."""
+    for key in _iter_map(events):
+        event, value = next(events)
+        if key != path[0]:
+            _skip(events, event)
+        elif len(path) == 1:
+            handle(event, value)
+        elif event == 'start_map':
+            _walk(events, path[1:], handle)
+        else:
+            _skip(events, event)
+
+
+# --- ABBYY structure: Fields -> [{Name, List: [{Value: scalar | {Fields: [...]}}]}] ---
+
+def _parse_fields(events, group, sink):
+    """Consumes a `Fields` array, writing the kept values into `sink`."""
+    for event, value in _iter_array(events):
+        if event == 'start_map':
+            _parse_field(events, group, sink)
+        else:
+            _skip(events, event)
+
+
+def _parse_field(events, group, sink):
+    name, buffered_entries = None, None
+    for key in _iter_map(events):
+        event, value = next(events)
+        if key == 'Name':
+            name = value
+        elif key == 'List' and event == 'start_array':
+            rule = group.rule_for(name) if name is not None else None
+            if rule is not None:
+                _parse_entries(events, rule, sink)
+            elif name is None:
+                # The name usually comes first; if not, keep the entries until we know the field
+                buffered_entries = _build(events, event, value)
+            else:
+                _skip(events, event)
+        else:
+            _skip(events, event)
+
+    if buffered_entries is not None and name is not None:
+        rule = group.rule_for(name)
+        if rule is not None:
+            replay = _events_from_object(buffered_entries)
+            next(replay)
+            _parse_entries(replay, rule, sink)
+
+
+def _parse_group_value(events, group, sink):
+    """Consumes a group entry's `Value` object ({"Fields": [...]}), writing the kept values into `sink`."""
+    def handle(event, value):
+        if event == 'start_array':
+            _parse_fields(events, group, sink)
+        else:
+            _skip(events, event)
+    _walk(events, ('Fields',), handle)
+
+
+def _parse_entries(events, rule, sink):
+    """Consumes a field's `List` array according to its rule."""
+    rows = []
+    first = True
+    for event, value in _iter_array(events):
+        if event != 'start_map':
+            _skip(events, event)
+            continue
+        for key in _iter_map(events):
+            event, value = next(events)
+            if key != 'Value':
+                _skip(events, event)
+            elif event == 'start_map':
+                if rule.table_key or rule.auto_key:
+                    row = {}
+                    _parse_group_value(events, rule.table_group or _Group(keep_all=True), row)
+                    if row:
+                        rows.append(row)
+                elif first and rule.group:
+                    _parse_group_value(events, rule.group, sink)
+                elif first and rule.scalar_keys:
+                    row = {}
+                    _parse_group_value(events, _Group(keep_all=True), row)
+                    for out_key in rule.scalar_keys:
+                        sink[out_key] = row
+                else:
+                    _skip(events, event)
+            elif event == 'start_array':
+                _skip(events, event)
+            elif rule.table_key:
+                rows.append(value)
+            elif first:
+                for out_key in rule.scalar_keys or [rule.auto_key]:
+                    if out_key:
+                        sink[out_key] = value
+        first = False
+
+    if rule.table_key:
+        sink[rule.table_key] = rows
+    elif rule.auto_key and rows:
+        sink[rule.auto_key] = rows
+
+
+def _parse_result(events, group):
+    documents = []
+
+    def handle_document_fields(event, value):
+        if event == 'start_array':
+            _parse_fields(events, group, documents[-1])
+        else:
+            _skip(events, event)
+
+    def handle_documents(event, value):
+        if event != 'start_array':
+            raise AbbyyFormatError("'Transaction.Documents' is not a list.")
+        for event, value in _iter_array(events):
+            if event != 'start_map':
+                _skip(events, event)
+                continue
+            documents.append({})
+            _walk(events, ('ExtractedData', 'RootObject', 'Fields'), handle_document_fields)
+
+    if next(events)[0] != 'start_map':
+        raise AbbyyFormatError("The result is not a JSON object.")
+    _walk(events, ('Transaction', 'Documents'), handle_documents)
+    if not documents:
+        raise AbbyyFormatError("The result contains no documents.")
+    return documents[0] if len(documents) == 1 else {'documents': documents}
+
+
+class AbbyyExtractor:
+    """
+    Extracts the fields named in an `abbyy_fields` spec from ABBYY results.
+    The spec is compiled once; an extractor is immutable and thread-safe.
+    """
+    def __init__(self, spec=None):
+        self.group = compile_spec(spec)
+        # Changes whenever the spec does, so cached extractions can be keyed on it
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def extract(self, source):
+        """
+        Extracts from a binary file-like object (e.g. a streamed download) or
+        bytes. Like parse_abbyy_response, returns {"error": ...} when the
+        result can't be parsed.
+        """
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        if ijson is not None:
+            events = iter(ijson.basic_parse(source, use_float=True))
+        else:
+            events = _events_from_object(json_codec.loads(source.read()))
+        return self._extract(events)
+
+    def extract_object(self, raw_data):
+        """Extracts from an already-loaded ABBYY result."""
+        return self._extract(_events_from_object(raw_data))
+
+    def _extract(self, events):
+        try:
+            return _parse_result(events, self.group)
+        except Exception as e:
+            # ijson raises its own JSONError; a truncated stream can end in StopIteration
+            print(f"Error parsing ABBYY response: {e!r}")
+            return {"error": "Failed to parse the ABBYY JSON structure."}
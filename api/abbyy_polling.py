@@ -0,0 +1,73 @@
+# api/abbyy_polling.py
+import math
+import threading
+from .caching import get_redis_client
+
+DEFAULT_POLLING_CONFIG = {
+    'min_interval_seconds': 2,
+    'max_interval_seconds': 30,
+    'backoff_factor': 1.5,
+    'initial_delay_seconds': 5,
+    'default_timeout_seconds': 600,
+    'history_weight': 0.3,
+}
+
+_HISTORY_KEY = 'docanalyzer:abbyy-processing-seconds'
+
+# Used while Redis is unavailable. PollSchedules are built per task, so this
+# lives at module level to keep learning across the tasks of one process.
+_local_history = {}
+_local_history_lock = threading.Lock()
+
+
+def size_bucket(file_size):
+    """Groups files into power-of-two size buckets (<=64 KB, 128 KB, 256 KB, ...)."""
+    return max(int(math.ceil(math.log2(max(file_size, 1)))), 16)
+
+
+class PollSchedule:
+    """
+    Decides when to check an ABBYY transaction: first just before the learned
+    processing time for the skill and file size, then with exponential backoff.
+    """
+    def __init__(self, polling_config=None):
+        self.config = {**DEFAULT_POLLING_CONFIG, **(polling_config or {})}
+
+    def _field(self, skill_id, file_size):
+        return f"{skill_id}:{size_bucket(file_size)}"
+
+    def expected_seconds(self, skill_id, file_size):
+        field = self._field(skill_id, file_size)
+        try:
+            value = get_redis_client().hget(_HISTORY_KEY, field)
+            return float(value) if value is not None else None
+        except Exception:
+            with _local_history_lock:
+                return _local_history.get(field)
+
+    def record(self, skill_id, file_size, elapsed_seconds):
+        """Folds one observed processing time into the running average."""
+        field = self._field(skill_id, file_size)
+        weight = self.config['history_weight']
+        previous = self.expected_seconds(skill_id, file_size)
+        average = elapsed_seconds if previous is None else (1 - weight) * previous + weight * elapsed_seconds
+        with _local_history_lock:
+            _local_history[field] = average
+        try:
+            get_redis_client().hset(_HISTORY_KEY, field, average)
+        except Exception as e:
+            print(f"WARNING: Could not store ABBYY processing history: {e}")
+
+    def first_delay(self, skill_id, file_size):
+        expected = self.expected_seconds(skill_id, file_size)
+        if expected is None:
+            return self.config['initial_delay_seconds']
+        # Check slightly before the typical finish time so fast runs aren't penalised
+        return max(self.config['min_interval_seconds'], expected * 0.8)
+
+    def next_delay(self, attempt):
+        delay = self.config['min_interval_seconds'] * (self.config['backoff_factor'] ** attempt)
+        return min(delay, self.config['max_interval_seconds'])
+
+    def timeout_seconds(self, doc_type_config):
+        return doc_type_config.get('abbyy_timeout_seconds', self.config['default_timeout_seconds'])
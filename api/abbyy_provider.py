@@ -1,5 +1,21 @@
-import time
 from .llm_providers.requests_provider import RequestsProvider
+from .abbyy_auth import get_token_manager
+from .multipart import StreamingMultipartEncoder
+from .metrics import timed, ABBYY_REQUEST_SECONDS, UPLOAD_BYTES, ABBYY_RESULT_BYTES
+from .resilience import ProviderGuard
+from . import json_codec
+
+class _CountingReader:
+    """Wraps a binary stream and counts the bytes read from it."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
 
 class AbbyyProvider:
     def __init__(self, config, vault_client):
@@ -7,12 +23,21 @@ class AbbyyProvider:
         self.secret_config = config['providers']['abbyy']
         self.vault_client = vault_client
         # --- THIS LINE IS CHANGED ---
-        # Initialize the HTTP client with SSL verification turned OFF
+        # Initialize the HTTP client with SSL verification turned OFF.
+        # It reuses the process-wide keep-alive pools, so this is cheap per task.
         self.http_client = RequestsProvider(verify=False)
 
+        auth_url = f"{self.config['base_url']}{self.config['auth_endpoint']}"
+        credential_id = f"{self.secret_config['vault_mount_point']}/{self.secret_config['vault_secret_path']}#{self.secret_config['client_id_vault_key']}"
+        self.token_manager = get_token_manager(auth_url, credential_id, self.fetch_access_token, self.secret_config)
+        # Shared rate limit and circuit breaker for this ABBYY account
+        self.guard = ProviderGuard('abbyy', credential=credential_id)
+
     # In api/abbyy_provider.py
 
-    def get_access_token(self):
+    @timed(ABBYY_REQUEST_SECONDS, operation='fetch_access_token')
+    def fetch_access_token(self):
+        """Performs the client-credentials exchange. Returns (access_token, expires_in)."""
         # Fetch secrets using the new, separated paths from the config
         mount_point = self.secret_config['vault_mount_point']
         secret_path = self.secret_config['vault_secret_path']
@@ -39,46 +64,108 @@ class AbbyyProvider:
             'scope': 'openid permissions global.wildcard'
         }
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        
-        response = self.http_client.post(auth_url, headers=headers, data=payload)
+
+        response = self.http_client.post(auth_url, headers=headers, data=payload, idempotent=True)
         response.raise_for_status()
-        return response.json()['access_token']
+        token_data = response.json()
+        return token_data['access_token'], token_data.get('expires_in', 3600)
+
+    def warm_up(self):
+        """Fetches (or loads the shared) access token so the first task's ABBYY calls find a warm connection."""
+        self.get_access_token()
 
-    def create_transaction(self, access_token, skill_id):
+    def get_access_token(self):
+        """Returns a cached access token, shared across tasks and workers."""
+        return self.token_manager.get_token()
+
+    def _authorized_request(self, method, url, headers=None, **kwargs):
+        """
+        Sends a request with the cached bearer token. If ABBYY rejects the token
+        (e.g. it was revoked early), fetches a new one and retries once.
+        """
+        send = self.http_client.post if method == 'POST' else self.http_client.get
+        with self.guard.call():
+            for attempt in range(2):
+                token = self.get_access_token()
+                request_headers = {**(headers or {}), 'Authorization': f'Bearer {token}'}
+                response = send(url, headers=request_headers, **kwargs)
+                if response.status_code != 401 or attempt == 1:
+                    break
+                self.token_manager.invalidate(token)
+            response.raise_for_status()
+        return response
+
+    @timed(ABBYY_REQUEST_SECONDS, operation='create_transaction')
+    def create_transaction(self, skill_id):
         url = f"{self.config['base_url']}{self.config['transactions_endpoint']}"
-        headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json'}
         body = {'skillId': skill_id}
-        response = self.http_client.post(url, headers=headers, json=body)
-        response.raise_for_status()
+        response = self._authorized_request('POST', url, headers=headers, json=body)
         return response.json()['transactionId']
 
-    def add_file_to_transaction(self, access_token, transaction_id, file_content, file_name, content_type):
+    @timed(ABBYY_REQUEST_SECONDS, operation='add_file_to_transaction')
+    def add_file_to_transaction(self, transaction_id, file_obj, file_name, content_type):
+        """
+        Streams the file from an open binary file handle so the request body is
+        never built in memory. Returns the upload's size, duration and throughput.
+        """
         url = f"{self.config['base_url']}{self.config['transactions_endpoint']}/{transaction_id}/files"
-        headers = {'Authorization': f'Bearer {access_token}'}
-        files = {'file': (file_name, file_content, content_type)}
-        response = self.http_client.post(url, headers=headers, files=files)
-        response.raise_for_status()
+        body = StreamingMultipartEncoder('file', file_obj, file_name, content_type)
+        headers = {'Content-Type': body.content_type}
+        self._authorized_request('POST', url, headers=headers, data=body)
 
-    def start_transaction(self, access_token, transaction_id):
+        upload_stats = body.stats()
+        if upload_stats:
+            UPLOAD_BYTES.observe(upload_stats['bytes'])
+            print(
+                f"ABBYY upload for transaction {transaction_id}: {upload_stats['bytes']} bytes in "
+                f"{upload_stats['seconds']:.2f}s ({upload_stats['bytes_per_second'] / 1024 / 1024:.2f} MB/s)"
+            )
+        return upload_stats
+
+    @timed(ABBYY_REQUEST_SECONDS, operation='start_transaction')
+    def start_transaction(self, transaction_id):
         url = f"{self.config['base_url']}{self.config['transactions_endpoint']}/{transaction_id}/start"
-        headers = {'Authorization': f'Bearer {access_token}'}
-        response = self.http_client.post(url, headers=headers, json={})
-        response.raise_for_status()
+        self._authorized_request('POST', url, json={})
 
-    def poll_and_get_result(self, access_token, transaction_id):
+    @timed(ABBYY_REQUEST_SECONDS, operation='get_transaction_status')
+    def get_transaction_status(self, transaction_id):
+        """Checks a transaction once and returns ABBYY's status payload."""
         status_url = f"{self.config['base_url']}{self.config['transactions_endpoint']}/{transaction_id}"
-        headers = {'Authorization': f'Bearer {access_token}'}
-        for _ in range(30):
-            response = self.http_client.get(status_url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            if data.get('status') == 'Processed':
-                file_id = data['documents'][0]['resultFiles'][0]['fileId']
-                download_url = f"{self.config['base_url']}{self.config['transactions_endpoint']}/{transaction_id}/files/{file_id}/download"
-                result_response = self.http_client.get(download_url, headers=headers)
-                result_response.raise_for_status()
-                return result_response.json()
-            elif data.get('status') in ['Error', 'Cancelled', 'ProcessingFailed']:
-                raise Exception(f"ABBYY processing failed with status: {data.get('status')}")
-            time.sleep(5)
-        raise Exception("ABBYY processing timed out.")
\ No newline at end of file
+        response = self._authorized_request('GET', status_url)
+        data = response.json()
+        if data.get('status') in ['Error', 'Cancelled', 'ProcessingFailed']:
+            raise Exception(f"ABBYY processing failed with status: {data.get('status')}")
+        return data
+
+    def _result_url(self, transaction_id, status_data, document_index):
+        file_id = status_data['documents'][document_index]['resultFiles'][0]['fileId']
+        return f"{self.config['base_url']}{self.config['transactions_endpoint']}/{transaction_id}/files/{file_id}/download"
+
+    @timed(ABBYY_REQUEST_SECONDS, operation='download_result')
+    def download_result(self, transaction_id, status_data, document_index=0):
+        """Downloads the JSON result of a processed transaction."""
+        result_response = self._authorized_request('GET', self._result_url(transaction_id, status_data, document_index))
+        ABBYY_RESULT_BYTES.observe(len(result_response.content))
+        return result_response.json()
+
+    @timed(ABBYY_REQUEST_SECONDS, operation='extract_result')
+    def extract_result(self, transaction_id, status_data, extractor, document_index=0, keep_raw=False):
+        """
+        Streams the result of a processed transaction through an AbbyyExtractor,
+        so the verbose ABBYY payload is never held in memory. Returns
+        (extracted_data, raw_data); raw_data is only downloaded whole, and
+        returned, with keep_raw.
+        """
+        url = self._result_url(transaction_id, status_data, document_index)
+        if keep_raw:
+            content = self._authorized_request('GET', url).content
+            ABBYY_RESULT_BYTES.observe(len(content))
+            return extractor.extract(content), json_codec.loads(content)
+
+        with self._authorized_request('GET', url, stream=True) as response:
+            response.raw.decode_content = True
+            reader = _CountingReader(response.raw)
+            extracted_data = extractor.extract(reader)
+        ABBYY_RESULT_BYTES.observe(reader.bytes_read)
+        return extracted_data, None
@@ -0,0 +1,93 @@
+# api/batches.py
+import time
+from .caching import get_redis_client
+from . import json_codec
+
+# Per-document stages, in order
+QUEUED, OCR, LLM, DONE, FAILED = 'queued', 'ocr', 'llm', 'done', 'failed'
+TERMINAL_STAGES = (DONE, FAILED)
+
+
+class BatchTracker:
+    """
+    Keeps per-document progress for a batch analysis in a Redis hash, so the
+    web server can report it while the documents move through ABBYY
+    transactions and LLM tasks on different workers.
+    """
+    def __init__(self, ttl_seconds=7 * 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, batch_id):
+        return f"docanalyzer:batch:{batch_id}"
+
+    @property
+    def client(self):
+        return get_redis_client()
+
+    def create(self, batch_id, documents):
+        """Registers a batch. `documents` is a list of dicts with at least 'file_name' and 'doc_type_id'."""
+        key = self._key(batch_id)
+        mapping = {'meta': json_codec.dumps_bytes({'created_at': time.time(), 'total': len(documents)})}
+        for index, document in enumerate(documents):
+            mapping[f"doc:{index}"] = json_codec.dumps_bytes({
+                'index': index,
+                'file_name': document['file_name'],
+                'doc_type_id': document['doc_type_id'],
+                'status': QUEUED,
+            })
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl_seconds)
+        pipe.execute()
+
+    def update_document(self, batch_id, index, **fields):
+        key = self._key(batch_id)
+        field = f"doc:{index}"
+        raw = self.client.hget(key, field)
+        document = json_codec.loads(raw) if raw else {'index': index}
+        document.update(fields)
+        self.client.hset(key, field, json_codec.dumps_bytes(document))
+
+    def fail_documents(self, batch_id, indexes, error, only_stages=None):
+        """Marks documents as failed; with `only_stages`, only those currently in one of these stages."""
+        for index in indexes:
+            if only_stages is not None:
+                raw = self.client.hget(self._key(batch_id), f"doc:{index}")
+                if raw is None or json_codec.loads(raw).get('status') not in only_stages:
+                    continue
+            self.update_document(batch_id, index, status=FAILED, error=error)
+
+    def get(self, batch_id):
+        """Returns the batch summary and per-document progress, or None for an unknown batch."""
+        raw = self.client.hgetall(self._key(batch_id))
+        if not raw:
+            return None
+        documents = []
+        for field, value in raw.items():
+            if field.startswith(b'doc:'):
+                documents.append(json_codec.loads(value))
+        documents.sort(key=lambda document: document['index'])
+
+        counts = {}
+        for document in documents:
+            counts[document['status']] = counts.get(document['status'], 0) + 1
+        finished = sum(counts.get(stage, 0) for stage in TERMINAL_STAGES)
+        if finished < len(documents):
+            status = 'PROGRESS' if len(documents) - counts.get(QUEUED, 0) else 'PENDING'
+        elif counts.get(FAILED, 0) == len(documents):
+            status = 'FAILURE'
+        elif counts.get(FAILED, 0):
+            status = 'PARTIAL'
+        else:
+            status = 'SUCCESS'
+
+        return {
+            'batch_id': batch_id,
+            'status': status,
+            'total': len(documents),
+            'counts': counts,
+            'documents': documents,
+        }
+
+
+batch_tracker = BatchTracker()
@@ -0,0 +1,202 @@
+# api/blob_store.py
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from django.conf import settings
+from .config_registry import config_section
+
+_BLOB_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BaseBlobStore(ABC):
+    """
+    Stores uploaded documents by the SHA-256 of their content, so only a short
+    reference has to travel through the Celery broker. Holders (usually task
+    ids) acquire a blob while they need it; a blob with no holders left is
+    deleted, and anything older than the retention window is swept up by
+    `collect_garbage`.
+    """
+    @abstractmethod
+    def put_chunks(self, chunks, holder=None):
+        """
+        Streams an iterable of bytes into the store and returns the blob id.
+        When `holder` is given the blob is acquired for it atomically.
+        """
+
+    @abstractmethod
+    def open(self, blob_id):
+        """Returns a readable binary file object for the blob."""
+
+    @abstractmethod
+    def size(self, blob_id):
+        pass
+
+    @abstractmethod
+    def acquire(self, blob_id, holder):
+        pass
+
+    @abstractmethod
+    def release(self, blob_id, holder):
+        """Drops `holder`'s hold; the blob is deleted once nobody holds it."""
+
+    @abstractmethod
+    def collect_garbage(self):
+        """Deletes expired blobs and stale holds. Returns the number of blobs removed."""
+
+    def read(self, blob_id):
+        with self.open(blob_id) as f:
+            return f.read()
+
+    @staticmethod
+    def validate_id(blob_id):
+        if not _BLOB_ID_RE.match(blob_id or ''):
+            raise ValueError(f"Invalid blob id: {blob_id!r}")
+        return blob_id
+
+
+class LocalBlobStore(BaseBlobStore):
+    """
+    A blob store on a local directory. The web server and the Celery workers
+    must see the same directory, so they have to run on the same host (or on
+    a filesystem where flock() locks hold across hosts): holds are counted
+    under an flock() lock, which NFS clients don't reliably share.
+    """
+    def __init__(self, directory, retention_seconds=24 * 3600):
+        self.directory = Path(directory)
+        self.retention_seconds = retention_seconds
+        self.blobs_dir = self.directory / 'blobs'
+        self.refs_dir = self.directory / 'refs'
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.refs_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serializes store/acquire/release across processes on this host."""
+        with open(self.directory / '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def path(self, blob_id):
+        self.validate_id(blob_id)
+        return self.blobs_dir / blob_id[:2] / blob_id
+
+    def put_chunks(self, chunks, holder=None):
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            blob_id = digest.hexdigest()
+            path = self.path(blob_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with self._locked():
+                if path.exists():
+                    # Same content is already stored; just restart its retention window
+                    os.utime(path, None)
+                else:
+                    os.replace(tmp_path, path)
+                if holder:
+                    self._acquire(blob_id, holder)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return blob_id
+
+    def open(self, blob_id):
+        return open(self.path(blob_id), 'rb')
+
+    def size(self, blob_id):
+        return self.path(blob_id).stat().st_size
+
+    def _refs_path(self, blob_id):
+        self.validate_id(blob_id)
+        return self.refs_dir / blob_id
+
+    def acquire(self, blob_id, holder):
+        with self._locked():
+            self._acquire(blob_id, holder)
+
+    def _acquire(self, blob_id, holder):
+        refs_path = self._refs_path(blob_id)
+        refs_path.mkdir(parents=True, exist_ok=True)
+        (refs_path / holder).touch()
+
+    def release(self, blob_id, holder):
+        refs_path = self._refs_path(blob_id)
+        with self._locked():
+            (refs_path / holder).unlink(missing_ok=True)
+            try:
+                # rmdir only succeeds when no other holder is left
+                refs_path.rmdir()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                return
+            self.path(blob_id).unlink(missing_ok=True)
+
+    def collect_garbage(self):
+        cutoff = time.time() - self.retention_seconds
+        for ref in self.refs_dir.glob('*/*'):
+            try:
+                if ref.stat().st_mtime < cutoff:
+                    ref.unlink()
+            except FileNotFoundError:
+                pass
+
+        removed = 0
+        for path in self.blobs_dir.glob('*/*'):
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+                with self._locked():
+                    refs_path = self.refs_dir / path.name
+                    if refs_path.exists() and any(refs_path.iterdir()):
+                        continue
+                    path.unlink()
+                    if refs_path.exists():
+                        refs_path.rmdir()
+                removed += 1
+            except OSError:
+                continue
+
+        # Partial uploads left behind by a crashed web worker
+        for part in self.directory.glob('*.part'):
+            try:
+                if part.stat().st_mtime < cutoff:
+                    part.unlink()
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+_blob_store = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store(config_data):
+    """Returns the configured blob store; 'local' is the only backend so far."""
+    global _blob_store
+    store_config = config_section('blob_store', config_data)
+    with _blob_store_lock:
+        if _blob_store is None:
+            backend = store_config.get('backend', 'local')
+            if backend == 'local':
+                _blob_store = LocalBlobStore(
+                    Path(settings.BASE_DIR) / store_config.get('directory', 'media/uploads'),
+                    retention_seconds=store_config.get('retention_seconds', 24 * 3600),
+                )
+            else:
+                raise ValueError(f"Unknown blob store backend: {backend}")
+    return _blob_store
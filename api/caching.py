@@ -0,0 +1,148 @@
+# api/caching.py
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+_redis_clients = {}
+_redis_lock = threading.Lock()
+
+
+def get_redis_client(url=None):
+    """
+    Returns a shared Redis client for the given URL, defaulting to the Celery
+    broker. Clients are created once per process and reuse their connection pool.
+    """
+    import redis
+
+    url = url or settings.CELERY_BROKER_URL
+    with _redis_lock:
+        if url not in _redis_clients:
+            _redis_clients[url] = redis.Redis.from_url(url)
+        return _redis_clients[url]
+
+
+class CacheStats:
+    """Thread-safe hit/miss counters shared by all cache backends."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class LocalLRUCache:
+    """
+    An in-process LRU cache for bytes values with a per-entry TTL and a limit on
+    the total size of stored values.
+    """
+    def __init__(self, ttl_seconds=3600, max_bytes=64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        self.stats.record(entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl_seconds=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, value)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """
+    A Redis-backed cache for bytes values shared by every web and Celery worker.
+    Redis errors are treated as misses so a cache outage never fails a request.
+    Values larger than `max_bytes` are not stored.
+    """
+    def __init__(self, prefix, ttl_seconds=3600, max_bytes=8 * 1024 * 1024, url=None):
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.url = url
+        self.stats = CacheStats()
+
+    @property
+    def client(self):
+        return get_redis_client(self.url)
+
+    def get(self, key):
+        try:
+            value = self.client.get(f"{self.prefix}{key}")
+        except Exception as e:
+            print(f"WARNING: Redis cache read failed: {e}")
+            value = None
+        self.stats.record(value is not None)
+        return value
+
+    def set(self, key, value, ttl_seconds=None):
+        if len(value) > self.max_bytes:
+            return
+        try:
+            self.client.set(f"{self.prefix}{key}", value, ex=max(1, int(ttl_seconds or self.ttl_seconds)))
+        except Exception as e:
+            print(f"WARNING: Redis cache write failed: {e}")
+
+    def delete(self, key):
+        try:
+            self.client.delete(f"{self.prefix}{key}")
+        except Exception as e:
+            print(f"WARNING: Redis cache delete failed: {e}")
+
+
+def build_cache(cache_config, prefix):
+    """Builds a LocalLRUCache or RedisCache from a 'caching.*' config section."""
+    ttl_seconds = cache_config.get('ttl_seconds', 3600)
+    max_bytes = cache_config.get('max_bytes', 64 * 1024 * 1024)
+    backend = cache_config.get('backend', 'local')
+    if backend == 'local':
+        return LocalLRUCache(ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+    elif backend == 'redis':
+        return RedisCache(prefix, ttl_seconds=ttl_seconds, max_bytes=max_bytes, url=cache_config.get('redis_url'))
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,136 @@
+# api/config_registry.py
+import hashlib
+import os
+import threading
+import yaml
+from pathlib import Path
+from django.conf import settings
+from .prompting import ENCODINGS, COMPACT
+from .map_reduce import LLM_MODES, SINGLE
+from .abbyy_extractor import AbbyyExtractor
+
+
+class ConfigSnapshot:
+    """
+    An immutable, parsed view of config.yaml with document types and AI models
+    indexed by id, every prompt template already loaded into memory and every
+    ABBYY field spec compiled.
+    """
+    def __init__(self, data, etag, prompt_templates, abbyy_extractors):
+        self.data = data
+        self.etag = etag
+        self.document_types = {item['id']: item for item in data.get('document_types', [])}
+        self.ai_models = {item['id']: item for item in data.get('ai_models', [])}
+        self.prompt_templates = prompt_templates
+        self.abbyy_extractors = abbyy_extractors
+
+    def get_document_type(self, doc_type_id):
+        return self.document_types.get(doc_type_id)
+
+    def get_model(self, model_id):
+        return self.ai_models.get(model_id)
+
+    def get_prompt_template(self, doc_type_id):
+        return self.prompt_templates[doc_type_id]
+
+    def get_abbyy_extractor(self, doc_type_id):
+        return self.abbyy_extractors[doc_type_id]
+
+
+class ConfigRegistry:
+    """
+    Parses config.yaml once per process and re-parses it only when the file
+    (or one of its prompt templates) changes on disk. A cheap stat() call is
+    the only per-request cost; content hashes guard against touch-only changes.
+    """
+    def __init__(self, config_path, base_dir):
+        self.config_path = Path(config_path)
+        self.base_dir = Path(base_dir)
+        self._snapshot = None
+        self._stamps = None
+        self._lock = threading.Lock()
+
+    def _stat_stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _current_stamps(self, snapshot):
+        paths = [self.config_path]
+        if snapshot:
+            paths += [self.base_dir / doc['prompt_template'] for doc in snapshot.document_types.values()]
+        return tuple(self._stat_stamp(path) for path in paths)
+
+    def get(self):
+        """Returns the current ConfigSnapshot, reloading it if the files changed."""
+        snapshot = self._snapshot
+        if snapshot is not None and self._current_stamps(snapshot) == self._stamps:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None and self._current_stamps(self._snapshot) == self._stamps:
+                return self._snapshot
+            try:
+                self._reload()
+            except Exception as e:
+                # Keep serving the last good config if an edit broke the file
+                if self._snapshot is None:
+                    raise
+                print(f"ERROR: Failed to reload '{self.config_path}', keeping the previous configuration. Error: {e}")
+                self._stamps = self._current_stamps(self._snapshot)
+            return self._snapshot
+
+    def _reload(self):
+        with open(self.config_path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw)
+
+        data = yaml.safe_load(raw)
+        prompt_templates = {}
+        abbyy_extractors = {}
+        for doc_type in data.get('document_types', []):
+            template_path = self.base_dir / doc_type['prompt_template']
+            with open(template_path, 'r') as f:
+                template = f.read()
+            digest.update(template.encode('utf-8'))
+            try:
+                template.format(extracted_data='', manual_rag_text='')
+            except (KeyError, IndexError, ValueError) as e:
+                raise ValueError(f"Invalid prompt template '{template_path}': {e!r}")
+            if doc_type.get('prompt_encoding', COMPACT) not in ENCODINGS:
+                raise ValueError(f"Invalid prompt_encoding for document type '{doc_type['id']}': {doc_type['prompt_encoding']!r}")
+            if doc_type.get('llm_mode', SINGLE) not in LLM_MODES:
+                raise ValueError(f"Invalid llm_mode for document type '{doc_type['id']}': {doc_type['llm_mode']!r}")
+            if not isinstance(doc_type.get('priority', 0), int) or not 0 <= doc_type.get('priority', 0) <= 9:
+                raise ValueError(f"Invalid priority for document type '{doc_type['id']}': {doc_type['priority']!r} (use 0-9)")
+            policy = doc_type.get('execution_policy') or {}
+            model_ids = {model['id'] for model in data.get('ai_models', [])}
+            if policy.get('fallback_model') and policy['fallback_model'] not in model_ids:
+                raise ValueError(f"Unknown fallback_model for document type '{doc_type['id']}': {policy['fallback_model']!r}")
+            prompt_templates[doc_type['id']] = template
+            try:
+                abbyy_extractors[doc_type['id']] = AbbyyExtractor(doc_type.get('abbyy_fields'))
+            except ValueError as e:
+                raise ValueError(f"Invalid abbyy_fields for document type '{doc_type['id']}': {e}")
+
+        etag = f'"{digest.hexdigest()}"'
+        if self._snapshot is None or self._snapshot.etag != etag:
+            self._snapshot = ConfigSnapshot(data, etag, prompt_templates, abbyy_extractors)
+        self._stamps = self._current_stamps(self._snapshot)
+
+
+# Create a single, reusable instance for the application
+config_registry = ConfigRegistry(settings.ANALYZER_CONFIG_PATH, settings.BASE_DIR)
+
+
+def config_section(path, config_data=None, defaults=None):
+    """
+    Returns a section of config.yaml by dotted path (e.g. 'caching.ocr_results'),
+    from `config_data` or else the current config, merged over `defaults`.
+    """
+    section = config_registry.get().data if config_data is None else config_data
+    for name in path.split('.'):
+        section = section.get(name) or {}
+    return {**(defaults or {}), **section}
@@ -0,0 +1,80 @@
+# api/json_codec.py
+"""
+JSON for Celery, API responses and Redis: orjson when installed, else the json
+module, with the same compact UTF-8 output. Hashes and cache keys stay on json.
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Registered with kombu for Celery messages and results (see register_celery_serializer)
+CELERY_SERIALIZER = 'docjson'
+CELERY_CONTENT_TYPE = 'application/x-docanalyzer-json'
+
+
+def _default(obj):
+    """Encodes the non-JSON types that turn up in task results and API responses."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).decode('utf-8')
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj, pretty, default):
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=default)
+
+
+def dumps_bytes(obj, pretty=False, default=None):
+    """Encodes `obj` as UTF-8 JSON bytes; `pretty` indents by two spaces."""
+    default = default or _default
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0))
+        except TypeError:
+            # e.g. integers beyond 64 bits, which orjson refuses; the json module copes
+            pass
+    return _stdlib_dumps(obj, pretty, default).encode('utf-8')
+
+
+def dumps(obj, pretty=False, default=None):
+    """Like dumps_bytes, but returns a str."""
+    if orjson is not None:
+        return dumps_bytes(obj, pretty, default).decode('utf-8')
+    return _stdlib_dumps(obj, pretty, default or _default)
+
+
+def loads(data):
+    """Decodes JSON from str, bytes, bytearray or memoryview. Raises ValueError for invalid JSON."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def register_celery_serializer():
+    """
+    Registers the codec with kombu under CELERY_SERIALIZER. It has its own
+    content type, so messages sent with Celery's 'json' serializer (events,
+    tasks queued before an upgrade) keep being decoded by kombu.
+    """
+    from kombu.serialization import register
+    register(
+        CELERY_SERIALIZER, dumps_bytes, loads,
+        content_type=CELERY_CONTENT_TYPE, content_encoding='utf-8',
+    )
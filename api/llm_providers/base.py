@@ -1,11 +1,73 @@
 # api/llm_providers/base.py
+import contextlib
+import time
 from abc import ABC, abstractmethod
+from api import json_codec
+from api.metrics import LLM_TIME_TO_FIRST_TOKEN_SECONDS, LLM_SECONDS_PER_OUTPUT_TOKEN
+
 
 class BaseLLMProvider(ABC):
+    # Short name used in cache keys and logs, e.g. "google" or "openai"
+    provider_name = None
+    # Whether stream_analysis() is implemented
+    supports_streaming = False
+
     def __init__(self, api_key, model_id):
         self.api_key = api_key
         self.model_id = model_id
 
     @abstractmethod
     def generate_analysis(self, prompt):
-        pass
\ No newline at end of file
+        pass
+
+    def generation_params(self):
+        """
+        Returns the generation settings sent alongside the prompt. Two calls
+        with the same provider, model, prompt and params are interchangeable.
+        """
+        return {}
+
+    def warm_up(self):
+        """Opens connections to the provider ahead of the first request. Optional."""
+
+    def stream_analysis(self, prompt):
+        """
+        Yields (text, output_tokens) pieces of the response as the model
+        generates it. output_tokens is the provider's running count of
+        generated tokens, or None when it doesn't report one.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming.")
+
+    def generate_analysis_streaming(self, prompt, on_progress=None):
+        """
+        Same result as generate_analysis, but streamed when the provider
+        supports it: `on_progress(text_so_far, output_tokens)` is called for
+        every received piece, and the time to the first token and the time per
+        following token are recorded per model.
+        """
+        if not self.supports_streaming:
+            return self.generate_analysis(prompt)
+
+        labels = {'provider': self.provider_name, 'model_id': self.model_id}
+        started = time.perf_counter()
+        first_token_at = None
+        parts, output_tokens = [], 0
+        # Closed right away when on_progress stops the stream (e.g. a losing hedged call), not when collected
+        with contextlib.closing(self.stream_analysis(prompt)) as stream:
+            for text, tokens in stream:
+                if text and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(first_token_at - started, **labels)
+                parts.append(text)
+                # Without a reported count, every non-empty piece is taken as one token
+                output_tokens = tokens if tokens is not None else output_tokens + (1 if text else 0)
+                if on_progress and (text or tokens is not None):
+                    on_progress(''.join(parts), output_tokens)
+
+        if first_token_at is not None and output_tokens > 1:
+            LLM_SECONDS_PER_OUTPUT_TOKEN.observe((time.perf_counter() - first_token_at) / (output_tokens - 1), **labels)
+
+        response_text = ''.join(parts).strip()
+        if not response_text:
+            raise ValueError(f"{self.provider_name} returned an empty streamed response.")
+        return json_codec.loads(response_text)
@@ -1,37 +1,80 @@
 # api/llm_providers/gemini_provider.py
-import json
 from .base import BaseLLMProvider
 from .requests_provider import RequestsProvider
 from api.utils import parse_gemini_response
+from api import json_codec
+from api.resilience import ProviderGuard
 
 
 class GeminiProvider(BaseLLMProvider):
+    provider_name = "google"
+    supports_streaming = True
+
     def __init__(self, api_key, model_id, config):
         super().__init__(api_key, model_id)
         self.config = config
         # --- THIS IS THE FIX ---
         # Initialize the HTTP client with SSL verification turned OFF for development
         self.http_client = RequestsProvider(verify=False)
+        # Shared rate limit and circuit breaker for this model and API key
+        self.guard = ProviderGuard(self.provider_name, model_id, credential=api_key)
 
-    def generate_analysis(self, prompt):
-        path = self.config['generate_content_path'].format(model_name=self.model_id)
+    def generation_params(self):
+        return {
+            "response_mime_type": "application/json",
+            "temperature": 0.2,
+        }
+
+    def warm_up(self):
+        # Any response will do; this only resolves DNS and leaves a TLS connection in the pool
+        connect_timeout = self.http_client.http_config['connect_timeout']
+        self.http_client.request('HEAD', self.config['base_url'], timeout=(connect_timeout, 10)).close()
+
+    def _request(self, prompt, path_key):
+        path = self.config[path_key].format(model_name=self.model_id)
         gemini_url = f"{self.config['base_url']}{path}"
 
         gemini_data = {
             "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "response_mime_type": "application/json",
-                "temperature": 0.2,
-            }
+            "generationConfig": self.generation_params()
         }
         headers = {
             "Content-Type": "application/json",
             "X-goog-api-key": self.api_key
         }
+        return gemini_url, headers, gemini_data
+
+    def generate_analysis(self, prompt):
+        gemini_url, headers, gemini_data = self._request(prompt, 'generate_content_path')
+
+        # Use the http_client which now has verify=False. Generation has no side
+        # effects, so it is safe to retry on 429/5xx.
+        with self.guard.call():
+            response = self.http_client.post(gemini_url, headers=headers, data=json_codec.dumps_bytes(gemini_data), idempotent=True)
+            response.raise_for_status()
+        response_data = json_codec.loads(response.content)
 
-        # Use the http_client which now has verify=False
-        response = self.http_client.post(gemini_url, headers=headers, json=gemini_data)
-        response.raise_for_status()
-        response_data = response.json()
+        return parse_gemini_response(response_data)
 
-        return parse_gemini_response(response_data)
\ No newline at end of file
+    def stream_analysis(self, prompt):
+        # streamGenerateContent with alt=sse sends one GenerateContentResponse per 'data:' line
+        gemini_url, headers, gemini_data = self._request(prompt, 'stream_generate_content_path')
+        with self.guard.call():
+            response = self.http_client.post(
+                gemini_url, headers=headers, data=json_codec.dumps_bytes(gemini_data), params={"alt": "sse"}, stream=True, idempotent=True,
+            )
+            with response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line.startswith(b'data:'):
+                        continue
+                    chunk = json_codec.loads(line[5:])
+                    if not chunk.get('candidates'):
+                        block_reason = chunk.get('promptFeedback', {}).get('blockReason')
+                        if block_reason:
+                            raise ValueError(f"Response blocked by safety filters. Reason: {block_reason}")
+                        continue
+                    parts = chunk['candidates'][0].get('content', {}).get('parts', [])
+                    text = ''.join(part.get('text', '') for part in parts)
+                    # candidatesTokenCount is the running total of generated tokens
+                    yield text, chunk.get('usageMetadata', {}).get('candidatesTokenCount')
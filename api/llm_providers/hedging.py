@@ -0,0 +1,102 @@
+# api/llm_providers/hedging.py
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from .base import BaseLLMProvider
+from api.metrics import LLM_POLICY_CALLS_TOTAL, ContextThreadPoolExecutor
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when no model returned a valid response before the execution policy's deadline."""
+
+
+class _Cancelled(Exception):
+    """Raised inside a losing streamed call to stop reading its response."""
+
+
+class HedgedLLMProvider(BaseLLMProvider):
+    """
+    Applies a document type's execution policy to every call: the primary
+    model is asked first and, if it hasn't answered after
+    `hedge_after_seconds` (or has failed), the fallback model is asked as
+    well. The first valid response wins. A losing streamed call stops at its
+    next piece; a losing blocking call finishes in the background and its
+    result is dropped. Raises LLMDeadlineExceeded after `deadline_seconds`.
+    """
+    def __init__(self, primary, fallback=None, deadline_seconds=None, hedge_after_seconds=None):
+        super().__init__(primary.api_key, primary.model_id)
+        self.primary = primary
+        self.fallback = fallback
+        self.provider_name = primary.provider_name
+        self.deadline_seconds = deadline_seconds
+        self.hedge_after_seconds = hedge_after_seconds
+
+    def generation_params(self):
+        return self.primary.generation_params()
+
+    def generate_analysis(self, prompt):
+        return self._race(lambda provider, on_progress: provider.generate_analysis(prompt))
+
+    def generate_analysis_streaming(self, prompt, on_progress=None):
+        return self._race(lambda provider, on_progress: provider.generate_analysis_streaming(prompt, on_progress), on_progress)
+
+    def _race(self, call, on_progress=None):
+        started = time.monotonic()
+        deadline = started + self.deadline_seconds if self.deadline_seconds else None
+        hedge_at = started + self.hedge_after_seconds if self.fallback and self.hedge_after_seconds is not None else None
+        finished = threading.Event()
+        # Only the first call that produces output reports progress, so partial outputs never interleave
+        output_owner = []
+        output_owner_lock = threading.Lock()
+
+        def attempt(provider):
+            def progress(text, output_tokens):
+                if finished.is_set():
+                    raise _Cancelled()
+                with output_owner_lock:
+                    if not output_owner:
+                        output_owner.append(provider)
+                if on_progress and output_owner[0] is provider:
+                    on_progress(text, output_tokens)
+            return call(provider, progress)
+
+        executor = ContextThreadPoolExecutor(max_workers=2)
+        futures = {executor.submit(attempt, self.primary): self.primary}
+        hedged = False
+        errors = []
+        try:
+            while True:
+                now = time.monotonic()
+                if deadline and now >= deadline:
+                    LLM_POLICY_CALLS_TOTAL.inc(hedged=str(hedged).lower(), winner='none')
+                    raise LLMDeadlineExceeded(
+                        f"No response from {self._model_ids(hedged)} within {self.deadline_seconds} seconds."
+                    )
+                if self.fallback and not hedged and (not futures or (hedge_at is not None and now >= hedge_at)):
+                    reason = 'failed' if not futures else f"has not answered after {self.hedge_after_seconds}s"
+                    print(f"Model '{self.primary.model_id}' {reason}; also asking '{self.fallback.model_id}'.")
+                    futures[executor.submit(attempt, self.fallback)] = self.fallback
+                    hedged = True
+                if not futures:
+                    LLM_POLICY_CALLS_TOTAL.inc(hedged=str(hedged).lower(), winner='none')
+                    raise errors[0]
+
+                waits = [moment - now for moment in (deadline, None if hedged else hedge_at) if moment is not None]
+                done, _ = wait(list(futures), timeout=min(waits) if waits else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    provider = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"WARNING: Model '{provider.model_id}' failed: {e}")
+                        errors.append(e)
+                        continue
+                    LLM_POLICY_CALLS_TOTAL.inc(hedged=str(hedged).lower(), winner=provider.model_id)
+                    return result
+        finally:
+            finished.set()
+            executor.shutdown(wait=False)
+
+    def _model_ids(self, hedged):
+        model_ids = [self.primary.model_id] + ([self.fallback.model_id] if hedged else [])
+        return ' or '.join(f"'{model_id}'" for model_id in model_ids)
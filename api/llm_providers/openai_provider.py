@@ -1,17 +1,50 @@
 # api/llm_providers/openai_provider.py
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError
 from .base import BaseLLMProvider
-import json
+from api.resilience import ProviderGuard
+from api import json_codec
 
 class OpenAIProvider(BaseLLMProvider):
+    provider_name = "openai"
+    supports_streaming = True
+
+    def __init__(self, api_key, model_id):
+        super().__init__(api_key, model_id)
+        # One client, and so one connection pool, for the provider's lifetime
+        self.client = OpenAI(api_key=api_key)
+        # Shared rate limit and circuit breaker for this model and API key
+        self.guard = ProviderGuard(self.provider_name, model_id, credential=api_key, transient_errors=(APIConnectionError,))
+
+    def generation_params(self):
+        return {"response_format": {"type": "json_object"}}
+
+    def warm_up(self):
+        # A cheap authenticated call that leaves a TLS connection in the client's pool
+        self.client.with_options(timeout=10, max_retries=0).models.retrieve(self.model_id)
+
     def generate_analysis(self, prompt):
-        client = OpenAI(api_key=self.api_key)
-        response = client.chat.completions.create(
-            model=self.model_id,
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-            # temperature=0.2
-        )
+        with self.guard.call():
+            response = self.client.chat.completions.create(
+                model=self.model_id,
+                messages=[{"role": "user", "content": prompt}],
+                **self.generation_params()
+                # temperature=0.2
+            )
         # OpenAI's JSON mode returns a string that needs to be parsed
-        return json.loads(response.choices[0].message.content)
-    
\ No newline at end of file
+        return json_codec.loads(response.choices[0].message.content)
+
+    def stream_analysis(self, prompt):
+        with self.guard.call():
+            stream = self.client.chat.completions.create(
+                model=self.model_id,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                # The last chunk then carries the token usage of the whole completion
+                stream_options={"include_usage": True},
+                **self.generation_params()
+            )
+            for chunk in stream:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or '', None
+                if chunk.usage:
+                    yield '', chunk.usage.completion_tokens
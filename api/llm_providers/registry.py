@@ -0,0 +1,84 @@
+# api/llm_providers/registry.py
+import hashlib
+import os
+import threading
+from gemini_project.vault_utils import vault_client
+from .gemini_provider import GeminiProvider
+from .openai_provider import OpenAIProvider
+from api.metrics import VAULT_READ_SECONDS
+
+
+def _fingerprint(api_key):
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+
+class ProviderRegistry:
+    """
+    Keeps one LLM provider (and with it one HTTP client and connection pool)
+    per (provider, model_id) for the life of a worker process. The API key is
+    still looked up on every call, which the Vault secret cache serves from
+    memory, and a provider is only rebuilt when its key rotates or config.yaml
+    is reloaded. Providers are dropped after a fork so children never share
+    sockets with their parent.
+    """
+    def __init__(self):
+        self._providers = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, provider_name, model_id, config):
+        api_key = self._read_api_key(provider_name, config)
+        fingerprint = _fingerprint(api_key)
+        key = (provider_name, model_id)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._providers.clear()
+                self._pid = os.getpid()
+            entry = self._providers.get(key)
+            # A reloaded config.yaml is a new dict, so identity tells us whether it changed
+            if entry and entry['fingerprint'] == fingerprint and entry['config'] is config:
+                return entry['provider']
+            if entry:
+                reason = 'its API key rotated' if entry['fingerprint'] != fingerprint else 'config.yaml changed'
+                print(f"Rebuilding LLM provider for {provider_name}/{model_id}: {reason}.")
+            provider = self._build(provider_name, model_id, api_key, config)
+            self._providers[key] = {'provider': provider, 'fingerprint': fingerprint, 'config': config}
+            return provider
+
+    def clear(self):
+        with self._lock:
+            self._providers.clear()
+
+    def _read_api_key(self, provider_name, config):
+        provider_info = config['providers'][provider_name]
+        with VAULT_READ_SECONDS.time(provider=provider_name):
+            return vault_client.get_secret(
+                provider_info['vault_secret_path'],
+                provider_info['api_key_vault_key'],
+                mount_point=provider_info['vault_mount_point'],
+            )
+
+    def _build(self, provider_name, model_id, api_key, config):
+        if provider_name == "google":
+            return GeminiProvider(api_key, model_id, config['api_endpoints']['google_gemini'])
+        if provider_name == "openai":
+            return OpenAIProvider(api_key, model_id)
+        raise ValueError(f"Unknown LLM provider: {provider_name}")
+
+    def warm_up(self, config):
+        """
+        Builds a provider for every configured model whose credentials are set
+        up and opens its connections, so the first task doesn't pay for Vault
+        reads, client construction, DNS or TLS. Failures are only logged.
+        """
+        for model in config.get('ai_models', []):
+            if model['provider'] not in config.get('providers', {}):
+                continue
+            try:
+                self.get(model['provider'], model['id'], config).warm_up()
+            except Exception as e:
+                print(f"WARNING: Could not warm up LLM provider for {model['id']}: {e}")
+
+
+# One registry per worker process
+provider_registry = ProviderRegistry()
@@ -1,9 +1,69 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HTTP_CONFIG = {
+    'pool_connections': 4,
+    'pool_maxsize': 20,
+    'connect_timeout': 10,
+    'read_timeout': 300,
+    'max_retries': 3,
+    'backoff_base': 0.5,
+    'backoff_max': 30,
+}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+def get_http_config():
+    """Returns the 'http' section of config.yaml merged over the defaults."""
+    from api.config_registry import config_section
+    return config_section('http', defaults=DEFAULT_HTTP_CONFIG)
+
+
+def _get_session(url, verify):
+    """
+    Returns the long-lived Session for the URL's origin. Sessions are per
+    process (they are dropped after a fork) so Celery children never share
+    sockets with their parent.
+    """
+    global _sessions_pid
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc, str(verify))
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(key)
+        if session is None:
+            http_config = get_http_config()
+            session = requests.Session()
+            session.verify = verify
+            adapter = HTTPAdapter(
+                pool_connections=http_config['pool_connections'],
+                pool_maxsize=http_config['pool_maxsize'],
+                max_retries=0,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
 
 class RequestsProvider:
     """
     A generic wrapper for the requests library to ensure consistent settings,
-    like SSL verification.
+    like SSL verification, timeouts and retries. All instances share pooled
+    keep-alive sessions, so creating one per task is cheap. The 'http' config
+    is read once, when the provider is created.
     """
     def __init__(self, verify=True):
         """
@@ -12,9 +72,44 @@ class RequestsProvider:
             verify (bool or str): Path to a CA bundle or boolean to enable/disable SSL verification.
         """
         self.verify = verify
+        self.http_config = get_http_config()
 
-    def post(self, url, **kwargs):
-        return requests.post(url, verify=self.verify, **kwargs)
+    def post(self, url, idempotent=False, **kwargs):
+        """
+        Sends a POST. Pass idempotent=True for calls that are safe to repeat
+        (e.g. an LLM generation or a token exchange) to enable retries.
+        """
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
 
     def get(self, url, **kwargs):
-        return requests.get(url, verify=self.verify, **kwargs)
\ No newline at end of file
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        http_config = self.http_config
+        kwargs.setdefault('timeout', (http_config['connect_timeout'], http_config['read_timeout']))
+        session = _get_session(url, self.verify)
+        max_retries = http_config['max_retries'] if idempotent else 0
+
+        for attempt in range(max_retries + 1):
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= max_retries:
+                    raise
+                time.sleep(self._backoff(http_config, attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < max_retries:
+                time.sleep(self._backoff(http_config, attempt, response.headers.get('Retry-After')))
+                response.close()
+                continue
+            return response
+
+    def _backoff(self, http_config, attempt, retry_after=None):
+        """Exponential backoff with full jitter, honouring a numeric Retry-After header."""
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), http_config['backoff_max'])
+        ceiling = min(http_config['backoff_base'] * (2 ** attempt), http_config['backoff_max'])
+        return random.uniform(0, ceiling)
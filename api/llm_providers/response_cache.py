@@ -0,0 +1,83 @@
+# api/llm_providers/response_cache.py
+import hashlib
+import json
+import threading
+from .base import BaseLLMProvider
+from api.caching import build_cache
+from api.config_registry import config_section
+from api import json_codec
+from api.metrics import CACHE_REQUESTS_TOTAL
+
+
+def make_cache_key(provider_name, model_id, prompt, generation_params):
+    """
+    Builds a stable hash of everything that determines an LLM response. The
+    params are serialized with sorted keys so dict ordering never matters.
+    """
+    key_material = json.dumps(
+        {
+            'provider': provider_name,
+            'model': model_id,
+            'prompt': prompt,
+            'params': generation_params,
+        },
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+
+class CachedLLMProvider(BaseLLMProvider):
+    """
+    Wraps another provider and serves repeated, byte-for-byte identical
+    requests from a response cache instead of calling the LLM again.
+    """
+    def __init__(self, provider, cache):
+        super().__init__(provider.api_key, provider.model_id)
+        self.provider = provider
+        self.provider_name = provider.provider_name
+        self.cache = cache
+
+    @property
+    def supports_streaming(self):
+        return self.provider.supports_streaming
+
+    def generation_params(self):
+        return self.provider.generation_params()
+
+    def _cached(self, prompt, generate):
+        key = make_cache_key(self.provider_name, self.model_id, prompt, self.generation_params())
+        cached = self.cache.get(key)
+        CACHE_REQUESTS_TOTAL.inc(cache='llm_responses', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return json_codec.loads(cached)
+
+        result = generate()
+        self.cache.set(key, json_codec.dumps_bytes(result))
+        return result
+
+    def generate_analysis(self, prompt):
+        return self._cached(prompt, lambda: self.provider.generate_analysis(prompt))
+
+    def stream_analysis(self, prompt):
+        return self.provider.stream_analysis(prompt)
+
+    def generate_analysis_streaming(self, prompt, on_progress=None):
+        # Cache hits are returned whole; there is nothing to stream
+        return self._cached(prompt, lambda: self.provider.generate_analysis_streaming(prompt, on_progress))
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(config_data):
+    """Returns the shared response cache, or None when 'caching.llm_responses' is disabled."""
+    global _response_cache
+    cache_config = config_section('caching.llm_responses', config_data)
+    if not cache_config.get('enabled', False):
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = build_cache(cache_config, prefix='docanalyzer:llm:')
+    return _response_cache
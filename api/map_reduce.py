@@ -0,0 +1,119 @@
+# api/map_reduce.py
+"""
+Chunked ("map-reduce") LLM analysis for extracted data that is too large for
+one generate_analysis call. The tables in the data are split into chunks that
+fit a token budget, each chunk is analysed with the document type's normal
+prompt, and a final call merges the partial results into the same schema.
+"""
+import math
+from concurrent.futures import as_completed
+from .metrics import ContextThreadPoolExecutor
+from .prompting import is_table, PromptTooLargeError
+
+SINGLE, MAP_REDUCE = 'single', 'map_reduce'
+LLM_MODES = (SINGLE, MAP_REDUCE)
+
+MAP_PREAMBLE = (
+    "The extracted data below is part {part} of {parts} of one document; its tables only contain "
+    "the rows of this part. Analyse this part on its own and answer in the requested format. "
+    "Only describe what this part contains; the parts are combined afterwards.\n\n"
+)
+REDUCE_PREAMBLE = (
+    "The document was too large to analyse at once, so it was analysed in {parts} parts. The "
+    "'extracted data' below holds the partial analyses, in document order. Merge them into a single "
+    "analysis of the whole document in exactly the requested format: combine lists, remove duplicates, "
+    "and write summaries that cover every part.\n\n"
+)
+
+
+def split_extracted_data(extracted_data, measure, max_tokens):
+    """
+    Splits the table rows of `extracted_data` into chunks whose prompt fits
+    `max_tokens`. `measure(data)` returns the token count of the full prompt
+    for some data. Non-table fields are repeated in every chunk. Returns a
+    single-element list when everything fits, or when there is nothing to split.
+    """
+    if not isinstance(extracted_data, dict) or measure(extracted_data) <= max_tokens:
+        return [extracted_data]
+
+    tables = {name: value for name, value in extracted_data.items() if is_table(value)}
+    total_rows = sum(len(rows) for rows in tables.values())
+    if not total_rows:
+        return [extracted_data]
+    scalars = {name: value for name, value in extracted_data.items() if name not in tables}
+
+    base_tokens = measure(scalars)
+    tokens_per_row = max((measure(extracted_data) - base_tokens) / total_rows, 1e-6)
+    # Leave headroom for rows that are larger than average
+    rows_per_chunk = max(1, math.floor((max_tokens - base_tokens) * 0.9 / tokens_per_row))
+
+    chunks = []
+    current, current_rows = dict(scalars), 0
+    for name, rows in tables.items():
+        start = 0
+        while start < len(rows):
+            take = min(rows_per_chunk - current_rows, len(rows) - start)
+            current[name] = rows[start:start + take]
+            current_rows += take
+            start += take
+            if current_rows >= rows_per_chunk:
+                chunks.append(current)
+                current, current_rows = dict(scalars), 0
+    if current_rows:
+        chunks.append(current)
+    return chunks
+
+
+def _group_for_reduce(partials, measure, max_tokens):
+    """Groups consecutive partial results so that each group's reduce prompt fits `max_tokens`."""
+    groups, current = [], []
+    for partial in partials:
+        if current and measure({'partial_analyses': current + [partial]}) > max_tokens:
+            groups.append(current)
+            current = []
+        current.append(partial)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def map_reduce_analysis(extracted_data, render, generate, measure, chunk_max_tokens, max_parallel=4, on_progress=None):
+    """
+    Analyses the data in chunks of at most `chunk_max_tokens`, `max_parallel`
+    at a time, and merges the partial results in as many rounds as needed.
+    Raises PromptTooLargeError when no two neighbouring partials fit together.
+    """
+    chunks = split_extracted_data(extracted_data, measure, chunk_max_tokens)
+    if len(chunks) == 1:
+        return generate(render(extracted_data, ''))
+
+    print(f"Analysing extracted data in {len(chunks)} parts (up to {max_parallel} at a time).")
+    with ContextThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(chunks)))) as executor:
+        futures = {
+            executor.submit(generate, render(chunk, MAP_PREAMBLE.format(part=index + 1, parts=len(chunks)))): index
+            for index, chunk in enumerate(chunks)
+        }
+        partials = [None] * len(chunks)
+        for done, future in enumerate(as_completed(futures), 1):
+            partials[futures[future]] = future.result()
+            if on_progress:
+                on_progress(done, len(chunks))
+
+        while True:
+            groups = _group_for_reduce(partials, measure, chunk_max_tokens)
+            if len(groups) == 1:
+                return generate(render({'partial_analyses': partials}, REDUCE_PREAMBLE.format(parts=len(partials))))
+            if len(groups) == len(partials):
+                # Another round would send the same partial results again
+                raise PromptTooLargeError(
+                    f"Can't merge {len(partials)} partial analyses: no two neighbouring ones fit in {chunk_max_tokens} tokens."
+                )
+            reduce_futures = [
+                executor.submit(generate, render({'partial_analyses': group}, REDUCE_PREAMBLE.format(parts=len(group))))
+                if len(group) > 1 else None
+                for group in groups
+            ]
+            partials = [
+                future.result() if future else group[0]
+                for future, group in zip(reduce_futures, groups)
+            ]
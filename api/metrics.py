@@ -0,0 +1,292 @@
+# api/metrics.py
+"""
+Prometheus-style metrics, buffered per process and flushed to Redis so the
+/metrics endpoint reports totals across all workers.
+"""
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from celery.signals import task_postrun
+from .caching import get_redis_client
+
+_REDIS_PREFIX = 'docanalyzer:metrics:'
+_FLUSH_INTERVAL_SECONDS = 5
+
+_context_labels = contextvars.ContextVar('metric_context_labels', default={})
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+TOKEN_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.1, 0.25, 0.5, 1)
+
+_registry = {}
+
+
+def set_metric_context(**labels):
+    """
+    Sets default label values (e.g. doc_type_id, model_id) for everything the
+    current task records. Cleared again when the task finishes.
+    """
+    _context_labels.set({**_context_labels.get(), **labels})
+
+
+@task_postrun.connect
+def _clear_metric_context(**kwargs):
+    _context_labels.set({})
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor whose calls keep the metric labels of the thread that submitted them."""
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _label_key(self, labels):
+        context = _context_labels.get()
+        values = [str(labels.get(name, context.get(name, ''))) for name in self.labelnames]
+        return json.dumps(values)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _buffer.add(self.name, self._label_key(labels), amount)
+
+
+class Gauge(_Metric):
+    """A value that is set rather than accumulated; the last writer wins."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        _buffer.put(self.name, self._label_key(labels), value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        label_key = self._label_key(labels)
+        # Buckets are stored non-cumulatively and summed when rendered
+        bucket = next((_format_value(bound) for bound in self.buckets if value <= bound), '+Inf')
+        _buffer.add(self.name, f"{label_key}|bucket|{bucket}", 1)
+        _buffer.add(self.name, f"{label_key}|sum", value)
+        _buffer.add(self.name, f"{label_key}|count", 1)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+def timed(histogram, **labels):
+    """Decorator that records the wrapped function's duration in `histogram`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Buffer:
+    """Collects increments in memory and periodically flushes them to Redis in one pipeline."""
+    def __init__(self):
+        self._increments = {}
+        self._values = {}
+        self._local = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, name, field, amount):
+        with self._lock:
+            key = (name, field)
+            self._increments[key] = self._increments.get(key, 0) + amount
+            self._local[key] = self._local.get(key, 0) + amount
+        self._ensure_flusher()
+
+    def put(self, name, field, value):
+        with self._lock:
+            self._values[(name, field)] = value
+            self._local[(name, field)] = value
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run, daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(_FLUSH_INTERVAL_SECONDS)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            increments, self._increments = self._increments, {}
+            values, self._values = self._values, {}
+        if not increments and not values:
+            return
+        try:
+            pipe = get_redis_client().pipeline(transaction=False)
+            for (name, field), amount in increments.items():
+                pipe.hincrbyfloat(_REDIS_PREFIX + name, field, amount)
+            for (name, field), value in values.items():
+                pipe.hset(_REDIS_PREFIX + name, field, value)
+            pipe.execute()
+        except Exception as e:
+            # Put the increments back so they're retried on the next flush
+            print(f"WARNING: Could not flush metrics to Redis: {e}")
+            with self._lock:
+                for key, amount in increments.items():
+                    self._increments[key] = self._increments.get(key, 0) + amount
+                for key, value in values.items():
+                    self._values.setdefault(key, value)
+
+    def local_snapshot(self, name):
+        with self._lock:
+            return {field: value for (metric_name, field), value in self._local.items() if metric_name == name}
+
+
+_buffer = _Buffer()
+atexit.register(_buffer.flush)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [(name, value) for name, value in zip(labelnames, values) if value != '']
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    value = float(value)
+    if value.is_integer() and not math.isinf(value):
+        return str(int(value))
+    return repr(value)
+
+
+def render_prometheus():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    try:
+        _buffer.flush()
+        client = get_redis_client()
+        pipe = client.pipeline(transaction=False)
+        for name in _registry:
+            pipe.hgetall(_REDIS_PREFIX + name)
+        stored = {
+            name: {field.decode(): float(value) for field, value in raw.items()}
+            for name, raw in zip(_registry, pipe.execute())
+        }
+    except Exception as e:
+        # Without Redis we can only report what this process has seen
+        print(f"WARNING: Could not read metrics from Redis, serving local values: {e}")
+        stored = {name: _buffer.local_snapshot(name) for name in _registry}
+
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        fields = stored.get(name, {})
+        if metric.kind != 'histogram':
+            for label_key, value in sorted(fields.items()):
+                lines.append(f"{name}{_format_labels(metric.labelnames, json.loads(label_key))} {_format_value(value)}")
+            continue
+
+        series = {}
+        for field, value in fields.items():
+            label_key, part = field.split('|', 1)
+            series.setdefault(label_key, {})[part] = value
+        for label_key, parts in sorted(series.items()):
+            values = json.loads(label_key)
+            cumulative = 0
+            for bound in [_format_value(bound) for bound in metric.buckets] + ['+Inf']:
+                cumulative += parts.get(f"bucket|{bound}", 0)
+                labels = _format_labels(metric.labelnames, values, ('le', bound))
+                lines.append(f"{name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(metric.labelnames, values)
+            lines.append(f"{name}_sum{labels} {_format_value(parts.get('sum', 0))}")
+            lines.append(f"{name}_count{labels} {_format_value(parts.get('count', 0))}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- Pipeline metrics ---
+STAGE_LABELS = ('doc_type_id', 'model_id')
+
+ANALYSES_TOTAL = Counter(
+    'docanalyzer_analyses_total', 'Finished analyses by outcome.', STAGE_LABELS + ('outcome',))
+ABBYY_REQUEST_SECONDS = Histogram(
+    'docanalyzer_abbyy_request_seconds', 'Duration of ABBYY API calls.', STAGE_LABELS + ('operation',))
+ABBYY_PROCESSING_SECONDS = Histogram(
+    'docanalyzer_abbyy_processing_seconds', 'Time from starting an ABBYY transaction until it was processed.',
+    STAGE_LABELS)
+ABBYY_POLL_ATTEMPTS = Histogram(
+    'docanalyzer_abbyy_poll_attempts', 'Status checks needed per ABBYY transaction.', STAGE_LABELS,
+    buckets=COUNT_BUCKETS)
+UPLOAD_BYTES = Histogram(
+    'docanalyzer_upload_bytes', 'Size of documents uploaded to ABBYY.', STAGE_LABELS, buckets=SIZE_BUCKETS)
+ABBYY_RESULT_BYTES = Histogram(
+    'docanalyzer_abbyy_result_bytes', 'Size of downloaded ABBYY result payloads.', STAGE_LABELS,
+    buckets=SIZE_BUCKETS)
+PARSE_SECONDS = Histogram(
+    'docanalyzer_parse_seconds', 'Duration of extracting ABBYY results, including the streamed download.', STAGE_LABELS)
+PROMPT_RENDER_SECONDS = Histogram(
+    'docanalyzer_prompt_render_seconds', 'Duration of rendering prompt templates.', STAGE_LABELS)
+PROMPT_CHARS = Histogram(
+    'docanalyzer_prompt_chars', 'Size of rendered prompts in characters.', STAGE_LABELS, buckets=SIZE_BUCKETS)
+PROMPT_TOKENS = Histogram(
+    'docanalyzer_prompt_tokens', 'Prompt size in (counted or estimated) tokens, by data encoding.',
+    STAGE_LABELS + ('encoding',), buckets=SIZE_BUCKETS)
+LLM_REQUEST_SECONDS = Histogram(
+    'docanalyzer_llm_request_seconds', 'Duration of generate_analysis calls.', STAGE_LABELS + ('provider',))
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    'docanalyzer_llm_time_to_first_token_seconds', 'Time from sending a streamed LLM request to its first token.',
+    STAGE_LABELS + ('provider',))
+LLM_SECONDS_PER_OUTPUT_TOKEN = Histogram(
+    'docanalyzer_llm_seconds_per_output_token', 'Average time per generated token after the first, per streamed call.',
+    STAGE_LABELS + ('provider',), buckets=TOKEN_LATENCY_BUCKETS)
+LLM_POLICY_CALLS_TOTAL = Counter(
+    'docanalyzer_llm_policy_calls_total',
+    'LLM calls under an execution policy, by whether the fallback model was asked and which model answered.',
+    STAGE_LABELS + ('hedged', 'winner'))
+THROTTLE_WAIT_SECONDS = Histogram(
+    'docanalyzer_throttle_wait_seconds', 'Time calls waited for a shared rate-limit token.', STAGE_LABELS + ('provider',))
+PROVIDER_REFUSALS_TOTAL = Counter(
+    'docanalyzer_provider_refusals_total', 'Calls refused (and requeued) because of a rate limit, an open circuit or a transient upstream error.',
+    STAGE_LABELS + ('provider', 'reason'))
+CIRCUIT_STATE = Gauge(
+    'docanalyzer_circuit_state', 'Circuit breaker state per provider and model (0 closed, 1 half-open, 2 open).',
+    ('breaker',))
+VAULT_READ_SECONDS = Histogram(
+    'docanalyzer_vault_read_seconds', 'Duration of reading provider credentials from Vault.', ('provider',))
+CACHE_REQUESTS_TOTAL = Counter(
+    'docanalyzer_cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
@@ -0,0 +1,65 @@
+# api/multipart.py
+import os
+import time
+import uuid
+from urllib3.fields import format_multipart_header_param
+
+
+class StreamingMultipartEncoder:
+    """
+    A multipart/form-data body for one file, read from disk in chunks while it
+    is sent. Iterating again starts over, so a request can be retried.
+    """
+    def __init__(self, field_name, file_obj, file_name, content_type, chunk_size=1024 * 1024):
+        self.file_obj = file_obj
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+        disposition = (
+            f"form-data; {format_multipart_header_param('name', field_name)}; "
+            f"{format_multipart_header_param('filename', file_name)}"
+        )
+        # Like requests, the part has no Content-Type when none is known
+        self._preamble = (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: {disposition}\r\n"
+            + (f"Content-Type: {content_type}\r\n" if content_type else "")
+            + "\r\n"
+        ).encode('utf-8')
+        self._epilogue = f"\r\n--{self.boundary}--\r\n".encode('utf-8')
+        self.file_size = os.fstat(file_obj.fileno()).st_size
+
+        self.bytes_sent = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def __len__(self):
+        return len(self._preamble) + self.file_size + len(self._epilogue)
+
+    def __iter__(self):
+        self.file_obj.seek(0)
+        self.bytes_sent = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+        yield self._preamble
+        while True:
+            chunk = self.file_obj.read(self.chunk_size)
+            if not chunk:
+                break
+            self.bytes_sent += len(chunk)
+            yield chunk
+        yield self._epilogue
+        self.finished_at = time.monotonic()
+
+    def stats(self):
+        """Returns the size, duration and throughput of the last complete upload."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        seconds = max(self.finished_at - self.started_at, 1e-6)
+        return {
+            'bytes': self.bytes_sent,
+            'seconds': seconds,
+            'bytes_per_second': self.bytes_sent / seconds,
+        }
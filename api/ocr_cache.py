@@ -0,0 +1,132 @@
+# api/ocr_cache.py
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from .config_registry import config_section
+from .metrics import CACHE_REQUESTS_TOTAL
+from . import json_codec
+
+
+def content_digest(file_content):
+    """Returns the SHA-256 hex digest of the raw file bytes."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+class OcrResultCache:
+    """
+    Parsed ABBYY results on disk, keyed by the file's SHA-256, the skill id and
+    the field spec. Entries expire `ttl_seconds` after they were written; hits
+    only move a file's atime, which orders LRU eviction.
+    """
+    def __init__(self, directory, ttl_seconds=7 * 24 * 3600, max_entries=500,
+                 max_bytes=256 * 1024 * 1024, store_raw=False):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store_raw = store_raw
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_digest, skill_id, extractor_digest=''):
+        # Entries depend on the fields we extract, so a changed abbyy_fields spec misses the cache
+        return hashlib.sha256(f"{skill_id}:{extractor_digest}:{file_digest}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key):
+        """Returns the cached entry dict, or None on a miss or expired entry."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                written_at = os.fstat(f.fileno()).st_mtime
+                entry = json_codec.loads(f.read())
+            if time.time() - entry.get('created_at', written_at) > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                raise FileNotFoundError(path)
+            # Bump only the access time, so eviction is least-recently-used but expiry isn't extended
+            os.utime(path, (time.time(), written_at))
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            CACHE_REQUESTS_TOTAL.inc(cache='ocr_results', result='miss')
+            return None
+        with self._lock:
+            self.hits += 1
+        CACHE_REQUESTS_TOTAL.inc(cache='ocr_results', result='hit')
+        return entry
+
+    def set(self, key, extracted_data, raw_data=None):
+        entry = {'created_at': time.time(), 'extracted_data': extracted_data}
+        if self.store_raw and raw_data is not None:
+            entry['raw'] = raw_data
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(json_codec.dumps_bytes(entry))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def delete(self, key):
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        now = time.time()
+        entries = []
+        for path in self.directory.glob('*/*.json'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_ocr_cache = None
+_ocr_cache_lock = threading.Lock()
+
+
+def get_ocr_cache(config_data):
+    """Returns the shared OcrResultCache, or None when 'caching.ocr_results' is disabled."""
+    global _ocr_cache
+    cache_config = config_section('caching.ocr_results', config_data)
+    if not cache_config.get('enabled', False):
+        return None
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            directory = Path(settings.BASE_DIR) / cache_config.get('directory', 'cache/ocr')
+            _ocr_cache = OcrResultCache(
+                directory,
+                ttl_seconds=cache_config.get('ttl_seconds', 7 * 24 * 3600),
+                max_entries=cache_config.get('max_entries', 500),
+                max_bytes=cache_config.get('max_bytes', 256 * 1024 * 1024),
+                store_raw=cache_config.get('store_raw', False),
+            )
+    return _ocr_cache
@@ -0,0 +1,20 @@
+# api/parsers.py
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser, get_encoding
+from . import json_codec
+from .renderers import FastJSONRenderer
+
+
+class FastJSONParser(JSONParser):
+    """DRF's JSONParser on top of api.json_codec."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = get_encoding(parser_context or {})
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '').replace('_', '') != 'utf8':
+                data = data.decode(encoding)
+            return json_codec.loads(data)
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
@@ -1,35 +1,145 @@
 # api/permissions.py
+import hashlib
+import threading
 from rest_framework.permissions import BasePermission
 from gemini_project.vault_utils import vault_client
 import hvac.exceptions # Import the hvac exceptions module
+from .caching import LocalLRUCache, RedisCache
+from .config_registry import config_section
+
+_VALID = b'1'
+_REJECTED = b'0'
+
+
+class TokenValidationCache:
+    """
+    Remembers the outcome of Vault token lookups, keyed by a SHA-256 of the
+    token so raw tokens are never stored. Valid tokens are cached until their
+    own Vault TTL runs out (capped by `max_ttl_seconds`); rejected tokens are
+    cached for `negative_ttl_seconds`. A per-process LRU answers the hot path,
+    and an optional Redis tier lets every gunicorn worker share lookups.
+    Valid tokens are cached with the caller's identity.
+    """
+    def __init__(self, max_ttl_seconds=300, negative_ttl_seconds=30, shared_cache=None):
+        self.max_ttl_seconds = max_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.local_cache = LocalLRUCache(ttl_seconds=max_ttl_seconds, max_bytes=1024 * 1024)
+        self.shared_cache = shared_cache
+
+    @staticmethod
+    def make_key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns (True, identity) or (False, None) for a cached outcome, or None when unknown."""
+        value = self.local_cache.get(key)
+        if value is None and self.shared_cache is not None:
+            value = self.shared_cache.get(key)
+            if value is not None:
+                # The shared tier can't tell us the remaining TTL, so keep the local copy short
+                self.local_cache.set(key, value, ttl_seconds=self.negative_ttl_seconds)
+        if value is None:
+            return None
+        if value[:1] != _VALID:
+            return False, None
+        return True, value[1:].decode('utf-8') or None
+
+    def set_valid(self, key, token_ttl, identity=None):
+        # A ttl of 0 means the token never expires (e.g. root tokens)
+        ttl_seconds = min(token_ttl, self.max_ttl_seconds) if token_ttl else self.max_ttl_seconds
+        self._set(key, _VALID + (identity or '').encode('utf-8'), ttl_seconds)
+
+    def set_rejected(self, key):
+        self._set(key, _REJECTED, self.negative_ttl_seconds)
+
+    def _set(self, key, value, ttl_seconds):
+        if ttl_seconds <= 0:
+            return
+        self.local_cache.set(key, value, ttl_seconds=ttl_seconds)
+        if self.shared_cache is not None:
+            self.shared_cache.set(key, value, ttl_seconds=ttl_seconds)
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Returns the shared TokenValidationCache, or None when token caching is disabled."""
+    global _token_cache
+    cache_config = config_section('caching.token_validation')
+    if not cache_config.get('enabled', False):
+        return None
+    with _token_cache_lock:
+        if _token_cache is None:
+            max_ttl_seconds = cache_config.get('max_ttl_seconds', 300)
+            shared_cache = None
+            if cache_config.get('backend', 'local') == 'redis':
+                shared_cache = RedisCache(
+                    'docanalyzer:vault-token:',
+                    ttl_seconds=max_ttl_seconds,
+                    max_bytes=1024,
+                    url=cache_config.get('redis_url'),
+                )
+            _token_cache = TokenValidationCache(
+                max_ttl_seconds=max_ttl_seconds,
+                negative_ttl_seconds=cache_config.get('negative_ttl_seconds', 30),
+                shared_cache=shared_cache,
+            )
+    return _token_cache
+
+
+def _identity(lookup_data, cache_key):
+    """The caller behind a token: its Vault entity, else its display name, else the token itself (hashed)."""
+    return lookup_data.get('entity_id') or lookup_data.get('display_name') or f"token-{cache_key[:16]}"
+
 
 class IsVaultAuthenticated(BasePermission):
     """
-    Checks if the request includes a valid Vault token in the header.
+    Checks if the request includes a valid Vault token in the header. On
+    success the caller's identity is set as `request.vault_identity`, which
+    the scheduler uses for per-caller priorities and fair share.
     """
     def has_permission(self, request, view):
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
             return False
-            
+
         token = auth_header.split(' ')[1]
         if not token:
             return False
-            
+
+        # Task-status polling hits this on every tick; answer from the cache when we can
+        token_cache = get_token_cache()
+        cache_key = TokenValidationCache.make_key(token)
+        if token_cache:
+            cached = token_cache.get(cache_key)
+            if cached is not None:
+                valid, identity = cached
+                request.vault_identity = identity or f"token-{cache_key[:16]}"
+                return valid
+
         try:
             # --- CORRECTED LOGIC ---
             # The validation is simple: if the lookup API call succeeds, the token is valid.
             # If the token were invalid, the hvac library would raise an exception.
-            vault_client.client.auth.token.lookup(token)
-            
+            lookup = vault_client.client.auth.token.lookup(token)
+
             # If we reach this line, it means no exception was raised, so the token is good.
+            lookup_data = lookup.get('data', {})
+            request.vault_identity = _identity(lookup_data, cache_key)
+            if token_cache:
+                token_cache.set_valid(cache_key, lookup_data.get('ttl') or 0, request.vault_identity)
             return True
 
-        except hvac.exceptions.InvalidRequest:
+        except (hvac.exceptions.InvalidRequest, hvac.exceptions.Forbidden):
             # This exception is typically raised for invalid or expired tokens.
             print("--- DEBUG: Vault rejected the token as invalid. ---")
+            if token_cache:
+                token_cache.set_rejected(cache_key)
             return False
         except Exception as e:
             # This will catch other errors, like network issues.
+            # Nothing is cached here so the next request retries the lookup.
             print(f"--- DEBUG: An unexpected error occurred during token lookup: {e} ---")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,161 @@
+# api/prompting.py
+import math
+import threading
+from . import json_codec
+
+# How extracted data is serialized into the prompt
+PRETTY, COMPACT, TABULAR = 'pretty', 'compact', 'tabular'
+ENCODINGS = (PRETTY, COMPACT, TABULAR)
+
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+_tiktoken_encodings = {}
+_tiktoken_lock = threading.Lock()
+
+
+class PromptTooLargeError(ValueError):
+    """Raised when even the most compact, truncated prompt exceeds the model's token budget."""
+
+
+def is_table(value):
+    """True for a list of row dicts, e.g. techSpecs."""
+    return isinstance(value, list) and value and all(isinstance(row, dict) for row in value)
+
+
+def to_tabular(extracted_data):
+    """
+    Rewrites every list of row dicts (e.g. techSpecs) as {"columns": [...],
+    "rows": [[...], ...]}, so column names appear once instead of once per row.
+    The result is still JSON, so templates with a ```json fence keep working.
+    """
+    if not isinstance(extracted_data, dict):
+        return extracted_data
+    encoded = {}
+    for name, value in extracted_data.items():
+        if is_table(value):
+            columns = []
+            for row in value:
+                columns.extend(column for column in row if column not in columns)
+            encoded[name] = {'columns': columns, 'rows': [[row.get(column) for column in columns] for row in value]}
+        else:
+            encoded[name] = value
+    return encoded
+
+
+def encode_extracted_data(extracted_data, encoding=COMPACT):
+    if encoding == PRETTY:
+        return json_codec.dumps(extracted_data, pretty=True)
+    if encoding == COMPACT:
+        return json_codec.dumps(extracted_data)
+    if encoding == TABULAR:
+        return json_codec.dumps(to_tabular(extracted_data))
+    raise ValueError(f"Unknown prompt encoding: {encoding}")
+
+
+def _tiktoken_encoding(model_id):
+    with _tiktoken_lock:
+        if model_id not in _tiktoken_encodings:
+            import tiktoken
+            try:
+                _tiktoken_encodings[model_id] = tiktoken.encoding_for_model(model_id)
+            except KeyError:
+                _tiktoken_encodings[model_id] = tiktoken.get_encoding('o200k_base')
+        return _tiktoken_encodings[model_id]
+
+
+def count_tokens(text, model_config):
+    """
+    Counts prompt tokens for a model. Models with `tokenizer: tiktoken` are
+    counted exactly when tiktoken is installed; everything else (including
+    Gemini, which has no offline tokenizer) is estimated from the character
+    count using the model's `chars_per_token`.
+    """
+    if model_config.get('tokenizer') == 'tiktoken':
+        try:
+            return len(_tiktoken_encoding(model_config['id']).encode(text))
+        except ImportError:
+            pass
+    chars_per_token = model_config.get('chars_per_token', DEFAULT_CHARS_PER_TOKEN)
+    return math.ceil(len(text) / chars_per_token)
+
+
+def prompt_tokens(template, extracted_data, manual_rag_text, model_config, encoding=COMPACT):
+    """Token count of the full prompt for `extracted_data`, without any budgeting."""
+    prompt = template.format(extracted_data=encode_extracted_data(extracted_data, encoding), manual_rag_text=manual_rag_text)
+    return count_tokens(prompt, model_config)
+
+
+def _truncate_tables(extracted_data, fraction):
+    """Keeps the first `fraction` of every table's rows and notes what was dropped."""
+    truncated = {}
+    notes = {}
+    for name, value in extracted_data.items():
+        if is_table(value):
+            keep = int(len(value) * fraction)
+            truncated[name] = value[:keep]
+            if keep < len(value):
+                notes[name] = f"showing the first {keep} of {len(value)} rows"
+        else:
+            truncated[name] = value
+    if notes:
+        truncated['_truncated'] = notes
+    return truncated
+
+
+def render_prompt(template, extracted_data, manual_rag_text, model_config, encoding=COMPACT, measure_baseline=True):
+    """
+    Renders a prompt template within the model's `max_prompt_tokens` budget.
+
+    The data is serialized with the requested encoding. If that is over budget,
+    the tabular encoding is tried, and then table rows are dropped from the
+    end until the prompt fits. Returns (prompt, stats). With `measure_baseline`
+    the stats also hold the size the old pretty-printed prompt would have had,
+    which costs one extra render.
+    """
+    budget = model_config.get('max_prompt_tokens')
+
+    def render(data, data_encoding):
+        prompt = template.format(extracted_data=encode_extracted_data(data, data_encoding), manual_rag_text=manual_rag_text)
+        return prompt, count_tokens(prompt, model_config)
+
+    prompt, tokens = render(extracted_data, encoding)
+    baseline = (len(prompt), tokens) if encoding == PRETTY else None
+    if measure_baseline and baseline is None:
+        baseline_prompt, baseline_tokens = render(extracted_data, PRETTY)
+        baseline = (len(baseline_prompt), baseline_tokens)
+        del baseline_prompt
+    truncated = False
+
+    if budget and tokens > budget and encoding != TABULAR and isinstance(extracted_data, dict):
+        encoding = TABULAR
+        prompt, tokens = render(extracted_data, encoding)
+
+    if budget and tokens > budget and isinstance(extracted_data, dict):
+        # Binary search for the largest share of table rows that fits
+        low, high, best = 0.0, 1.0, None
+        for _ in range(12):
+            fraction = (low + high) / 2
+            candidate, candidate_tokens = render(_truncate_tables(extracted_data, fraction), encoding)
+            if candidate_tokens <= budget:
+                best, low = (candidate, candidate_tokens), fraction
+            else:
+                high = fraction
+        if best is None:
+            best = render(_truncate_tables(extracted_data, 0.0), encoding)
+        prompt, tokens = best
+        truncated = True
+
+    if budget and tokens > budget:
+        raise PromptTooLargeError(
+            f"Prompt needs {tokens} tokens, more than the {budget} allowed for model '{model_config['id']}'."
+        )
+
+    stats = {
+        'encoding': encoding,
+        'chars': len(prompt),
+        'tokens': tokens,
+        'baseline_chars': baseline[0] if baseline else None,
+        'baseline_tokens': baseline[1] if baseline else None,
+        'truncated': truncated,
+    }
+    return prompt, stats
@@ -0,0 +1,20 @@
+# api/renderers.py
+from rest_framework.renderers import JSONRenderer
+from . import json_codec
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    DRF's JSONRenderer on top of api.json_codec. Compact responses (the
+    default) go through the codec; indented ones, e.g. for the browsable API
+    or 'Accept: application/json; indent=4', still use the json module.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = json_codec.dumps_bytes(data, default=self.encoder_class().default)
+        # Like JSONRenderer, escape U+2028/U+2029 so the output is also valid JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,225 @@
+# api/resilience.py
+"""
+Rate limits and circuit breakers for the upstream APIs, kept in Redis so all
+workers back off together. Configured in the 'resilience' section of config.yaml.
+"""
+import contextlib
+import email.utils
+import hashlib
+import time
+import requests
+from .caching import get_redis_client
+from .llm_providers.requests_provider import RETRY_STATUS_CODES
+from . import metrics
+
+_PREFIX = 'docanalyzer:resilience:'
+
+DEFAULT_LIMITS = {
+    'requests_per_second': None,    # No rate limit
+    'burst': 1,
+    'failure_threshold': 5,
+    'failure_window_seconds': 60,
+    'open_seconds': 30,
+}
+DEFAULT_MAX_WAIT_SECONDS = 10
+# A half-open circuit lets one probe call through; others retry after this
+PROBE_RETRY_SECONDS = 5
+PROBE_TIMEOUT_SECONDS = 300
+
+# Errors that mean the provider is unreachable or overloaded (rather than that the request was bad)
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+# Takes one token from a bucket refilled at ARGV[1] tokens/s up to ARGV[2]. If the
+# token is available within ARGV[3] seconds it is reserved and the wait returned,
+# otherwise nothing is taken. Uses the Redis clock so all hosts agree.
+_TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst, max_wait = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens < 1 then
+  wait = (1 - tokens) / rate
+end
+if wait > max_wait then
+  return {0, tostring(wait)}
+end
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+return {1, tostring(wait)}
+"""
+
+_CLOSED, _HALF_OPEN, _OPEN = 0, 1, 2
+
+
+class ProviderUnavailable(Exception):
+    """
+    Raised when a provider is throttled, its circuit is open or it failed
+    transiently; the task requeues itself after `retry_after` seconds.
+    """
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_resilience_config():
+    """Returns the 'resilience' section of config.yaml."""
+    from api.config_registry import config_section
+    return config_section('resilience')
+
+
+def _status_code(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(error, 'status_code', None)
+
+
+def _retry_after(error):
+    """Returns the seconds asked for by a response's Retry-After header, or None."""
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'headers', None) and response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def _fingerprint(credential):
+    if not credential:
+        return '-'
+    return hashlib.sha256(credential.encode('utf-8')).hexdigest()[:12]
+
+
+class ProviderGuard:
+    """
+    Rate limit and circuit breaker for one provider, model and credential;
+    wrap each request in `with guard.call():`. After `failure_threshold`
+    transient failures the circuit opens for `open_seconds`, then one probe
+    call decides whether it closes. Without Redis calls go through unguarded.
+    """
+    def __init__(self, provider, model_id=None, credential=None, transient_errors=()):
+        resilience_config = get_resilience_config()
+        self.enabled = resilience_config.get('enabled', True)
+        self.max_wait_seconds = resilience_config.get('max_wait_seconds', DEFAULT_MAX_WAIT_SECONDS)
+        self.limits = {**DEFAULT_LIMITS, **resilience_config.get('providers', {}).get(provider, {})}
+        self.redis_url = resilience_config.get('redis_url')
+        self.provider = provider
+        # Used in logs and metric labels; the credential's fingerprint only goes into the Redis keys
+        self.name = f"{provider}:{model_id or '-'}"
+        self._key_prefix = f"{_PREFIX}{self.name}:{_fingerprint(credential)}:"
+        self.transient_errors = TRANSIENT_ERRORS + tuple(transient_errors)
+
+    def _key(self, suffix):
+        return f"{self._key_prefix}{suffix}"
+
+    @contextlib.contextmanager
+    def call(self):
+        if not self.enabled:
+            yield
+            return
+        probing = self._before_call()
+        try:
+            yield
+        except GeneratorExit:
+            # A streamed response whose reader stopped early (e.g. the losing
+            # call of a hedged pair); the provider was answering
+            if probing:
+                self._record_success()
+            raise
+        except Exception as e:
+            if isinstance(e, self.transient_errors) or _status_code(e) in RETRY_STATUS_CODES:
+                self._record_failure(probing)
+                retry_after = _retry_after(e) or self.limits['open_seconds']
+                self._refuse('upstream_error', retry_after, f"{self.name} failed with a transient error: {e}")
+            if probing:
+                # The provider answered; a rejected request is not an outage
+                self._record_success()
+            raise
+        except BaseException:
+            # Interrupted (e.g. worker shutdown); let the next call probe instead
+            if probing:
+                self._release_probe()
+            raise
+        else:
+            if probing:
+                self._record_success()
+
+    def _refuse(self, reason, retry_after, message):
+        metrics.PROVIDER_REFUSALS_TOTAL.inc(provider=self.provider, reason=reason)
+        raise ProviderUnavailable(message, max(retry_after, 1))
+
+    def _before_call(self):
+        """Checks the breaker and takes a rate-limit token, waiting for it if allowed. Returns whether this call is the probe."""
+        try:
+            client = get_redis_client(self.redis_url)
+            open_ms = client.pttl(self._key('open'))
+            if open_ms and open_ms > 0:
+                self._refuse('circuit_open', open_ms / 1000, f"Circuit for {self.name} is open after repeated failures.")
+
+            probing = False
+            if client.exists(self._key('tripped')):
+                if not client.set(self._key('probe'), 1, nx=True, ex=PROBE_TIMEOUT_SECONDS):
+                    self._refuse('circuit_open', PROBE_RETRY_SECONDS, f"Circuit for {self.name} is half-open; a probe call is in flight.")
+                probing = True
+                metrics.CIRCUIT_STATE.set(_HALF_OPEN, breaker=self.name)
+
+            rate = self.limits['requests_per_second']
+            if rate:
+                granted, wait = client.eval(
+                    _TOKEN_BUCKET_SCRIPT, 1, self._key('bucket'), rate, self.limits['burst'], self.max_wait_seconds,
+                )
+                wait = float(wait)
+                if not int(granted):
+                    if probing:
+                        client.delete(self._key('probe'))
+                    self._refuse('throttled', wait, f"Rate limit for {self.name} reached; next slot in {wait:.1f}s.")
+                metrics.THROTTLE_WAIT_SECONDS.observe(wait, provider=self.provider)
+                if wait > 0:
+                    time.sleep(wait)
+            return probing
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            print(f"WARNING: Rate limiter unavailable for {self.name}, calling unguarded: {e}")
+            return False
+
+    def _record_failure(self, probing):
+        try:
+            client = get_redis_client(self.redis_url)
+            failures = client.incr(self._key('failures'))
+            if failures == 1:
+                client.expire(self._key('failures'), self.limits['failure_window_seconds'])
+            if probing or failures >= self.limits['failure_threshold']:
+                open_seconds = self.limits['open_seconds']
+                pipe = client.pipeline()
+                pipe.set(self._key('open'), 1, px=int(open_seconds * 1000))
+                pipe.set(self._key('tripped'), 1, ex=int(open_seconds) + PROBE_TIMEOUT_SECONDS)
+                pipe.delete(self._key('failures'), self._key('probe'))
+                pipe.execute()
+                metrics.CIRCUIT_STATE.set(_OPEN, breaker=self.name)
+                print(f"WARNING: Circuit for {self.name} opened for {open_seconds}s.")
+        except Exception as e:
+            print(f"WARNING: Could not record failure for {self.name}: {e}")
+
+    def _release_probe(self):
+        try:
+            get_redis_client(self.redis_url).delete(self._key('probe'))
+        except Exception as e:
+            print(f"WARNING: Could not release the probe of {self.name}: {e}")
+
+    def _record_success(self):
+        try:
+            get_redis_client(self.redis_url).delete(self._key('tripped'), self._key('probe'), self._key('failures'))
+            metrics.CIRCUIT_STATE.set(_CLOSED, breaker=self.name)
+            print(f"Circuit for {self.name} closed again.")
+        except Exception as e:
+            print(f"WARNING: Could not close circuit for {self.name}: {e}")
@@ -0,0 +1,182 @@
+# api/result_store.py
+import threading
+import time
+import zlib
+from celery.result import AsyncResult
+from .caching import LocalLRUCache, get_redis_client
+from .config_registry import config_section
+from . import json_codec
+
+# Task states after which neither the status nor the result changes again
+_FINAL_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+
+# Final states the Celery result backend can reach without the task publishing
+# them itself (worker killed, hard time limit, revoked before it ran, ...)
+_BACKEND_ONLY_STATES = ('FAILURE', 'REVOKED')
+
+# One-byte markers in front of stored results
+_RAW, _ZLIB = b'j', b'z'
+
+
+class TaskResultStore:
+    """
+    Keeps each task's latest state in a small Redis record and its final
+    result in a separate, compressed one, so a status check is one small read.
+    Finished tasks are also cached in process. Records expire after `retention_seconds`.
+    """
+    def __init__(self, retention_seconds=7 * 24 * 3600, compress_min_bytes=1024, local_max_bytes=32 * 1024 * 1024,
+                 backend_check_seconds=120):
+        self.retention_seconds = retention_seconds
+        self.compress_min_bytes = compress_min_bytes
+        self.backend_check_seconds = backend_check_seconds
+        self.local_cache = LocalLRUCache(ttl_seconds=min(retention_seconds, 3600), max_bytes=local_max_bytes)
+
+    @property
+    def client(self):
+        return get_redis_client()
+
+    def _state_key(self, task_id):
+        return f"docanalyzer:task-state:{task_id}"
+
+    def _result_key(self, task_id):
+        return f"docanalyzer:task-result:{task_id}"
+
+    def encode_result(self, result):
+        data = json_codec.dumps_bytes(result)
+        if len(data) < self.compress_min_bytes:
+            return _RAW + data
+        return _ZLIB + zlib.compress(data, 6)
+
+    @staticmethod
+    def decode_result(raw):
+        if raw[:1] == _ZLIB:
+            return json_codec.loads(zlib.decompress(raw[1:]))
+        return json_codec.loads(raw[1:])
+
+    def save(self, task_id, event):
+        """
+        Stores a task event (as published by task_events). A 'result' is split
+        off into its own compressed record; the state record only notes that
+        one exists.
+        """
+        state = {key: value for key, value in event.items() if key != 'result'}
+        pipe = self.client.pipeline()
+        if 'result' in event:
+            state['has_result'] = True
+            pipe.set(self._result_key(task_id), self.encode_result(event['result']), ex=self.retention_seconds)
+        pipe.set(self._state_key(task_id), json_codec.dumps_bytes(state), ex=self.retention_seconds)
+        pipe.execute()
+
+    def get_state(self, task_id):
+        """Returns the task's compact state dict (no result), or None if nothing is stored."""
+        cached = self.local_cache.get(self._state_key(task_id))
+        if cached is not None:
+            return json_codec.loads(cached)
+        raw = self.client.get(self._state_key(task_id))
+        if raw is None:
+            return None
+        state = json_codec.loads(raw)
+        if state.get('status') in _FINAL_STATES:
+            self.local_cache.set(self._state_key(task_id), raw)
+        return state
+
+    def get_result(self, task_id):
+        cached = self.local_cache.get(self._result_key(task_id))
+        if cached is None:
+            cached = self.client.get(self._result_key(task_id))
+            if cached is None:
+                return None
+            self.local_cache.set(self._result_key(task_id), cached)
+        return self.decode_result(cached)
+
+    def get(self, task_id, include_result=True):
+        """
+        Returns the task's latest event, with its result when `include_result`
+        is set. Unknown tasks, and tasks silent for `backend_check_seconds`
+        (e.g. a killed worker), are checked in the Celery result backend.
+        """
+        try:
+            state = self.get_state(task_id)
+        except Exception as e:
+            print(f"WARNING: Could not read task state for {task_id}: {e}")
+            return self._from_backend(task_id)
+
+        if state is None:
+            event = self._from_backend(task_id)
+            if event['status'] in _FINAL_STATES:
+                try:
+                    self.save(task_id, event)
+                except Exception as e:
+                    print(f"WARNING: Could not store task state for {task_id}: {e}")
+            if not include_result:
+                event.pop('result', None)
+            return event
+
+        if state.get('status') not in _FINAL_STATES and self._backend_check_due(task_id, state):
+            state = self._check_backend(task_id, state)
+
+        if include_result and state.pop('has_result', False):
+            try:
+                state['result'] = self.get_result(task_id)
+            except Exception as e:
+                print(f"WARNING: Could not read task result for {task_id}: {e}")
+                return self._from_backend(task_id)
+        else:
+            state.pop('has_result', None)
+        return state
+
+    def _backend_check_due(self, task_id, state):
+        if time.time() - state.get('timestamp', 0) < self.backend_check_seconds:
+            return False
+        # Once per interval per task in this process, however often it is polled
+        marker = f"docanalyzer:task-backend-check:{task_id}"
+        if self.local_cache.get(marker) is not None:
+            return False
+        self.local_cache.set(marker, b'1', ttl_seconds=self.backend_check_seconds)
+        return True
+
+    def _check_backend(self, task_id, state):
+        """Returns the backend's event instead of `state` if the backend knows the task has died."""
+        try:
+            event = self._from_backend(task_id)
+        except Exception as e:
+            print(f"WARNING: Could not check task {task_id} in the result backend: {e}")
+            return state
+        if event['status'] not in _BACKEND_ONLY_STATES:
+            return state
+        try:
+            self.save(task_id, event)
+        except Exception as e:
+            print(f"WARNING: Could not store task state for {task_id}: {e}")
+        return {key: value for key, value in event.items() if key != 'result'}
+
+    @staticmethod
+    def _from_backend(task_id):
+        task_result = AsyncResult(task_id)
+        event = {'task_id': task_id, 'status': task_result.status, 'timestamp': time.time()}
+        if task_result.status in _BACKEND_ONLY_STATES:
+            event['error'] = task_result.info if isinstance(task_result.info, dict) else str(task_result.info)
+        elif task_result.successful():
+            event['result'] = task_result.result
+        elif isinstance(task_result.info, dict):
+            event['info'] = task_result.info
+        return event
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store(config_data):
+    """Returns the TaskResultStore, created on first use."""
+    global _result_store
+    store_config = config_section('result_store', config_data)
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = TaskResultStore(
+                retention_seconds=store_config.get('retention_seconds', 7 * 24 * 3600),
+                compress_min_bytes=store_config.get('compress_min_bytes', 1024),
+                local_max_bytes=store_config.get('local_max_bytes', 32 * 1024 * 1024),
+                backend_check_seconds=store_config.get('backend_check_seconds', 120),
+            )
+    return _result_store
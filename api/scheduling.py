@@ -0,0 +1,147 @@
+# api/scheduling.py
+"""
+Priorities and per-caller fairness for the stage queues (ingest, ocr, parse,
+llm; see CELERY_TASK_ROUTES). Caller state lives in Redis and fails open.
+"""
+import time
+from .caching import get_redis_client
+
+INGEST, OCR, PARSE, LLM = 'ingest', 'ocr', 'parse', 'llm'
+STAGES = (INGEST, OCR, PARSE, LLM)
+
+# The Redis broker orders messages by priority 0 (first) to 9 (last)
+HIGHEST_PRIORITY, LOWEST_PRIORITY = 0, 9
+DEFAULT_PRIORITY = 5
+
+_PREFIX = 'docanalyzer:scheduling:'
+
+# Takes a slot in a caller's set of running tasks if it has fewer than ARGV[2],
+# or if ARGV[1] already holds one. Slots are leases that expire after ARGV[3]
+# seconds, so tasks killed without releasing theirs don't block the caller forever.
+_ACQUIRE_SLOT_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local limit, lease = tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) and redis.call('ZCARD', KEYS[1]) >= limit then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + lease, ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(lease))
+return 1
+"""
+
+
+def get_scheduling_config():
+    """Returns the 'scheduling' section of config.yaml."""
+    from api.config_registry import config_section
+    return config_section('scheduling')
+
+
+def _clamp(priority):
+    return max(HIGHEST_PRIORITY, min(LOWEST_PRIORITY, int(priority)))
+
+
+def _redis_client(scheduling_config):
+    return get_redis_client(scheduling_config.get('redis_url'))
+
+
+def assign_priority(doc_type_config, caller, documents=1):
+    """
+    Returns the Celery priority for `documents` new analyses by `caller` (a
+    Vault identity, or None) and counts them towards its recent submissions,
+    which lower the priority when fair share is enabled.
+    """
+    scheduling_config = get_scheduling_config()
+    caller_priorities = scheduling_config.get('caller_priorities') or {}
+    if caller in caller_priorities:
+        priority = caller_priorities[caller]
+    else:
+        priority = doc_type_config.get('priority', scheduling_config.get('default_priority', DEFAULT_PRIORITY))
+
+    fair_share = scheduling_config.get('fair_share', {})
+    if caller is None or not fair_share.get('enabled', False):
+        return _clamp(priority)
+
+    window_seconds = fair_share.get('window_seconds', 300)
+    window = int(time.time() // window_seconds)
+    key = f"{_PREFIX}submissions:{caller}:"
+    try:
+        pipe = _redis_client(scheduling_config).pipeline()
+        pipe.incrby(f"{key}{window}", documents)
+        pipe.expire(f"{key}{window}", window_seconds * 2)
+        pipe.get(f"{key}{window - 1}")
+        current, _, previous = pipe.execute()
+    except Exception as e:
+        print(f"WARNING: Could not count submissions for {caller}, using the base priority: {e}")
+        return _clamp(priority)
+
+    # Sliding-window estimate: the previous window counts for the part of it still inside the window
+    elapsed = (time.time() % window_seconds) / window_seconds
+    recent = int(current) + int(previous or 0) * (1 - elapsed)
+    penalty = int((recent - 1) // fair_share.get('submissions_per_step', 10))
+    return _clamp(priority + max(penalty, 0))
+
+
+class StageSlots:
+    """
+    Limits how many tasks of one caller run at the same time in a stage
+    ('max_running_per_caller' in the 'fair_share' section). Stages without a
+    limit, and tasks without a caller, always get a slot.
+    """
+    def acquire(self, stage, caller, task_id):
+        """Returns True if the task may run now; it must then call release()."""
+        scheduling_config = get_scheduling_config()
+        fair_share = scheduling_config.get('fair_share', {})
+        limit = (fair_share.get('max_running_per_caller') or {}).get(stage)
+        if caller is None or not limit or not fair_share.get('enabled', False):
+            return True
+        try:
+            return bool(_redis_client(scheduling_config).eval(
+                _ACQUIRE_SLOT_SCRIPT, 1, self._key(stage, caller), task_id, limit, fair_share.get('lease_seconds', 900),
+            ))
+        except Exception as e:
+            print(f"WARNING: Could not check the running {stage} tasks of {caller}, running anyway: {e}")
+            return True
+
+    def release(self, stage, caller, task_id):
+        if caller is None:
+            return
+        try:
+            _redis_client(get_scheduling_config()).zrem(self._key(stage, caller), task_id)
+        except Exception as e:
+            print(f"WARNING: Could not release the {stage} slot of task {task_id}: {e}")
+
+    @staticmethod
+    def _key(stage, caller):
+        return f"{_PREFIX}running:{stage}:{caller}"
+
+    @staticmethod
+    def defer_seconds():
+        """How long a task that got no slot waits before trying again."""
+        return get_scheduling_config().get('fair_share', {}).get('defer_seconds', 5)
+
+
+stage_slots = StageSlots()
+
+
+def apply_queue_settings(worker, queues):
+    """
+    Applies the 'queues' section of config.yaml to a worker (a Celery
+    WorkController) started with `-Q <stage>`: its concurrency and prefetch
+    multiplier. Workers consuming several stage queues (e.g. one worker for
+    everything in development) keep their command-line settings, as do
+    workers for queues left out of config.yaml.
+    """
+    from api.config_registry import config_section
+    queue_config = config_section('queues')
+    configured = [queue for queue in queues if queue in queue_config]
+    if len(configured) != 1:
+        return
+    queue = configured[0]
+    queue_settings = queue_config[queue]
+    if 'concurrency' in queue_settings:
+        worker.concurrency = queue_settings['concurrency']
+    if 'prefetch_multiplier' in queue_settings:
+        worker.prefetch_multiplier = queue_settings['prefetch_multiplier']
+    print(f"Worker settings for queue '{queue}': {queue_settings}")
@@ -0,0 +1,88 @@
+# api/task_events.py
+import time
+from .caching import get_redis_client
+from . import json_codec
+from .config_registry import config_registry
+from .result_store import get_result_store
+
+# Pipeline stages, in order. Each one is also stored as the Celery task state.
+QUEUED, OCR, LLM, DONE, FAILED = 'QUEUED', 'OCR', 'LLM', 'SUCCESS', 'FAILURE'
+# Only ever set by Celery, when a task is revoked
+REVOKED = 'REVOKED'
+TERMINAL_STATES = (DONE, FAILED, REVOKED)
+
+
+def _channel(task_id):
+    return f"docanalyzer:task-events:{task_id}"
+
+
+def _result_store():
+    return get_result_store(config_registry.get().data)
+
+
+def publish_event(task_id, state, **data):
+    """
+    Publishes a stage transition to everyone streaming this task's status and
+    records it in the result store as the task's latest state. Redis errors
+    are logged and ignored; clients then fall back to the Celery result backend.
+    """
+    event = {'task_id': task_id, 'status': state, 'timestamp': time.time(), **data}
+    try:
+        _result_store().save(task_id, event)
+        get_redis_client().publish(_channel(task_id), json_codec.dumps_bytes(event))
+    except Exception as e:
+        print(f"WARNING: Could not publish status event for task {task_id}: {e}")
+
+
+def report_stage(task, state, **meta):
+    """Records an in-progress stage on the Celery task and pushes it to listeners."""
+    task.update_state(state=state, meta=meta)
+    publish_event(task.request.id, state, info=meta)
+
+
+def current_event(task_id, include_result=True):
+    """Returns the task's latest event, falling back to the Celery result backend."""
+    return _result_store().get(task_id, include_result=include_result)
+
+
+def iter_events(task_id, timeout, heartbeat=15):
+    """
+    Yields the task's current event and then every new one until the task
+    finishes or `timeout` seconds pass. Yields None as a heartbeat while idle.
+    """
+    pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the current state so no transition is missed
+    pubsub.subscribe(_channel(task_id))
+    try:
+        event = current_event(task_id)
+        yield event
+        if event['status'] in TERMINAL_STATES:
+            return
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=min(heartbeat, max(deadline - time.monotonic(), 0)))
+            if message is None:
+                yield None
+                continue
+            event = json_codec.loads(message['data'])
+            yield event
+            if event['status'] in TERMINAL_STATES:
+                return
+    finally:
+        pubsub.close()
+
+
+def wait_for_change(task_id, since_status, timeout):
+    """
+    Long-poll helper: returns the first event whose status differs from
+    `since_status`, or the current event once `timeout` seconds pass.
+    """
+    last_event = None
+    for event in iter_events(task_id, timeout, heartbeat=timeout):
+        if event is None:
+            continue
+        last_event = event
+        if event['status'] != since_status:
+            return event
+    return last_event or current_event(task_id)
@@ -1,100 +1,730 @@
-import base64
-import json
-import yaml
-import requests
-from pathlib import Path
-from celery import shared_task
-from django.conf import settings
+import inspect
+import os
+import threading
+import time
+from collections import Counter
+from celery import Task, chord, shared_task
+from celery.signals import worker_process_init, worker_ready
 from gemini_project.vault_utils import vault_client
 
 # Import Providers
 from .abbyy_provider import AbbyyProvider
-from .llm_providers.gemini_provider import GeminiProvider
-from .llm_providers.openai_provider import OpenAIProvider
+from .llm_providers.registry import provider_registry
+from .llm_providers.response_cache import CachedLLMProvider, get_response_cache
+from .llm_providers.hedging import HedgedLLMProvider
 
-from .utils import parse_abbyy_response # <-- Import from utils
+from .config_registry import config_registry
+from .ocr_cache import get_ocr_cache
+from .blob_store import get_blob_store
+from .result_store import get_result_store
+from .resilience import ProviderUnavailable
+from .prompting import render_prompt, prompt_tokens, COMPACT
+from .map_reduce import map_reduce_analysis, SINGLE, MAP_REDUCE
+from .abbyy_polling import PollSchedule
+from .batches import batch_tracker, QUEUED, OCR, LLM, DONE, FAILED
+from . import scheduling
+from . import task_events
+from . import metrics
 
-# --- ABBYY JSON Parser ---
-ABBYY_BASE_URL = "https://vantage-us.abbyy.com"
+# Provider Factory
+def _build_llm_provider(provider_name, model_id, config, use_cache=True):
+    # Providers and their HTTP clients live as long as the worker process
+    provider = provider_registry.get(provider_name, model_id, config)
 
+    # Serve identical prompt/model/params combinations from the response cache
+    response_cache = get_response_cache(config) if use_cache else None
+    if response_cache:
+        return CachedLLMProvider(provider, response_cache)
+    return provider
 
-# --- Helper Functions for ABBYY API V1 Workflow ---
-def get_abbyy_access_token():
-    """Step 1: Authenticate and get an access token."""
-    auth_url = f"{ABBYY_BASE_URL}/auth2/connect/token"
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    payload = {
-        'grant_type': 'client_credentials',
-        'client_id': settings.ABBYY_CLIENT_ID,
-        'client_secret': settings.ABBYY_CLIENT_SECRET,
-        'scope': 'openid permissions global.wildcard'
-    }
-    response = requests.post(auth_url, headers=headers, data=payload, verify=False)
-    response.raise_for_status()
-    return response.json()['access_token']
 
+def get_llm_provider(provider_name, model_id, config, use_cache=True, policy=None):
+    """
+    Returns the provider for a model. With a document type's execution policy
+    every call is bounded by its deadline and hedged with its fallback model.
+    """
+    provider = _build_llm_provider(provider_name, model_id, config, use_cache=use_cache)
+    if not policy:
+        return provider
 
-# Provider Factory
-def get_llm_provider(provider_name, model_id, config):
-    provider_info = config['providers'][provider_name]
-    
-    # Use the new, separated path keys from the config
-    mount_point = provider_info['vault_mount_point']
-    secret_path = provider_info['vault_secret_path']
-    api_key_vault_key = provider_info['api_key_vault_key']
+    fallback = None
+    fallback_model_id = policy.get('fallback_model')
+    if fallback_model_id and fallback_model_id != model_id:
+        fallback_config = next(model for model in config['ai_models'] if model['id'] == fallback_model_id)
+        fallback = _build_llm_provider(fallback_config['provider'], fallback_model_id, config, use_cache=use_cache)
+    return HedgedLLMProvider(provider, fallback, policy.get('deadline_seconds'), policy.get('hedge_after_seconds'))
     
-    api_key = vault_client.get_secret(secret_path, api_key_vault_key, mount_point=mount_point)
+def warm_up_worker():
+    """
+    Builds the LLM providers, reads their Vault secrets and opens connections
+    to ABBYY and the LLM endpoints, so the first task on a fresh worker process
+    runs as fast as later ones.
+    """
+    config_data = config_registry.get().data
+    if not config_data.get('worker', {}).get('warm_up', True):
+        return
+    started = time.perf_counter()
+    provider_registry.warm_up(config_data)
+    try:
+        AbbyyProvider(config_data, vault_client).warm_up()
+    except Exception as e:
+        print(f"WARNING: Could not warm up the ABBYY provider: {e}")
+    print(f"Worker process {os.getpid()} warmed up in {time.perf_counter() - started:.2f}s.")
+
+
+@worker_process_init.connect
+def _warm_up_worker_process(**kwargs):
+    # Prefork children and the solo pool run tasks in the process that sends this. Warm up in
+    # the background: Celery gives process init only a few seconds (worker_proc_alive_timeout).
+    threading.Thread(target=warm_up_worker, daemon=True).start()
+
+
+@worker_ready.connect
+def _warm_up_green_worker(sender=None, **kwargs):
+    # eventlet, gevent and thread pools run tasks in the main process, which never sends worker_process_init
+    pool = getattr(sender, 'pool', None)
+    if pool is not None and type(pool).__module__.rsplit('.', 1)[-1] in ('eventlet', 'gevent', 'thread'):
+        threading.Thread(target=warm_up_worker, daemon=True).start()
+
+
+def _failure_meta(e):
+    error_message = str(e)
+    if hasattr(e, 'response') and e.response is not None:
+        error_message += f" | Response: {e.response.text}"
+    return {'exc_type': type(e).__name__, 'exc_message': error_message}
+
+
+def _report_failure(task, e):
+    meta = _failure_meta(e)
+    task.update_state(state='FAILURE', meta=meta)
+    metrics.ANALYSES_TOTAL.inc(outcome='failure')
+    task_events.publish_event(task.request.id, task_events.FAILED, error=meta)
+
 
-    if provider_name == "google":
-        return GeminiProvider(api_key, model_id, config['api_endpoints']['google_gemini'])
-    elif provider_name == "openai":
-        return OpenAIProvider(api_key, model_id)
+class AnalysisStageTask(Task):
+    """
+    Base class for the stages of a single-document analysis. Stages report
+    their own failures with _report_failure; an exception that escapes a
+    stage before it could (e.g. a document type dropped by a config reload,
+    or a blob removed by garbage collection) is still published as FAILED, so
+    clients following the task stop waiting for it.
+    """
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        try:
+            state = get_result_store(config_registry.get().data).get_state(task_id)
+        except Exception:
+            state = None
+        if state is not None and state.get('status') == task_events.FAILED:
+            return
+        metrics.ANALYSES_TOTAL.inc(outcome='failure')
+        task_events.publish_event(task_id, task_events.FAILED, error=_failure_meta(exc))
+
+
+def _max_requeues(config):
+    return config.data.get('resilience', {}).get('max_requeues', 30)
+
+
+def _requeue(task, state, signature, error):
+    """
+    Replaces the task with `signature`, delayed until the provider should
+    accept calls again. The task keeps its id, so clients keep following it.
+    """
+    print(f"{error} Requeueing task {task.request.id} in {error.retry_after:.0f}s.")
+    task_events.report_stage(task, state, requeued_for_seconds=round(error.retry_after, 1), reason=str(error))
+    return task.replace(signature.set(countdown=error.retry_after))
+
+
+def _prioritized(signature, context):
+    """Gives the next stage of an analysis the priority it was submitted with; task routes pick its queue."""
+    if context.get('priority') is None:
+        return signature
+    return signature.set(priority=context['priority'])
+
+
+def _defer(task, state, signature):
+    """
+    Replaces a task whose caller already has its share of running tasks in
+    this stage, so it tries again later and other callers' tasks go first.
+    `state` is reported to the task's listeners, if it has any.
+    """
+    defer_seconds = scheduling.stage_slots.defer_seconds()
+    if state is not None:
+        task_events.report_stage(task, state, waiting_for_slot_seconds=defer_seconds)
+    return task.replace(signature.set(countdown=defer_seconds))
+
+
+def _render_analysis_prompt(config, context, model_config, extracted_data, preamble='', measure_baseline=True):
+    """Renders, measures and logs the analysis prompt for (part of) the extracted data."""
+    # Serialized compactly and kept within the model's token budget (see api/prompting.py)
+    doc_type_config = config.get_document_type(context['doc_type_id'])
+    with metrics.PROMPT_RENDER_SECONDS.time():
+        prompt_template = config.get_prompt_template(context['doc_type_id'])
+        prompt, prompt_stats = render_prompt(
+            prompt_template, extracted_data, context['manual_rag_text'], model_config,
+            encoding=doc_type_config.get('prompt_encoding', COMPACT),
+            measure_baseline=measure_baseline and config.data.get('prompting', {}).get('log_savings', True),
+        )
+    metrics.PROMPT_CHARS.observe(len(prompt))
+    metrics.PROMPT_TOKENS.observe(prompt_stats['tokens'], encoding=prompt_stats['encoding'])
+    truncated_note = ', truncated' if prompt_stats['truncated'] else ''
+    if prompt_stats['baseline_tokens']:
+        saved = 1 - prompt_stats['tokens'] / prompt_stats['baseline_tokens']
+        print(
+            f"Prompt for {context['doc_type_id']}/{context['model_id']}: {prompt_stats['baseline_tokens']} -> "
+            f"{prompt_stats['tokens']} tokens ({prompt_stats['baseline_chars']} -> {prompt_stats['chars']} chars, "
+            f"{prompt_stats['encoding']}, {saved:.0%} smaller{truncated_note})"
+        )
     else:
-        raise ValueError(f"Unknown LLM provider: {provider_name}")
-    
+        print(
+            f"Prompt for {context['doc_type_id']}/{context['model_id']}: {prompt_stats['tokens']} tokens "
+            f"({prompt_stats['chars']} chars, {prompt_stats['encoding']}{truncated_note})"
+        )
+    return preamble + prompt
+
+
+def generate_llm_analysis(config, context, extracted_data, on_progress=None, on_output=None):
+    """
+    Renders the prompt for the extracted data and returns the LLM's JSON
+    analysis. Document types with `llm_mode: map_reduce` analyse oversized
+    data in parallel chunks and merge the results; `on_progress(done, total)`
+    then reports finished chunks. Otherwise, when streaming is enabled,
+    `on_output(text_so_far, output_tokens)` reports the response as it arrives.
+    """
+    model_config = config.get_model(context['model_id'])
+    doc_type_config = config.get_document_type(context['doc_type_id'])
+    llm_provider = get_llm_provider(
+        model_config['provider'], context['model_id'], config.data,
+        use_cache=not context['bypass_cache'], policy=doc_type_config.get('execution_policy'),
+    )
+    streaming = config.data.get('llm_streaming', {}).get('enabled', False)
+
+    def generate(prompt, on_output=None):
+        with metrics.LLM_REQUEST_SECONDS.time(provider=model_config['provider']):
+            if streaming:
+                return llm_provider.generate_analysis_streaming(prompt, on_progress=on_output)
+            return llm_provider.generate_analysis(prompt)
+
+    if doc_type_config.get('llm_mode', SINGLE) == MAP_REDUCE:
+        map_reduce_config = doc_type_config.get('map_reduce', {})
+        prompt_template = config.get_prompt_template(context['doc_type_id'])
+        encoding = doc_type_config.get('prompt_encoding', COMPACT)
+        return map_reduce_analysis(
+            extracted_data,
+            render=lambda data, preamble: _render_analysis_prompt(
+                config, context, model_config, data, preamble, measure_baseline=not preamble,
+            ),
+            generate=generate,
+            measure=lambda data: prompt_tokens(prompt_template, data, context['manual_rag_text'], model_config, encoding),
+            chunk_max_tokens=map_reduce_config.get('chunk_max_tokens', 30000),
+            max_parallel=map_reduce_config.get('max_parallel_chunks', 4),
+            on_progress=on_progress,
+        )
+
+    return generate(_render_analysis_prompt(config, context, model_config, extracted_data), on_output=on_output)
+
+
+def _output_reporter(task, config):
+    """Returns an on_output callback that publishes the partial response, at most once per interval."""
+    interval = config.data.get('llm_streaming', {}).get('progress_interval_seconds', 1.0)
+    last_reported = 0.0
+
+    def report(text, output_tokens):
+        nonlocal last_reported
+        now = time.monotonic()
+        if now - last_reported >= interval:
+            last_reported = now
+            task_events.report_stage(task, task_events.LLM, output_tokens=output_tokens, partial_output=text)
+    return report
+
+
+def run_llm_workflow(task, config, context, extracted_data):
+    """
+    Runs the LLM stage for a single-document task, reporting progress and
+    failures on the task. When the LLM provider is rate limited or its circuit
+    is open, the stage is requeued as run_llm_stage instead of failing.
+    """
+    try:
+        task_events.report_stage(task, task_events.LLM)
+        final_json = generate_llm_analysis(
+            config, context, extracted_data,
+            on_progress=lambda done, total: task_events.report_stage(task, task_events.LLM, chunks_done=done, chunks=total),
+            on_output=_output_reporter(task, config),
+        )
+        task_events.publish_event(task.request.id, task_events.DONE, result=final_json)
+        metrics.ANALYSES_TOTAL.inc(outcome='success')
+        return final_json
+    except ProviderUnavailable as e:
+        if context.get('requeues', 0) >= _max_requeues(config):
+            _report_failure(task, e)
+            raise
+        unavailable = e
+    except Exception as e:
+        _report_failure(task, e)
+        raise
+
+    requeued_context = {**context, 'requeues': context.get('requeues', 0) + 1}
+    return _requeue(task, task_events.LLM, _prioritized(run_llm_stage.s(requeued_context, extracted_data), context), unavailable)
+
+
+@shared_task(bind=True, base=AnalysisStageTask)
+def run_llm_stage(self, context, extracted_data):
+    """The LLM stage of a single-document analysis (queue 'llm')."""
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    caller = context.get('caller')
+    if not scheduling.stage_slots.acquire(scheduling.LLM, caller, self.request.id):
+        return _defer(self, task_events.LLM, _prioritized(run_llm_stage.s(context, extracted_data), context))
+    try:
+        return run_llm_workflow(self, config_registry.get(), context, extracted_data)
+    finally:
+        scheduling.stage_slots.release(scheduling.LLM, caller, self.request.id)
+
+
 # The Main Orchestrator Task
-@shared_task(bind=True)
-def process_document_analysis(self, file_content_b64, file_name, content_type, manual_rag_text, doc_type_id, model_id):
-    # 1. Load Configuration
-    config_path = Path(settings.BASE_DIR) / 'config.yaml'
-    with open(config_path, 'r') as f:
-        config_data = yaml.safe_load(f)
-
-    doc_type_config = next((item for item in config_data['document_types'] if item['id'] == doc_type_id), None)
-    model_config = next((item for item in config_data['ai_models'] if item['id'] == model_id), None)
+# A single-document analysis runs as stages on their own queues (see api/scheduling.py):
+# process_document_analysis (ingest) -> poll_abbyy_transaction (ocr) -> parse_abbyy_result (parse) -> run_llm_stage (llm).
+# Each stage replaces itself with the next, so the analysis keeps one task id throughout.
+@shared_task(bind=True, base=AnalysisStageTask)
+def process_document_analysis(self, blob_id, file_name, content_type, manual_rag_text, doc_type_id, model_id, bypass_cache=False, requeues=0,
+                              caller=None, priority=None):
+    metrics.set_metric_context(doc_type_id=doc_type_id, model_id=model_id)
+
+    # 1. Load Configuration (parsed once per process, reloaded only when config.yaml changes)
+    config = config_registry.get()
+    config_data = config.data
+
+    doc_type_config = config.get_document_type(doc_type_id)
+    model_config = config.get_model(model_id)
     
     if not doc_type_config or not model_config:
         raise ValueError("Invalid document type or model ID.")
     
-    file_content = base64.b64decode(file_content_b64)
+    blob_store = get_blob_store(config_data)
+    context = {
+        'doc_type_id': doc_type_id,
+        'model_id': model_id,
+        'manual_rag_text': manual_rag_text,
+        'bypass_cache': bypass_cache,
+        'file_size': blob_store.size(blob_id),
+        'ocr_cache_key': None,
+        'caller': caller,
+        'priority': priority,
+    }
+    retry_signature = _prioritized(process_document_analysis.s(
+        blob_id, file_name, content_type, manual_rag_text, doc_type_id, model_id, bypass_cache,
+        requeues=requeues, caller=caller, priority=priority,
+    ), context)
+
+    # 2. ABBYY Workflow (skipped when the same file was already processed by this skill)
+    # The blob id is the SHA-256 of the file, so it doubles as the content digest
+    ocr_cache = None if bypass_cache else get_ocr_cache(config_data)
+    if ocr_cache:
+        context['ocr_cache_key'] = ocr_cache.make_key(blob_id, doc_type_config['abbyy_skill_id'], config.get_abbyy_extractor(doc_type_id).digest)
+        cached_entry = ocr_cache.get(context['ocr_cache_key'])
+        if cached_entry:
+            blob_store.release(blob_id, self.request.id)
+            return self.replace(_prioritized(run_llm_stage.s(context, cached_entry['extracted_data']), context))
+
+    if not scheduling.stage_slots.acquire(scheduling.INGEST, caller, self.request.id):
+        return _defer(self, task_events.QUEUED, retry_signature)
+
+    unavailable = None
+    try:
+        try:
+            task_events.report_stage(self, task_events.OCR)
+            abbyy_provider = AbbyyProvider(config_data, vault_client)
+            # The access token comes from the shared token cache, not a per-task exchange
+            transaction_id = abbyy_provider.create_transaction(doc_type_config['abbyy_skill_id'])
+            with blob_store.open(blob_id) as file_obj:
+                abbyy_provider.add_file_to_transaction(transaction_id, file_obj, file_name, content_type)
+            abbyy_provider.start_transaction(transaction_id)
+        except ProviderUnavailable as e:
+            # A transaction created before ABBYY refused is abandoned; the retry starts a new one
+            if requeues >= _max_requeues(config):
+                _report_failure(self, e)
+                raise
+            unavailable = e
+        except Exception as e:
+            _report_failure(self, e)
+            raise
+    finally:
+        scheduling.stage_slots.release(scheduling.INGEST, caller, self.request.id)
+        # ABBYY has its own copy now (or the task failed); the upload is no longer needed.
+        # A requeued task still needs it.
+        if unavailable is None:
+            blob_store.release(blob_id, self.request.id)
+
+    if unavailable is not None:
+        return _requeue(self, task_events.OCR, retry_signature.clone(kwargs={'requeues': requeues + 1}), unavailable)
+
+    # Hand off instead of sleeping in this worker; the status check keeps this task's id
+    schedule = PollSchedule(config_data.get('abbyy_polling'))
+    delay = schedule.first_delay(doc_type_config['abbyy_skill_id'], context['file_size'])
+    return self.replace(_prioritized(
+        poll_abbyy_transaction.s(transaction_id, context, attempt=0, started_at=time.time()), context,
+    ).set(countdown=delay))
+
 
-    # 2. ABBYY Workflow
+@shared_task(bind=True, base=AnalysisStageTask)
+def poll_abbyy_transaction(self, transaction_id, context, attempt=0, started_at=None):
+    """
+    Checks an ABBYY transaction once. While it is still running the task
+    re-schedules itself with a growing countdown, so no worker sleeps on it.
+    Once processed, it hands over to parse_abbyy_result.
+    """
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    config = config_registry.get()
+    config_data = config.data
+    doc_type_config = config.get_document_type(context['doc_type_id'])
+    skill_id = doc_type_config['abbyy_skill_id']
+    schedule = PollSchedule(config_data.get('abbyy_polling'))
+
+    delay = None
     try:
+        task_events.report_stage(self, task_events.OCR, transaction_id=transaction_id, attempt=attempt)
         abbyy_provider = AbbyyProvider(config_data, vault_client)
-        token = abbyy_provider.get_access_token()
-        transaction_id = abbyy_provider.create_transaction(token, doc_type_config['abbyy_skill_id'])
-        abbyy_provider.add_file_to_transaction(token, transaction_id, file_content, file_name, content_type)
-        abbyy_provider.start_transaction(token, transaction_id)
-        raw_abbyy_data = abbyy_provider.poll_and_get_result(token, transaction_id)
-        extracted_data = parse_abbyy_response(raw_abbyy_data)
+        status_data = abbyy_provider.get_transaction_status(transaction_id)
+        is_processed = status_data.get('status') == 'Processed'
+        if not is_processed and time.time() - started_at > schedule.timeout_seconds(doc_type_config):
+            raise Exception("ABBYY processing timed out.")
+    except ProviderUnavailable as e:
+        # Check again once ABBYY accepts calls; the processing timeout still applies
+        if time.time() - started_at > schedule.timeout_seconds(doc_type_config):
+            _report_failure(self, e)
+            raise
+        is_processed, delay = False, e.retry_after
     except Exception as e:
-        self.update_state(state='FAILURE', meta={'exc_type': type(e).__name__, 'exc_message': str(e)})
+        _report_failure(self, e)
         raise
 
-    # 3. LLM Workflow
+    if not is_processed:
+        return self.replace(_prioritized(
+            poll_abbyy_transaction.s(transaction_id, context, attempt=attempt + 1, started_at=started_at), context,
+        ).set(countdown=delay or schedule.next_delay(attempt)))
+
+    processing_seconds = time.time() - started_at
+    schedule.record(skill_id, context['file_size'], processing_seconds)
+    metrics.ABBYY_PROCESSING_SECONDS.observe(processing_seconds)
+    metrics.ABBYY_POLL_ATTEMPTS.observe(attempt + 1)
+
+    return self.replace(_prioritized(parse_abbyy_result.s(transaction_id, status_data, context), context))
+
+
+@shared_task(bind=True, base=AnalysisStageTask)
+def parse_abbyy_result(self, transaction_id, status_data, context):
+    """
+    Downloads and extracts the result of a processed ABBYY transaction, stores
+    it in the OCR cache and hands it to the LLM stage.
+    """
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    config = config_registry.get()
+    config_data = config.data
+
+    unavailable = None
     try:
-        llm_provider = get_llm_provider(model_config['provider'], model_id, config_data)
-        
-        prompt_template_path = Path(settings.BASE_DIR) / doc_type_config['prompt_template']
-        with open(prompt_template_path, 'r') as f:
-            prompt_template = f.read()
-        prompt = prompt_template.format(extracted_data=json.dumps(extracted_data, indent=2), manual_rag_text=manual_rag_text)
-        
-        final_json = llm_provider.generate_analysis(prompt)
-        return final_json
+        task_events.report_stage(self, task_events.OCR, transaction_id=transaction_id, parsing=True)
+        abbyy_provider = AbbyyProvider(config_data, vault_client)
+        # The result is streamed through the document type's field spec; the raw payload is only kept for the cache
+        ocr_cache = get_ocr_cache(config_data)
+        with metrics.PARSE_SECONDS.time():
+            extracted_data, raw_abbyy_data = abbyy_provider.extract_result(
+                transaction_id, status_data, config.get_abbyy_extractor(context['doc_type_id']),
+                keep_raw=bool(ocr_cache and ocr_cache.store_raw and context['ocr_cache_key']),
+            )
+    except ProviderUnavailable as e:
+        if context.get('requeues', 0) >= _max_requeues(config):
+            _report_failure(self, e)
+            raise
+        unavailable = e
+    except Exception as e:
+        _report_failure(self, e)
+        raise
+
+    if unavailable is not None:
+        requeued_context = {**context, 'requeues': context.get('requeues', 0) + 1}
+        return _requeue(self, task_events.OCR, _prioritized(
+            parse_abbyy_result.s(transaction_id, status_data, requeued_context), context,
+        ), unavailable)
+
+    # Parse failures are returned as an error dict; never cache those
+    if ocr_cache and context['ocr_cache_key'] and 'error' not in extracted_data:
+        ocr_cache.set(context['ocr_cache_key'], extracted_data, raw_abbyy_data)
+
+    return self.replace(_prioritized(run_llm_stage.s(context, extracted_data), context))
+
+
+# --- Batch Analysis ---
+# Documents of the same type share one ABBYY transaction; the LLM stage then fans
+# out as one task per document. Progress is kept in the batch tracker. The stages
+# use the same queues as single documents: process_batch_transaction (ingest) ->
+# poll_batch_transaction (ocr) -> parse_batch_results (parse) -> analyze_batch_document (llm).
+
+def _match_abbyy_documents(status_data, documents):
+    """
+    Pairs each of our documents with the ABBYY document built from it. ABBYY
+    reports source file names when it has them; files sharing a name are
+    paired in upload order, and files ABBYY doesn't name by their position.
+    """
+    abbyy_documents = status_data.get('documents', [])
+    by_name = {}
+    for abbyy_index, abbyy_document in enumerate(abbyy_documents):
+        for source_file in abbyy_document.get('sourceFiles', []):
+            by_name.setdefault(source_file.get('name'), []).append(abbyy_index)
+    occurrences = Counter()
+
+    matches = []
+    for position, document in enumerate(documents):
+        named = by_name.get(document['file_name'], [])
+        occurrence = occurrences[document['file_name']]
+        occurrences[document['file_name']] += 1
+        abbyy_index = named[occurrence] if occurrence < len(named) else position
+        matches.append((document, abbyy_index if abbyy_index < len(abbyy_documents) else None))
+    return matches
+
+
+class BatchStageTask(Task):
+    """
+    Base class for the ABBYY stages of a batch. An exception that escapes a
+    stage fails every document it carries that is still queued or in OCR, so
+    the batch still finishes.
+    """
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        arguments = inspect.signature(self.run).bind_partial(*args, **kwargs).arguments
+        indexes = [document['index'] for document in arguments.get('documents') or []]
+        try:
+            batch_tracker.fail_documents(arguments['batch_id'], indexes, str(exc), only_stages=(QUEUED, OCR))
+        except Exception as e:
+            print(f"WARNING: Could not record the failure of batch {arguments.get('batch_id')}: {e}")
+
+
+@shared_task(bind=True, base=BatchStageTask)
+def process_batch_transaction(self, batch_id, documents, context, requeues=0):
+    """
+    Runs one ABBYY transaction for a group of same-type documents. Documents
+    already in the OCR cache skip ABBYY and go straight to the LLM stage.
+    """
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    caller = context.get('caller')
+    if not scheduling.stage_slots.acquire(scheduling.INGEST, caller, self.request.id):
+        # Progress of batch documents is kept in the batch tracker, not on this task
+        return _defer(self, None, _prioritized(
+            process_batch_transaction.s(batch_id, documents, context, requeues=requeues), context,
+        ))
+    try:
+        return _process_batch_transaction(self, batch_id, documents, context, requeues)
+    finally:
+        scheduling.stage_slots.release(scheduling.INGEST, caller, self.request.id)
+
+
+def _process_batch_transaction(task, batch_id, documents, context, requeues):
+    config = config_registry.get()
+    config_data = config.data
+    doc_type_config = config.get_document_type(context['doc_type_id'])
+    blob_store = get_blob_store(config_data)
+    ocr_cache = None if context['bypass_cache'] else get_ocr_cache(config_data)
+
+    cached_results = []
+    pending = []
+    for document in documents:
+        document['ocr_cache_key'] = None
+        if ocr_cache:
+            document['ocr_cache_key'] = ocr_cache.make_key(
+                document['blob_id'], doc_type_config['abbyy_skill_id'], config.get_abbyy_extractor(context['doc_type_id']).digest,
+            )
+            cached_entry = ocr_cache.get(document['ocr_cache_key'])
+            if cached_entry:
+                blob_store.release(document['blob_id'], document['holder'])
+                cached_results.append((document, cached_entry['extracted_data']))
+                continue
+        pending.append(document)
+
+    if cached_results:
+        _dispatch_batch_llm_stage(batch_id, context, cached_results)
+    if not pending:
+        return {'batch_id': batch_id, 'transaction_id': None}
+
+    unavailable = None
+    try:
+        abbyy_provider = AbbyyProvider(config_data, vault_client)
+        transaction_id = abbyy_provider.create_transaction(doc_type_config['abbyy_skill_id'])
+        for document in pending:
+            with blob_store.open(document['blob_id']) as file_obj:
+                abbyy_provider.add_file_to_transaction(transaction_id, file_obj, document['file_name'], document['content_type'])
+        abbyy_provider.start_transaction(transaction_id)
     except Exception as e:
-        error_message = str(e)
-        if hasattr(e, 'response') and e.response is not None:
-            error_message += f" | Response: {e.response.text}"
-        self.update_state(state='FAILURE', meta={'exc_type': type(e).__name__, 'exc_message': error_message})
-        raise
\ No newline at end of file
+        if not isinstance(e, ProviderUnavailable) or requeues >= _max_requeues(config):
+            batch_tracker.fail_documents(batch_id, [document['index'] for document in pending], str(e))
+            raise
+        unavailable = e
+    finally:
+        # Requeued documents keep their uploads
+        if unavailable is None:
+            for document in pending:
+                blob_store.release(document['blob_id'], document['holder'])
+
+    if unavailable is not None:
+        print(f"{unavailable} Requeueing batch {batch_id} in {unavailable.retry_after:.0f}s.")
+        return task.replace(_prioritized(
+            process_batch_transaction.s(batch_id, pending, context, requeues=requeues + 1), context,
+        ).set(countdown=unavailable.retry_after))
+
+    for document in pending:
+        batch_tracker.update_document(batch_id, document['index'], status=OCR, transaction_id=transaction_id)
+
+    total_size = sum(document['file_size'] for document in pending)
+    schedule = PollSchedule(config_data.get('abbyy_polling'))
+    delay = schedule.first_delay(doc_type_config['abbyy_skill_id'], total_size)
+    return task.replace(_prioritized(
+        poll_batch_transaction.s(batch_id, transaction_id, pending, context, attempt=0, started_at=time.time()), context,
+    ).set(countdown=delay))
+
+
+@shared_task(bind=True, base=BatchStageTask)
+def poll_batch_transaction(self, batch_id, transaction_id, documents, context, attempt=0, started_at=None):
+    """Checks a batch's ABBYY transaction once, then re-schedules itself or hands over to parse_batch_results."""
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    config = config_registry.get()
+    config_data = config.data
+    doc_type_config = config.get_document_type(context['doc_type_id'])
+    schedule = PollSchedule(config_data.get('abbyy_polling'))
+    indexes = [document['index'] for document in documents]
+
+    delay = None
+    try:
+        abbyy_provider = AbbyyProvider(config_data, vault_client)
+        status_data = abbyy_provider.get_transaction_status(transaction_id)
+        is_processed = status_data.get('status') == 'Processed'
+        if not is_processed and time.time() - started_at > schedule.timeout_seconds(doc_type_config):
+            raise Exception("ABBYY processing timed out.")
+    except Exception as e:
+        # When ABBYY is unavailable, check again later; the processing timeout still applies
+        if not isinstance(e, ProviderUnavailable) or time.time() - started_at > schedule.timeout_seconds(doc_type_config):
+            batch_tracker.fail_documents(batch_id, indexes, str(e))
+            raise
+        is_processed, delay = False, e.retry_after
+
+    if not is_processed:
+        return self.replace(_prioritized(
+            poll_batch_transaction.s(batch_id, transaction_id, documents, context, attempt=attempt + 1, started_at=started_at),
+            context,
+        ).set(countdown=delay or schedule.next_delay(attempt)))
+
+    total_size = sum(document['file_size'] for document in documents)
+    processing_seconds = time.time() - started_at
+    schedule.record(doc_type_config['abbyy_skill_id'], total_size, processing_seconds)
+    metrics.ABBYY_PROCESSING_SECONDS.observe(processing_seconds)
+    metrics.ABBYY_POLL_ATTEMPTS.observe(attempt + 1)
+
+    return self.replace(_prioritized(parse_batch_results.s(batch_id, transaction_id, status_data, documents, context), context))
+
+
+@shared_task(base=BatchStageTask)
+def parse_batch_results(batch_id, transaction_id, status_data, documents, context):
+    """Downloads and extracts each document of a processed batch transaction, then fans out the LLM stage."""
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    config = config_registry.get()
+    config_data = config.data
+    abbyy_provider = AbbyyProvider(config_data, vault_client)
+    ocr_cache = get_ocr_cache(config_data)
+    extractor = config.get_abbyy_extractor(context['doc_type_id'])
+    results = []
+    for document, abbyy_index in _match_abbyy_documents(status_data, documents):
+        if abbyy_index is None:
+            batch_tracker.update_document(batch_id, document['index'], status=FAILED, error="ABBYY returned no document for this file.")
+            continue
+        try:
+            with metrics.PARSE_SECONDS.time():
+                extracted_data, raw_abbyy_data = abbyy_provider.extract_result(
+                    transaction_id, status_data, extractor, document_index=abbyy_index,
+                    keep_raw=bool(ocr_cache and ocr_cache.store_raw and document['ocr_cache_key']),
+                )
+        except Exception as e:
+            batch_tracker.update_document(batch_id, document['index'], status=FAILED, error=str(e))
+            continue
+        # Parse failures are returned as an error dict; never cache those
+        if ocr_cache and document['ocr_cache_key'] and 'error' not in extracted_data:
+            ocr_cache.set(document['ocr_cache_key'], extracted_data, raw_abbyy_data)
+        results.append((document, extracted_data))
+
+    _dispatch_batch_llm_stage(batch_id, context, results)
+    return {'batch_id': batch_id, 'transaction_id': transaction_id}
+
+
+def _dispatch_batch_llm_stage(batch_id, context, results):
+    if not results:
+        return
+    header = [
+        _prioritized(analyze_batch_document.s(batch_id, document['index'], context, extracted_data), context)
+        for document, extracted_data in results
+    ]
+    chord(header)(_prioritized(finalize_batch_group.s(batch_id), context))
+
+
+@shared_task(bind=True)
+def analyze_batch_document(self, batch_id, index, context, extracted_data, deferrals=0):
+    """
+    Runs the LLM stage for one document of a batch. Failures are recorded on
+    the document instead of raised, so one bad document doesn't fail the chord.
+    """
+    metrics.set_metric_context(doc_type_id=context['doc_type_id'], model_id=context['model_id'])
+    caller = context.get('caller')
+    if not scheduling.stage_slots.acquire(scheduling.LLM, caller, self.request.id):
+        # Waiting for a slot is counted apart from the retries for an unavailable provider
+        raise self.retry(
+            kwargs={**self.request.kwargs, 'deferrals': deferrals + 1},
+            countdown=scheduling.stage_slots.defer_seconds(), max_retries=None,
+        )
+    try:
+        batch_tracker.update_document(batch_id, index, status=LLM, task_id=self.request.id)
+        config = config_registry.get()
+        retry_after = None
+        try:
+            result = generate_llm_analysis(config, context, extracted_data)
+        except ProviderUnavailable as e:
+            if self.request.retries - deferrals < _max_requeues(config):
+                retry_after = e.retry_after
+            else:
+                batch_tracker.update_document(batch_id, index, status=FAILED, error=str(e))
+                metrics.ANALYSES_TOTAL.inc(outcome='failure')
+                return {'index': index, 'ok': False}
+        except Exception as e:
+            error_message = str(e)
+            if hasattr(e, 'response') and e.response is not None:
+                error_message += f" | Response: {e.response.text}"
+            batch_tracker.update_document(batch_id, index, status=FAILED, error=error_message)
+            metrics.ANALYSES_TOTAL.inc(outcome='failure')
+            return {'index': index, 'ok': False}
+    finally:
+        scheduling.stage_slots.release(scheduling.LLM, caller, self.request.id)
+    if retry_after is not None:
+        # Rate limited or circuit open: retry later instead of failing the document
+        raise self.retry(countdown=retry_after, max_retries=None)
+    batch_tracker.update_document(batch_id, index, status=DONE, result=result)
+    metrics.ANALYSES_TOTAL.inc(outcome='success')
+    return {'index': index, 'ok': True}
+
+
+@shared_task
+def finalize_batch_group(group_results, batch_id):
+    """Runs once every document of one transaction group has finished its LLM stage."""
+    summary = batch_tracker.get(batch_id)
+    return {'batch_id': batch_id, 'status': summary['status'] if summary else None, 'group_size': len(group_results)}
+
+
+@shared_task
+def collect_blob_garbage():
+    """Deletes uploads that outlived the blob store's retention window."""
+    return get_blob_store(config_registry.get().data).collect_garbage()
+
+
+@shared_task
+def expire_task_results():
+    """
+    Deletes Celery task results older than the result store's retention
+    window, so the django-db result table stops growing without bound.
+    """
+    from django_celery_results.models import GroupResult, TaskResult
+
+    retention_seconds = get_result_store(config_registry.get().data).retention_seconds
+    deleted, _ = TaskResult.objects.get_all_expired(retention_seconds).delete()
+    GroupResult.objects.get_all_expired(retention_seconds).delete()
+    return deleted
@@ -46,18 +46,11 @@ def parse_abbyy_response(raw_data):
 
 # --- Helper Functions for ABBYY API V1 Workflow ---
 def get_abbyy_access_token():
-    """Step 1: Authenticate and get an access token."""
-    auth_url = f"{ABBYY_BASE_URL}/auth2/connect/token"
-    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    payload = {
-        'grant_type': 'client_credentials',
-        'client_id': settings.ABBYY_CLIENT_ID,
-        'client_secret': settings.ABBYY_CLIENT_SECRET,
-        'scope': 'openid permissions global.wildcard'
-    }
-    response = requests.post(auth_url, headers=headers, data=payload, verify=False)
-    response.raise_for_status()
-    return response.json()['access_token']
+    """Step 1: Get an access token from the shared, cached ABBYY token manager."""
+    from gemini_project.vault_utils import vault_client
+    from .abbyy_provider import AbbyyProvider
+    from .config_registry import config_registry
+    return AbbyyProvider(config_registry.get().data, vault_client).get_access_token()
 
 def create_abbyy_transaction(access_token, skill_id):
     """Step 2: Create an empty transaction."""
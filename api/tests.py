@@ -1,3 +1,920 @@
-from django.test import TestCase
+import datetime
+import decimal
+import io
+import json
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock, skipIf
+from django.test import SimpleTestCase
+from django.urls import reverse
 
-# Create your tests here.
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+import hvac.exceptions
+import requests
+from gemini_project.vault_utils import SecretCache
+from . import batches, json_codec, metrics, scheduling, task_events
+from .abbyy_auth import AbbyyTokenManager
+from .abbyy_extractor import AbbyyExtractor
+from .abbyy_polling import PollSchedule
+from .abbyy_provider import AbbyyProvider
+from .blob_store import LocalBlobStore
+from .config_registry import config_registry
+from .ocr_cache import OcrResultCache
+from .permissions import IsVaultAuthenticated, TokenValidationCache
+from .prompting import PromptTooLargeError
+from .llm_providers.base import BaseLLMProvider
+from .llm_providers.requests_provider import DEFAULT_HTTP_CONFIG, RequestsProvider
+from .multipart import StreamingMultipartEncoder
+from .map_reduce import map_reduce_analysis, split_extracted_data
+from .metrics import ABBYY_REQUEST_SECONDS
+from .llm_providers.hedging import HedgedLLMProvider, LLMDeadlineExceeded
+from .resilience import ProviderGuard, ProviderUnavailable
+from .result_store import TaskResultStore
+from .utils import parse_abbyy_response
+from .tasks import _match_abbyy_documents, poll_batch_transaction, process_document_analysis, run_llm_stage
+
+
+class FakeAsyncResult:
+    """Stands in for celery.result.AsyncResult with a fixed backend state."""
+    def __init__(self, status, info=None):
+        self.status = self.state = status
+        self.info = info
+        self.result = info
+
+    def failed(self):
+        return self.status == 'FAILURE'
+
+    def successful(self):
+        return self.status == 'SUCCESS'
+
+
+class PatchingTestCase(SimpleTestCase):
+    def patch(self, target, **kwargs):
+        """Patches `target` for the rest of the test."""
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+
+@skipIf(fakeredis is None, "fakeredis is not installed")
+class FakeRedisTestCase(PatchingTestCase):
+    """Points get_redis_client in each of `redis_modules` at one in-memory Redis per test."""
+    redis_modules = ()
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for module in self.redis_modules:
+            self.patch(f'{module}.get_redis_client', return_value=self.redis)
+
+
+class TaskResultStoreTests(FakeRedisTestCase):
+    redis_modules = ('api.result_store',)
+
+    def setUp(self):
+        super().setUp()
+        self.store = TaskResultStore()
+
+    def test_dead_task_reported_by_backend_is_failed(self):
+        self.store.save('task-1', {'task_id': 'task-1', 'status': 'OCR', 'timestamp': 1.0})
+        backend = FakeAsyncResult('FAILURE', info=RuntimeError('Worker exited prematurely'))
+        with mock.patch('api.result_store.AsyncResult', return_value=backend):
+            event = self.store.get('task-1')
+        self.assertEqual(event['status'], 'FAILURE')
+        self.assertIn('Worker exited prematurely', event['error'])
+        # Copied into the store, so the backend isn't needed again
+        self.assertEqual(self.store.get_state('task-1')['status'], 'FAILURE')
+
+    def test_running_task_keeps_stored_state(self):
+        self.store.save('task-1', {'task_id': 'task-1', 'status': 'LLM', 'timestamp': 1.0})
+        with mock.patch('api.result_store.AsyncResult', return_value=FakeAsyncResult('PENDING')):
+            self.assertEqual(self.store.get('task-1')['status'], 'LLM')
+
+    def test_fresh_state_does_not_consult_backend(self):
+        self.store.save('task-1', {'task_id': 'task-1', 'status': 'OCR', 'timestamp': time.time()})
+        with mock.patch('api.result_store.AsyncResult') as async_result:
+            self.assertEqual(self.store.get('task-1')['status'], 'OCR')
+        async_result.assert_not_called()
+
+    def test_silent_task_is_checked_once_per_interval(self):
+        self.store.save('task-1', {'task_id': 'task-1', 'status': 'LLM', 'timestamp': 1.0})
+        with mock.patch('api.result_store.AsyncResult', return_value=FakeAsyncResult('STARTED')) as async_result:
+            for _ in range(3):
+                self.assertEqual(self.store.get('task-1')['status'], 'LLM')
+        async_result.assert_called_once_with('task-1')
+
+    def test_final_state_does_not_consult_backend(self):
+        self.store.save('task-1', {'task_id': 'task-1', 'status': 'SUCCESS', 'timestamp': 1.0, 'result': {'a': 1}})
+        with mock.patch('api.result_store.AsyncResult') as async_result:
+            event = self.store.get('task-1')
+        async_result.assert_not_called()
+        self.assertEqual(event['result'], {'a': 1})
+
+
+class AnalysisStageTaskTests(FakeRedisTestCase):
+    redis_modules = ('api.result_store', 'api.task_events')
+
+    def test_exception_before_stage_handling_publishes_failed(self):
+        task_events.publish_event('task-2', task_events.QUEUED)
+        result = process_document_analysis.apply(
+            args=('0' * 64, 'spec.pdf', 'application/pdf', '', 'no-such-type', 'no-such-model'), task_id='task-2',
+        )
+        self.assertTrue(result.failed())
+        with mock.patch('api.result_store.AsyncResult', return_value=FakeAsyncResult('PENDING')):
+            event = task_events.current_event('task-2')
+        self.assertEqual(event['status'], task_events.FAILED)
+        self.assertEqual(event['error']['exc_type'], 'ValueError')
+
+
+class BatchStageTaskTests(FakeRedisTestCase):
+    redis_modules = ('api.batches',)
+
+    def setUp(self):
+        super().setUp()
+        self.documents = [
+            {'index': index, 'file_name': f'spec-{index}.pdf', 'doc_type_id': 'tender_spec', 'file_size': 100}
+            for index in range(3)
+        ]
+        batches.batch_tracker.create('batch-1', self.documents)
+
+    def test_exception_outside_stage_handling_fails_waiting_documents(self):
+        batches.batch_tracker.update_document('batch-1', 0, status=batches.OCR)
+        batches.batch_tracker.update_document('batch-1', 2, status=batches.LLM)
+        context = {'doc_type_id': 'tender_spec', 'model_id': 'test-model'}
+        with mock.patch('api.tasks.PollSchedule', side_effect=RuntimeError('bad polling config')):
+            result = poll_batch_transaction.apply(args=('batch-1', 'transaction-1', self.documents, context))
+        self.assertTrue(result.failed())
+        summary = batches.batch_tracker.get('batch-1')
+        self.assertEqual([document['status'] for document in summary['documents']], [batches.FAILED, batches.FAILED, batches.LLM])
+        self.assertEqual(summary['documents'][0]['error'], 'bad polling config')
+
+    def test_duplicate_file_names_are_paired_in_upload_order(self):
+        documents = [{'file_name': 'spec.pdf'}, {'file_name': 'spec.pdf'}, {'file_name': 'other.pdf'}]
+        status_data = {'documents': [
+            {'sourceFiles': [{'name': 'other.pdf'}]},
+            {'sourceFiles': [{'name': 'spec.pdf'}]},
+            {'sourceFiles': [{'name': 'spec.pdf'}]},
+        ]}
+        matches = _match_abbyy_documents(status_data, documents)
+        self.assertEqual([abbyy_index for _, abbyy_index in matches], [1, 2, 0])
+
+
+class ProviderGuardTests(FakeRedisTestCase):
+    redis_modules = ('api.resilience',)
+
+    def setUp(self):
+        super().setUp()
+        resilience_config = {'providers': {'google': {'failure_threshold': 3, 'open_seconds': 30}}}
+        self.patch('api.resilience.get_resilience_config', return_value=resilience_config)
+        self.guard = ProviderGuard('google', 'test-model', credential='key')
+
+    @staticmethod
+    def http_error(status_code, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        return requests.HTTPError(f"{status_code} Error", response=response)
+
+    def trip(self):
+        """Leaves the breaker half-open: the next call is the probe."""
+        self.redis.set(self.guard._key('tripped'), 1)
+
+    def stream(self, items):
+        with self.guard.call():
+            yield from items
+
+    def test_rate_limit_refuses_beyond_the_allowed_wait(self):
+        self.guard.limits.update(requests_per_second=0.1, burst=2)
+        self.guard.max_wait_seconds = 1
+        for _ in range(2):
+            with self.guard.call():
+                pass
+        with self.assertRaises(ProviderUnavailable) as raised:
+            with self.guard.call():
+                pass
+        self.assertGreater(raised.exception.retry_after, 1)
+
+    def test_breaker_opens_after_repeated_failures(self):
+        for _ in range(3):
+            with self.assertRaises(ProviderUnavailable):
+                with self.guard.call():
+                    raise requests.ConnectionError()
+        with self.assertRaises(ProviderUnavailable) as raised:
+            with self.guard.call():
+                self.fail("The circuit should be open")
+        self.assertIn('open', str(raised.exception))
+
+    def test_credentials_have_separate_breakers_without_exposing_them(self):
+        other = ProviderGuard('google', 'test-model', credential='other-key')
+        self.trip()
+        with other.call():
+            pass
+        self.assertEqual(other.name, 'google:test-model')
+        self.assertNotEqual(other._key('tripped'), self.guard._key('tripped'))
+
+    def test_transient_status_requeues_after_retry_after(self):
+        with self.assertRaises(ProviderUnavailable) as raised:
+            with self.guard.call():
+                raise self.http_error(429, {'Retry-After': '7'})
+        self.assertEqual(raised.exception.retry_after, 7)
+
+    def test_transient_status_without_retry_after_waits_open_seconds(self):
+        with self.assertRaises(ProviderUnavailable) as raised:
+            with self.guard.call():
+                raise self.http_error(503)
+        self.assertEqual(raised.exception.retry_after, 30)
+
+    def test_rejected_request_is_not_requeued(self):
+        with self.assertRaises(requests.HTTPError):
+            with self.guard.call():
+                raise self.http_error(400)
+
+    def test_failed_probe_reopens_the_circuit(self):
+        self.trip()
+        with self.assertRaises(ProviderUnavailable):
+            with self.guard.call():
+                raise self.http_error(503)
+        self.assertTrue(self.redis.exists(self.guard._key('open')))
+        self.assertFalse(self.redis.exists(self.guard._key('probe')))
+
+    def test_abandoned_stream_resolves_the_probe(self):
+        self.trip()
+        stream = self.stream(['first', 'second'])
+        self.assertEqual(next(stream), 'first')
+        self.assertTrue(self.redis.exists(self.guard._key('probe')))
+        stream.close()
+        self.assertFalse(self.redis.exists(self.guard._key('probe')))
+        self.assertFalse(self.redis.exists(self.guard._key('tripped')))
+        with self.guard.call():
+            pass
+
+    def test_interrupted_probe_lets_the_next_call_probe(self):
+        self.trip()
+        with self.assertRaises(KeyboardInterrupt):
+            with self.guard.call():
+                raise KeyboardInterrupt()
+        self.assertFalse(self.redis.exists(self.guard._key('probe')))
+        self.assertTrue(self.redis.exists(self.guard._key('tripped')))
+
+
+class StageSlotsTests(FakeRedisTestCase):
+    redis_modules = ('api.scheduling',)
+
+    def setUp(self):
+        super().setUp()
+        scheduling_config = {
+            'fair_share': {'enabled': True, 'max_running_per_caller': {'llm': 1}, 'lease_seconds': 60},
+        }
+        self.patch('api.scheduling.get_scheduling_config', return_value=scheduling_config)
+        self.slots = scheduling.StageSlots()
+
+    def test_caller_is_limited_per_stage(self):
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'alice', 'task-1'))
+        self.assertFalse(self.slots.acquire(scheduling.LLM, 'alice', 'task-2'))
+        # The same task may take its slot again, and other callers and stages aren't affected
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'alice', 'task-1'))
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'bob', 'task-3'))
+        self.assertTrue(self.slots.acquire(scheduling.INGEST, 'alice', 'task-4'))
+
+    def test_release_frees_the_slot(self):
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'alice', 'task-1'))
+        self.slots.release(scheduling.LLM, 'alice', 'task-1')
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'alice', 'task-2'))
+
+    def test_expired_lease_frees_the_slot(self):
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'alice', 'task-1'))
+        # As if task-1 was killed long ago without releasing its slot
+        self.redis.zadd(self.slots._key(scheduling.LLM, 'alice'), {'task-1': 1})
+        self.assertTrue(self.slots.acquire(scheduling.LLM, 'alice', 'task-2'))
+
+    def test_failed_stage_releases_its_slot(self):
+        context = {'doc_type_id': 'tender_spec', 'model_id': 'test-model', 'caller': 'alice'}
+        with mock.patch('api.tasks.run_llm_workflow', side_effect=RuntimeError('LLM failed')), \
+                mock.patch('api.tasks.task_events.publish_event'):
+            result = run_llm_stage.apply(args=(context, {}), task_id='task-1')
+        self.assertTrue(result.failed())
+        self.assertEqual(self.redis.zcard(self.slots._key(scheduling.LLM, 'alice')), 0)
+
+
+class OcrResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = OcrResultCache(directory.name, ttl_seconds=60, max_entries=2)
+
+    def test_hits_do_not_extend_the_ttl(self):
+        started = time.time()
+        with mock.patch('api.ocr_cache.time.time', return_value=started - 50):
+            self.cache.set('a' * 64, {'title': 'spec'})
+        self.assertEqual(self.cache.get('a' * 64)['extracted_data'], {'title': 'spec'})
+        with mock.patch('api.ocr_cache.time.time', return_value=started + 20):
+            self.assertIsNone(self.cache.get('a' * 64))
+
+    def test_least_recently_read_entry_is_evicted(self):
+        started = time.time()
+        for offset, key in enumerate(('a' * 64, 'b' * 64)):
+            with mock.patch('api.ocr_cache.time.time', return_value=started + offset):
+                self.cache.set(key, {'key': key})
+        with mock.patch('api.ocr_cache.time.time', return_value=started + 2):
+            self.cache.get('a' * 64)
+        with mock.patch('api.ocr_cache.time.time', return_value=started + 3):
+            self.cache.set('c' * 64, {'key': 'c'})
+        self.assertIsNotNone(self.cache.get('a' * 64))
+        self.assertIsNone(self.cache.get('b' * 64))
+
+
+class LocalBlobStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = LocalBlobStore(directory.name)
+
+    def test_same_content_is_stored_once(self):
+        first = self.store.put_chunks([b'spec ', b'sheet'], holder='task-1')
+        second = self.store.put_chunks([b'spec sheet'], holder='task-2')
+        self.assertEqual(first, second)
+        with self.store.open(first) as f:
+            self.assertEqual(f.read(), b'spec sheet')
+
+    def test_blob_is_deleted_with_its_last_holder(self):
+        blob_id = self.store.put_chunks([b'spec sheet'], holder='task-1')
+        self.store.acquire(blob_id, 'task-2')
+        self.store.release(blob_id, 'task-1')
+        self.assertTrue(self.store.path(blob_id).exists())
+        self.store.release(blob_id, 'task-2')
+        self.assertFalse(self.store.path(blob_id).exists())
+
+    def test_rejects_ids_that_are_not_digests(self):
+        with self.assertRaises(ValueError):
+            self.store.path('../config.yaml')
+
+
+class TaskEventsTests(FakeRedisTestCase):
+    redis_modules = ('api.result_store', 'api.task_events')
+
+    def setUp(self):
+        super().setUp()
+        self.patch('api.result_store.AsyncResult', return_value=FakeAsyncResult('PENDING'))
+
+    def test_stream_of_finished_task_ends_with_its_result(self):
+        task_events.publish_event('task-3', task_events.DONE, result={'a': 1})
+        events = list(task_events.iter_events('task-3', timeout=5))
+        self.assertEqual([event['status'] for event in events], [task_events.DONE])
+        self.assertEqual(events[0]['result'], {'a': 1})
+
+    def test_long_poll_returns_the_next_stage(self):
+        task_events.publish_event('task-3', task_events.QUEUED)
+        timer = threading.Timer(0.2, task_events.publish_event, args=('task-3', task_events.OCR))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        event = task_events.wait_for_change('task-3', task_events.QUEUED, timeout=5)
+        self.assertEqual(event['status'], task_events.OCR)
+
+    def test_long_poll_times_out_with_the_current_state(self):
+        task_events.publish_event('task-3', task_events.OCR)
+        event = task_events.wait_for_change('task-3', task_events.OCR, timeout=0.2)
+        self.assertEqual(event['status'], task_events.OCR)
+
+
+class FakeLLMProvider(BaseLLMProvider):
+    """Answers {'model': model_id} after `delay` seconds, or raises `error`."""
+    provider_name = 'fake'
+    supports_streaming = True
+
+    def __init__(self, model_id, delay=0, error=None):
+        super().__init__('key', model_id)
+        self.delay = delay
+        self.error = error
+        self.stream_closed = threading.Event()
+
+    def generate_analysis(self, prompt):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {'model': self.model_id}
+
+    def stream_analysis(self, prompt):
+        try:
+            for piece in ('{"model": ', f'"{self.model_id}"', '}'):
+                time.sleep(self.delay / 3)
+                yield piece, None
+        finally:
+            self.stream_closed.set()
+
+
+class HedgedLLMProviderTests(PatchingTestCase):
+    def setUp(self):
+        self.patch('api.llm_providers.hedging.LLM_POLICY_CALLS_TOTAL')
+
+    def test_fast_primary_wins_without_hedging(self):
+        fallback = FakeLLMProvider('fallback')
+        provider = HedgedLLMProvider(FakeLLMProvider('primary'), fallback, deadline_seconds=5, hedge_after_seconds=1)
+        self.assertEqual(provider.generate_analysis('prompt'), {'model': 'primary'})
+
+    def test_calls_keep_the_metric_labels_of_the_task(self):
+        class LabelledProvider(FakeLLMProvider):
+            def generate_analysis(self, prompt):
+                return metrics._context_labels.get()
+
+        token = metrics._context_labels.set({'doc_type_id': 'tender_spec'})
+        self.addCleanup(metrics._context_labels.reset, token)
+        provider = HedgedLLMProvider(LabelledProvider('primary'), deadline_seconds=5)
+        self.assertEqual(provider.generate_analysis('prompt'), {'doc_type_id': 'tender_spec'})
+
+    def test_slow_primary_is_hedged(self):
+        provider = HedgedLLMProvider(
+            FakeLLMProvider('primary', delay=2), FakeLLMProvider('fallback'), deadline_seconds=5, hedge_after_seconds=0.1,
+        )
+        self.assertEqual(provider.generate_analysis('prompt'), {'model': 'fallback'})
+
+    def test_failed_primary_is_hedged_at_once(self):
+        provider = HedgedLLMProvider(
+            FakeLLMProvider('primary', error=ValueError('bad reply')), FakeLLMProvider('fallback'),
+            deadline_seconds=5, hedge_after_seconds=10,
+        )
+        self.assertEqual(provider.generate_analysis('prompt'), {'model': 'fallback'})
+
+    def test_deadline(self):
+        provider = HedgedLLMProvider(
+            FakeLLMProvider('primary', delay=2), FakeLLMProvider('fallback', delay=2), deadline_seconds=0.3, hedge_after_seconds=0.1,
+        )
+        with self.assertRaises(LLMDeadlineExceeded):
+            provider.generate_analysis('prompt')
+
+    def test_losing_stream_is_closed(self):
+        primary = FakeLLMProvider('primary', delay=1.5)
+        provider = HedgedLLMProvider(primary, FakeLLMProvider('fallback', delay=0.1), deadline_seconds=5, hedge_after_seconds=0.1)
+        self.assertEqual(provider.generate_analysis_streaming('prompt'), {'model': 'fallback'})
+        self.assertTrue(primary.stream_closed.wait(2))
+
+
+class SecretCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.fetches = []
+        self.lease_duration = 0
+
+    def fetch(self, mount_point, secret_path):
+        self.fetches.append(secret_path)
+        return {'api_key': f'key-{len(self.fetches)}'}, self.lease_duration
+
+    def test_secret_is_read_once(self):
+        cache = SecretCache(self.fetch, ttl=60)
+        self.assertEqual(cache.get('kv', 'team'), {'api_key': 'key-1'})
+        self.assertEqual(cache.get('kv', 'team'), {'api_key': 'key-1'})
+        self.assertEqual(self.fetches, ['team'])
+
+    def test_concurrent_misses_share_one_read(self):
+        release = threading.Event()
+
+        def slow_fetch(mount_point, secret_path):
+            release.wait(2)
+            return self.fetch(mount_point, secret_path)
+
+        cache = SecretCache(slow_fetch, ttl=60)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('kv', 'team'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        # A waiter must not depend on the entry still being cached when it wakes up
+        cache.invalidate()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetches, ['team'])
+        self.assertEqual(results, [{'api_key': 'key-1'}] * 5)
+
+    def test_entry_is_refreshed_ahead_of_expiry(self):
+        cache = SecretCache(self.fetch, ttl=60, refresh_ahead=30)
+        cache.get('kv', 'team')
+        cache._entries[('kv', 'team')]['refresh_at'] = 0
+        # Still served from the cache while the refresh runs in the background
+        self.assertEqual(cache.get('kv', 'team'), {'api_key': 'key-1'})
+        for _ in range(100):
+            if cache._entries.get(('kv', 'team'), {}).get('data') == {'api_key': 'key-2'}:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('kv', 'team'), {'api_key': 'key-2'})
+
+    def test_refresh_of_invalidated_entry_is_skipped(self):
+        cache = SecretCache(self.fetch, ttl=60)
+        cache.get('kv', 'team')
+        cache.invalidate('kv', 'team')
+        cache._refresh_in_background(('kv', 'team'))
+        self.assertEqual(self.fetches, ['team'])
+
+    def test_invalidate_forces_a_new_read(self):
+        cache = SecretCache(self.fetch, ttl=60)
+        cache.get('kv', 'team')
+        cache.invalidate('kv', 'team')
+        self.assertEqual(cache.get('kv', 'team'), {'api_key': 'key-2'})
+
+    def test_long_lease_does_not_extend_the_ttl(self):
+        self.lease_duration = 768 * 3600
+        cache = SecretCache(self.fetch, ttl=60)
+        cache.get('kv', 'team')
+        entry = cache._entries[('kv', 'team')]
+        self.assertLessEqual(entry['expires_at'] - time.monotonic(), 60)
+
+
+def abbyy_field(name, *values):
+    return {'Name': name, 'List': [{'Value': value, 'Confidence': 0.9, 'Regions': [{'Page': 0}]} for value in values]}
+
+
+def abbyy_result(*fields):
+    return {'Transaction': {'Id': 't-1', 'Documents': [
+        {'Meta': {'Pages': [1, 2]}, 'ExtractedData': {'RootObject': {'Fields': list(fields)}}},
+    ]}}
+
+
+TENDER_RESULT = abbyy_result(
+    abbyy_field('tenderTitle', 'Pumps'),
+    abbyy_field('customer', 'ACME', 'ACME Ltd'),
+    abbyy_field('budget', 12500.5),
+    abbyy_field('notes'),
+    abbyy_field('techSpecs', *[
+        {'Fields': [abbyy_field('parameter', f'p{row}'), abbyy_field('value', row), abbyy_field('unit', 'kW')]}
+        for row in range(3)
+    ]),
+)
+
+
+class FakeResultResponse:
+    def __init__(self, raw_data):
+        self.content = raw_data if isinstance(raw_data, bytes) else json.dumps(raw_data).encode()
+        self.raw = io.BytesIO(self.content)
+
+    def json(self):
+        return json.loads(self.content)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.raw.close()
+
+
+class AbbyyExtractorTests(SimpleTestCase):
+    status_data = {'documents': [{'resultFiles': [{'fileId': 'f-1'}]}]}
+
+    def provider_returning(self, raw_data):
+        provider = AbbyyProvider.__new__(AbbyyProvider)
+        provider.config = {'base_url': 'https://abbyy.test', 'transactions_endpoint': '/transactions'}
+        provider._authorized_request = mock.Mock(side_effect=lambda *args, **kwargs: FakeResultResponse(raw_data))
+        return provider
+
+    def download_and_parse(self, raw_data):
+        return parse_abbyy_response(self.provider_returning(raw_data).download_result('t-1', self.status_data))
+
+    def stream_and_extract(self, raw_data, spec=None, **kwargs):
+        provider = self.provider_returning(raw_data)
+        return provider.extract_result('t-1', self.status_data, AbbyyExtractor(spec), **kwargs)
+
+    def test_streamed_extraction_matches_download_and_parse(self):
+        extracted_data, raw_data = self.stream_and_extract(TENDER_RESULT)
+        self.assertIsNone(raw_data)
+        self.assertEqual(extracted_data, self.download_and_parse(TENDER_RESULT))
+        self.assertEqual(extracted_data['customer'], 'ACME')
+        self.assertEqual(extracted_data['techSpecs'][2], {'parameter': 'p2', 'value': 2, 'unit': 'kW'})
+
+    def test_extraction_without_ijson_matches_download_and_parse(self):
+        with mock.patch('api.abbyy_extractor.ijson', None):
+            extracted_data, _ = self.stream_and_extract(TENDER_RESULT)
+        self.assertEqual(extracted_data, self.download_and_parse(TENDER_RESULT))
+
+    def test_keep_raw_returns_the_whole_result(self):
+        extracted_data, raw_data = self.stream_and_extract(TENDER_RESULT, keep_raw=True)
+        self.assertEqual(raw_data, TENDER_RESULT)
+        self.assertEqual(extracted_data, self.download_and_parse(TENDER_RESULT))
+
+    def test_missing_field_is_left_out(self):
+        spec = {'title': 'tenderTitle', 'deadline': 'deadline', 'specs': {'table': 'techSpecs', 'fields': {'unit': 'unit'}}}
+        extracted_data, _ = self.stream_and_extract(TENDER_RESULT, spec)
+        parsed = self.download_and_parse(TENDER_RESULT)
+        self.assertNotIn('deadline', parsed)
+        self.assertEqual(extracted_data, {'title': parsed['tenderTitle'], 'specs': [{'unit': 'kW'}] * 3})
+
+    def test_malformed_result_is_reported_like_the_parser(self):
+        malformed = {'Transaction': {'Documents': {'ExtractedData': {}}}}
+        extracted_data, _ = self.stream_and_extract(malformed)
+        self.assertEqual(extracted_data, self.download_and_parse(malformed))
+        self.assertIn('error', extracted_data)
+
+    def test_truncated_download_is_reported_as_an_error(self):
+        extracted_data, _ = self.stream_and_extract(json.dumps(TENDER_RESULT).encode()[:200])
+        self.assertIn('error', extracted_data)
+
+    def test_extraction_is_timed_as_its_own_operation(self):
+        with mock.patch.object(ABBYY_REQUEST_SECONDS, 'time') as time_call:
+            self.stream_and_extract(TENDER_RESULT)
+        time_call.assert_called_once_with(operation='extract_result')
+
+
+class RequestsProviderTests(PatchingTestCase):
+    def test_http_config_is_read_once_per_provider(self):
+        get_http_config = self.patch('api.llm_providers.requests_provider.get_http_config', return_value=DEFAULT_HTTP_CONFIG)
+        session = self.patch('api.llm_providers.requests_provider._get_session').return_value
+        session.request.return_value.status_code = 200
+        provider = RequestsProvider()
+        for _ in range(3):
+            provider.get('https://example.test/status')
+        get_http_config.assert_called_once_with()
+        session.request.assert_called_with('GET', 'https://example.test/status', timeout=(10, 300))
+
+
+class MapReduceTests(SimpleTestCase):
+    """Uses a fake LLM whose map answers are `partial_size` characters long and whose prompts are the data's JSON."""
+    def setUp(self):
+        self.data = {'title': 'Pumps', 'techSpecs': [{'parameter': f'p{row}', 'value': 'x' * 20} for row in range(40)]}
+        self.prompts = []
+        self.partial_size = 10
+        self.progress = []
+
+    @staticmethod
+    def measure(data):
+        return len(json.dumps(data))
+
+    def render(self, data, preamble):
+        return {'preamble': preamble, 'data': data}
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        data = prompt['data']
+        if 'partial_analyses' in data:
+            return {'rows': sum(partial['rows'] for partial in data['partial_analyses']), 'summary': 's' * self.partial_size}
+        return {'rows': len(data.get('techSpecs', [])), 'summary': 's' * self.partial_size}
+
+    def analyse(self, max_tokens):
+        return map_reduce_analysis(
+            self.data, self.render, self.generate, self.measure, max_tokens,
+            max_parallel=2, on_progress=lambda done, total: self.progress.append((done, total)),
+        )
+
+    def test_split_keeps_every_row_once_and_repeats_scalars(self):
+        chunks = split_extracted_data(self.data, self.measure, 400)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertEqual(chunk['title'], 'Pumps')
+            self.assertLessEqual(self.measure(chunk), 400)
+        self.assertEqual([row for chunk in chunks for row in chunk['techSpecs']], self.data['techSpecs'])
+
+    def test_data_that_fits_is_analysed_in_one_call(self):
+        self.assertEqual(self.analyse(10000)['rows'], 40)
+        self.assertEqual(self.prompts, [{'preamble': '', 'data': self.data}])
+
+    def test_partials_are_reduced_to_one_result(self):
+        result = self.analyse(400)
+        map_calls = [prompt for prompt in self.prompts if 'techSpecs' in prompt['data']]
+        self.assertEqual(result['rows'], 40)
+        self.assertEqual(len(self.prompts), len(map_calls) + 1)
+        self.assertEqual(self.progress[-1], (len(map_calls), len(map_calls)))
+
+    def test_partials_are_reduced_in_several_rounds(self):
+        self.partial_size = 120
+        result = self.analyse(400)
+        reduce_calls = [prompt for prompt in self.prompts if 'partial_analyses' in prompt['data']]
+        self.assertEqual(result['rows'], 40)
+        self.assertGreater(len(reduce_calls), 1)
+        for prompt in reduce_calls:
+            self.assertLessEqual(self.measure(prompt['data']), 400)
+
+    def test_partials_that_cannot_be_combined_fail(self):
+        self.partial_size = 300
+        with self.assertRaises(PromptTooLargeError):
+            self.analyse(400)
+        self.assertFalse([prompt for prompt in self.prompts if 'partial_analyses' in prompt['data']])
+
+
+class ConfigViewTests(SimpleTestCase):
+    def test_unchanged_config_is_revalidated_with_its_etag(self):
+        response = self.client.get(reverse('app-config'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], config_registry.get().etag)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        revalidated = self.client.get(reverse('app-config'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+    def test_stale_etag_gets_the_config(self):
+        response = self.client.get(reverse('app-config'), HTTP_IF_NONE_MATCH='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['document_types'], config_registry.get().data['document_types'])
+
+
+class TokenValidationCacheTests(PatchingTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.patch('api.caching.time.monotonic', side_effect=lambda: self.now)
+        self.cache = TokenValidationCache(max_ttl_seconds=300, negative_ttl_seconds=30)
+        self.key = TokenValidationCache.make_key('s.token')
+
+    def test_rejected_token_is_remembered_for_the_negative_ttl(self):
+        self.cache.set_rejected(self.key)
+        self.now += 29
+        self.assertEqual(self.cache.get(self.key), (False, None))
+        self.now += 2
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_valid_token_is_remembered_until_its_own_ttl(self):
+        self.cache.set_valid(self.key, token_ttl=60, identity='entity-1')
+        self.now += 59
+        self.assertEqual(self.cache.get(self.key), (True, 'entity-1'))
+        self.now += 2
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_valid_token_ttl_is_capped(self):
+        for token_ttl in (3600, 0):
+            self.cache.set_valid(self.key, token_ttl=token_ttl)
+            self.now += 299
+            self.assertEqual(self.cache.get(self.key), (True, None))
+            self.now += 2
+            self.assertIsNone(self.cache.get(self.key))
+
+    def test_permission_answers_repeated_tokens_from_the_cache(self):
+        self.patch('api.permissions.get_token_cache', return_value=self.cache)
+        lookup = self.patch('api.permissions.vault_client').client.auth.token.lookup
+        lookup.side_effect = hvac.exceptions.Forbidden()
+        request = mock.Mock(headers={'Authorization': 'Bearer s.token'})
+        for _ in range(2):
+            self.assertFalse(IsVaultAuthenticated().has_permission(request, None))
+        self.assertEqual(lookup.call_count, 1)
+
+        self.now += 31
+        lookup.side_effect = None
+        lookup.return_value = {'data': {'ttl': 600, 'entity_id': 'entity-1'}}
+        for _ in range(2):
+            self.assertTrue(IsVaultAuthenticated().has_permission(request, None))
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(request.vault_identity, 'entity-1')
+
+    def test_lookup_errors_are_not_cached(self):
+        self.patch('api.permissions.get_token_cache', return_value=self.cache)
+        lookup = self.patch('api.permissions.vault_client').client.auth.token.lookup
+        lookup.side_effect = requests.ConnectionError()
+        request = mock.Mock(headers={'Authorization': 'Bearer s.token'})
+        self.assertFalse(IsVaultAuthenticated().has_permission(request, None))
+        self.assertIsNone(self.cache.get(self.key))
+
+
+class AbbyyTokenManagerTests(PatchingTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.patch('api.abbyy_auth.time.time', side_effect=lambda: self.now)
+        self.fetches = 0
+
+    def fetch_token(self):
+        self.fetches += 1
+        return f'token-{self.fetches}', 3600
+
+    def manager(self, share_via_redis=False):
+        return AbbyyTokenManager(self.fetch_token, 'docanalyzer:abbyy-token:test', refresh_margin=60, share_via_redis=share_via_redis)
+
+    def test_token_is_refreshed_before_it_expires(self):
+        manager = self.manager()
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.now += 3539
+        self.assertEqual(manager.get_token(), 'token-1')
+        self.now += 2
+        self.assertEqual(manager.get_token(), 'token-2')
+
+    @skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_workers_share_one_token(self):
+        self.patch('api.abbyy_auth.get_redis_client', return_value=fakeredis.FakeRedis())
+        self.assertEqual(self.manager(share_via_redis=True).get_token(), 'token-1')
+        self.assertEqual(self.manager(share_via_redis=True).get_token(), 'token-1')
+        self.assertEqual(self.fetches, 1)
+
+    def test_rejected_token_is_replaced_and_the_request_retried_once(self):
+        provider = AbbyyProvider.__new__(AbbyyProvider)
+        provider.guard = mock.MagicMock()
+        provider.token_manager = self.manager()
+        provider.http_client = mock.Mock()
+        responses = [mock.Mock(status_code=401), mock.Mock(status_code=200), mock.Mock(status_code=401), mock.Mock(status_code=401)]
+        provider.http_client.get.side_effect = responses
+
+        self.assertIs(provider._authorized_request('GET', 'https://abbyy.test/status'), responses[1])
+        tokens = [call.kwargs['headers']['Authorization'] for call in provider.http_client.get.call_args_list]
+        self.assertEqual(tokens, ['Bearer token-1', 'Bearer token-2'])
+
+        # A second 401 in a row is an error rather than another token exchange
+        responses[3].raise_for_status.side_effect = requests.HTTPError("401 Error")
+        with self.assertRaises(requests.HTTPError):
+            provider._authorized_request('GET', 'https://abbyy.test/status')
+        self.assertEqual(self.fetches, 3)
+
+
+class PollScheduleTests(FakeRedisTestCase):
+    redis_modules = ('api.abbyy_polling',)
+
+    def setUp(self):
+        super().setUp()
+        self.schedule = PollSchedule({'initial_delay_seconds': 5, 'min_interval_seconds': 2, 'max_interval_seconds': 30,
+                                      'backoff_factor': 2, 'history_weight': 0.5})
+
+    def test_first_check_without_history_uses_the_initial_delay(self):
+        self.assertEqual(self.schedule.first_delay('skill', 100_000), 5)
+
+    def test_first_check_follows_the_learned_processing_time(self):
+        self.schedule.record('skill', 100_000, 40)
+        self.assertEqual(self.schedule.first_delay('skill', 100_000), 32)
+        self.schedule.record('skill', 100_000, 20)
+        self.assertEqual(self.schedule.first_delay('skill', 100_000), 24)
+        # Other skills and size buckets keep their own history
+        self.assertEqual(self.schedule.first_delay('other-skill', 100_000), 5)
+        self.assertEqual(self.schedule.first_delay('skill', 10_000_000), 5)
+
+    def test_fast_history_never_checks_before_the_minimum_interval(self):
+        self.schedule.record('skill', 100_000, 1)
+        self.assertEqual(self.schedule.first_delay('skill', 100_000), 2)
+
+    def test_later_checks_back_off_up_to_the_ceiling(self):
+        self.assertEqual([self.schedule.next_delay(attempt) for attempt in range(6)], [2, 4, 8, 16, 30, 30])
+
+
+class StreamingMultipartEncoderTests(PatchingTestCase):
+    def setUp(self):
+        self.file_obj = tempfile.TemporaryFile()
+        self.addCleanup(self.file_obj.close)
+        self.content = bytes(range(256)) * 40 + b'\r\n--tail'
+        self.file_obj.write(self.content)
+
+    def requests_body(self, encoder, file_name, content_type):
+        self.patch('urllib3.filepost.choose_boundary', return_value=encoder.boundary)
+        request = requests.Request(
+            'POST', 'https://abbyy.test/files', files={'file': (file_name, self.content, content_type)},
+        ).prepare()
+        return request.body, request.headers['Content-Type']
+
+    def test_body_matches_the_requests_encoder(self):
+        for file_name, content_type in (('tender.pdf', 'application/pdf'), ('Angebot "final" ä.pdf', None)):
+            with self.subTest(file_name=file_name):
+                encoder = StreamingMultipartEncoder('file', self.file_obj, file_name, content_type, chunk_size=1000)
+                body, requests_content_type = self.requests_body(encoder, file_name, content_type)
+                self.assertEqual(b''.join(encoder), body)
+                self.assertEqual(len(encoder), len(body))
+                self.assertEqual(encoder.content_type, requests_content_type)
+
+    def test_iterating_again_resends_the_whole_body(self):
+        encoder = StreamingMultipartEncoder('file', self.file_obj, 'tender.pdf', 'application/pdf', chunk_size=1000)
+        first = b''.join(encoder)
+        self.assertEqual(b''.join(encoder), first)
+        self.assertEqual(encoder.stats()['bytes'], len(self.content))
+        self.assertGreater(len(list(encoder)), 2)
+
+
+class JsonCodecTests(SimpleTestCase):
+    data = {
+        'title': 'Pumpen für Übersee – 東京',
+        'budget': 12500.5,
+        'count': 3,
+        'large': 2 ** 70,
+        'flags': [True, False, None],
+        'nested': {'empty': {}, 'rows': [], 1: 'int key'},
+        'escaped': 'quote " backslash \\ newline \n tab \t \u2028',
+    }
+    special = {
+        'when': datetime.datetime(2024, 5, 1, 12, 30),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'amount': decimal.Decimal('10.25'),
+        'raw': b'bytes',
+    }
+
+    def stdlib(self, obj, **kwargs):
+        return json.dumps(obj, ensure_ascii=False, default=json_codec._default, **kwargs).encode('utf-8')
+
+    def test_output_matches_the_json_module(self):
+        for backend in (json_codec.orjson, None):
+            with self.subTest(orjson=backend is not None), mock.patch('api.json_codec.orjson', backend):
+                for obj in (self.data, self.special):
+                    self.assertEqual(json_codec.dumps_bytes(obj), self.stdlib(obj, separators=(',', ':')))
+                    self.assertEqual(json_codec.dumps_bytes(obj, pretty=True), self.stdlib(obj, indent=2))
+                    self.assertEqual(json_codec.dumps(obj), self.stdlib(obj, separators=(',', ':')).decode('utf-8'))
+
+    def test_either_backend_reads_what_the_other_wrote(self):
+        floats = {'small': 1e-7, 'big': 1e20, 'fraction': 0.1}
+        for written_with in (json_codec.orjson, None):
+            with mock.patch('api.json_codec.orjson', written_with):
+                encoded = json_codec.dumps_bytes({**self.data, **floats})
+            for read_with in (json_codec.orjson, None):
+                with self.subTest(written_with=written_with, read_with=read_with), mock.patch('api.json_codec.orjson', read_with):
+                    self.assertEqual(json_codec.loads(memoryview(encoded)), json.loads(self.stdlib({**self.data, **floats})))
+                    self.assertEqual(json_codec.loads(encoded.decode('utf-8'))['small'], 1e-7)
+
+    def test_invalid_json_raises_value_error(self):
+        for backend in (json_codec.orjson, None):
+            with self.subTest(orjson=backend is not None), mock.patch('api.json_codec.orjson', backend):
+                with self.assertRaises(ValueError):
+                    json_codec.loads(b'{"truncated": ')
+
+    def test_unknown_types_raise_type_error(self):
+        for backend in (json_codec.orjson, None):
+            with self.subTest(orjson=backend is not None), mock.patch('api.json_codec.orjson', backend):
+                with self.assertRaises(TypeError):
+                    json_codec.dumps_bytes({'value': object()})
@@ -1,9 +1,13 @@
 # api/urls.py
 from django.urls import path
-from .views import FullAnalysisView, TaskStatusView, ConfigView
+from .views import FullAnalysisView, TaskStatusView, ConfigView, BatchAnalysisView, BatchStatusView, TaskEventsView, MetricsView
 
 urlpatterns = [
     path('analyze/', FullAnalysisView.as_view(), name='start-analysis'),
     path('task-status/<str:task_id>/', TaskStatusView.as_view(), name='task-status'),
+    path('task-events/<str:task_id>/', TaskEventsView.as_view(), name='task-events'),
+    path('analyze/batch/', BatchAnalysisView.as_view(), name='start-batch-analysis'),
+    path('batch-status/<str:batch_id>/', BatchStatusView.as_view(), name='batch-status'),
     path('config/', ConfigView.as_view(), name='app-config'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
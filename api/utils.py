@@ -1,5 +1,5 @@
 # api/utils.py
-import json
+from . import json_codec
 
 def parse_abbyy_response(raw_data):
     """
@@ -51,7 +51,7 @@ def parse_gemini_response(response_data):
             cleaned_json_string = part['text'].strip()
             if not cleaned_json_string:
                 raise ValueError("Gemini returned an empty text response.")
-            return json.loads(cleaned_json_string)
+            return json_codec.loads(cleaned_json_string)
         else:
             raise ValueError(f"Unexpected Gemini response format. Content: {content}")
     except (KeyError, IndexError) as e:
@@ -1,17 +1,25 @@
 # api/views.py
-import base64
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import BaseRenderer
 from rest_framework import status
-from celery.result import AsyncResult
-from .tasks import process_document_analysis
+from celery import uuid
+from .tasks import process_document_analysis, process_batch_transaction
 from .permissions import IsVaultAuthenticated
+from .config_registry import config_registry
+from .blob_store import get_blob_store
+from .batches import batch_tracker
+from . import task_events
+from . import metrics
+from .scheduling import assign_priority
+from . import json_codec
+from .renderers import FastJSONRenderer
 
 # api/views.py
-import yaml
-from pathlib import Path
-from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny # No authentication needed for this
@@ -22,13 +30,19 @@ class ConfigView(APIView):
     permission_classes = [AllowAny] # Anyone can access this config
 
     def get(self, request, *args, **kwargs):
-        config_path = Path(settings.BASE_DIR) / 'config.yaml'
         try:
-            with open(config_path, 'r') as f:
-                config_data = yaml.safe_load(f)
-            return Response(config_data)
+            config = config_registry.get()
         except FileNotFoundError:
             return Response({"error": "Configuration file not found."}, status=500)
+
+        # The frontend re-fetches this on every load; let it revalidate with the ETag
+        if config.etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(config.data)
+        response['ETag'] = config.etag
+        patch_cache_control(response, no_cache=True)
+        return response
         
 
 class FullAnalysisView(APIView):
@@ -41,37 +55,209 @@ class FullAnalysisView(APIView):
         # Get the new parameters from the request
         doc_type_id = request.data.get('doc_type_id')
         model_id = request.data.get('model_id')
+        # Lets the caller force fresh ABBYY and LLM runs instead of serving cached results
+        bypass_cache = str(request.data.get('bypass_cache', '')).lower() in ('1', 'true', 'yes')
 
         if not all([uploaded_file, doc_type_id, model_id]):
             return Response({"error": "Missing required fields: document, doc_type_id, model_id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        config = config_registry.get()
+        if not config.get_document_type(doc_type_id) or not config.get_model(model_id):
+            return Response({"error": "Invalid document type or model ID."}, status=status.HTTP_400_BAD_REQUEST)
         
-        file_content_b64 = base64.b64encode(uploaded_file.read()).decode('utf-8')
-        
+        # Stream the upload to the blob store; only its content hash goes through the broker
+        blob_store = get_blob_store(config.data)
+        task_id = uuid()
+        blob_id = blob_store.put_chunks(uploaded_file.chunks(), holder=task_id)
+        # Published before dispatch so it can never overwrite a later stage
+        task_events.publish_event(task_id, task_events.QUEUED)
+
+        # Every stage of the analysis runs with this priority (see api/scheduling.py)
+        caller = getattr(request, 'vault_identity', None)
+        priority = assign_priority(config.get_document_type(doc_type_id), caller)
+
         # Pass the new parameters to the Celery task
-        task = process_document_analysis.delay(
-            file_content_b64, 
-            uploaded_file.name, 
-            uploaded_file.content_type, 
-            rag_text,
-            doc_type_id,
-            model_id
+        task = process_document_analysis.apply_async(
+            args=(
+                blob_id,
+                uploaded_file.name,
+                uploaded_file.content_type,
+                rag_text,
+                doc_type_id,
+                model_id,
+            ),
+            kwargs={'bypass_cache': bypass_cache, 'caller': caller, 'priority': priority},
+            task_id=task_id,
+            priority=priority,
         )
 
         return Response({"task_id": task.id}, status=status.HTTP_202_ACCEPTED)
 
 
+class BatchAnalysisView(APIView):
+    """
+    Starts the analysis of several documents at once. Documents of the same
+    type share ABBYY transactions; progress is reported per document.
+    """
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [IsVaultAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        uploaded_files = request.FILES.getlist('documents')
+        # Either one doc_type_id for the whole batch, or one per document in upload order
+        doc_type_ids = request.data.getlist('doc_type_id')
+        model_id = request.data.get('model_id')
+        rag_text = request.data.get('ragText', '')
+        bypass_cache = str(request.data.get('bypass_cache', '')).lower() in ('1', 'true', 'yes')
+
+        if not all([uploaded_files, doc_type_ids, model_id]):
+            return Response({"error": "Missing required fields: documents, doc_type_id, model_id"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(doc_type_ids) == 1:
+            doc_type_ids = doc_type_ids * len(uploaded_files)
+        if len(doc_type_ids) != len(uploaded_files):
+            return Response({"error": "Provide one doc_type_id, or one per document."}, status=status.HTTP_400_BAD_REQUEST)
+
+        config = config_registry.get()
+        batch_config = config.data.get('batch', {})
+        if len(uploaded_files) > batch_config.get('max_documents', 100):
+            return Response({"error": f"A batch can contain at most {batch_config.get('max_documents', 100)} documents."}, status=status.HTTP_400_BAD_REQUEST)
+        if not config.get_model(model_id) or not all(config.get_document_type(doc_type_id) for doc_type_id in doc_type_ids):
+            return Response({"error": "Invalid document type or model ID."}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch_id = uuid()
+        blob_store = get_blob_store(config.data)
+        documents = []
+        for index, (uploaded_file, doc_type_id) in enumerate(zip(uploaded_files, doc_type_ids)):
+            holder = f"{batch_id}-{index}"
+            blob_id = blob_store.put_chunks(uploaded_file.chunks(), holder=holder)
+            documents.append({
+                'index': index,
+                'blob_id': blob_id,
+                'holder': holder,
+                'file_name': uploaded_file.name,
+                'content_type': uploaded_file.content_type,
+                'file_size': uploaded_file.size,
+                'doc_type_id': doc_type_id,
+            })
+        batch_tracker.create(batch_id, documents)
+
+        # One ABBYY transaction per document type, split if it gets too large
+        max_files = batch_config.get('max_files_per_transaction', 20)
+        by_doc_type = {}
+        for document in documents:
+            by_doc_type.setdefault(document['doc_type_id'], []).append(document)
+        caller = getattr(request, 'vault_identity', None)
+        for doc_type_id, group in by_doc_type.items():
+            priority = assign_priority(config.get_document_type(doc_type_id), caller, documents=len(group))
+            context = {
+                'doc_type_id': doc_type_id,
+                'model_id': model_id,
+                'manual_rag_text': rag_text,
+                'bypass_cache': bypass_cache,
+                'caller': caller,
+                'priority': priority,
+            }
+            for start in range(0, len(group), max_files):
+                process_batch_transaction.apply_async((batch_id, group[start:start + max_files], context), priority=priority)
+
+        return Response({
+            "batch_id": batch_id,
+            "documents": [{"index": document['index'], "file_name": document['file_name']} for document in documents],
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class BatchStatusView(APIView):
+    """Reports the overall status of a batch and the progress of each document."""
+    permission_classes = [IsVaultAuthenticated]
+
+    def get(self, request, batch_id, *args, **kwargs):
+        summary = batch_tracker.get(batch_id)
+        if summary is None:
+            return Response({"error": "Unknown batch ID."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(summary, status=status.HTTP_200_OK)
+
+
 class TaskStatusView(APIView):
-    """Checks the status of a Celery task."""
+    """
+    Checks the status of a Celery task. With ?wait=<seconds>&since=<status>
+    it long-polls: the response is held until the status moves on from
+    `since` (or `wait` runs out), for clients that can't use task-events.
+    A held request occupies a server worker, so `wait` is capped short.
+    """
     permission_classes = [IsVaultAuthenticated]
+    max_wait_seconds = 20
 
     def get(self, request, task_id, *args, **kwargs):
-        task_result = AsyncResult(task_id)
-        
-        if task_result.failed():
+        wait = request.query_params.get('wait')
+        if wait:
+            try:
+                wait_seconds = min(float(wait), self.max_wait_seconds)
+            except ValueError:
+                return Response({"error": "wait must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+            event = task_events.wait_for_change(task_id, request.query_params.get('since'), wait_seconds)
+            result = {key: event[key] for key in ('status', 'result', 'error', 'info') if key in event}
+            return Response(result, status=status.HTTP_200_OK)
+
+        # Served from the result store: one small read per poll. Pass
+        # include_result=false to get just the status of a finished task.
+        include_result = request.query_params.get('include_result', 'true').lower() not in ('0', 'false', 'no')
+        event = task_events.current_event(task_id, include_result=include_result)
+
+        if event['status'] in (task_events.FAILED, task_events.REVOKED):
             # Access the custom error message if available
-            error_info = task_result.info if isinstance(task_result.info, dict) else str(task_result.info)
-            result = {"status": task_result.status, "error": error_info}
+            result = {"status": event['status'], "error": event.get('error')}
         else:
-            result = {"status": task_result.status, "result": task_result.result}
-            
-        return Response(result, status=status.HTTP_200_OK)
\ No newline at end of file
+            result = {"status": event['status'], "result": event.get('result', event.get('info'))}
+
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients that send Accept: text/event-stream pass content negotiation."""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only error responses (e.g. 403) are rendered here; streams bypass renderers
+        return json_codec.dumps_bytes(data)
+
+
+class TaskEventsView(APIView):
+    """
+    Streams a task's stage transitions (QUEUED -> OCR -> LLM -> SUCCESS/FAILURE)
+    as Server-Sent Events. The final result is sent once, in the last event.
+    An open stream occupies a server worker, so it closes after
+    `max_stream_seconds` and clients reconnect (after the `retry:` delay).
+    Keeping it short stops a few open dashboards from starving uploads.
+    """
+    permission_classes = [IsVaultAuthenticated]
+    renderer_classes = [FastJSONRenderer, EventStreamRenderer]
+    max_stream_seconds = 25
+    heartbeat_seconds = 10
+
+    def get(self, request, task_id, *args, **kwargs):
+        def event_stream():
+            # Tell EventSource-style clients how long to wait before reconnecting
+            yield "retry: 1000\n\n"
+            for event in task_events.iter_events(task_id, self.max_stream_seconds, self.heartbeat_seconds):
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: status\ndata: {json_codec.dumps(event)}\n\n"
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx and similar proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MetricsView(APIView):
+    """
+    Exposes per-stage latency, size and cache metrics, aggregated across all
+    Celery workers, in the Prometheus text format.
+    """
+    permission_classes = [AllowAny] # Scraped by Prometheus; only aggregate numbers, no document data
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
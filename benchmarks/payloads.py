@@ -0,0 +1,86 @@
+# benchmarks/payloads.py
+"""
+Synthetic, deterministic payloads shaped like the ones the pipeline sees in
+production: ABBYY Vantage transaction results, Gemini generateContent
+responses and raw document uploads.
+"""
+import json
+import random
+
+_SPEC_COLUMNS = ('parameter', 'value', 'unit', 'notes')
+
+
+def _field(name, value):
+    return {'Name': name, 'List': [{'Value': value}]}
+
+
+def abbyy_result(rows, seed=0):
+    """Returns an ABBYY result with a `techSpecs` table of `rows` rows plus the usual scalar fields."""
+    rng = random.Random(seed)
+    spec_rows = []
+    for index in range(rows):
+        spec_rows.append({
+            'Value': {
+                'Fields': [
+                    _field('parameter', f"Parameter {index}"),
+                    _field('value', str(rng.randint(1, 100000))),
+                    _field('unit', rng.choice(('mm', 'kg', 'kW', 'pcs', 'm2'))),
+                    _field('notes', ' '.join(rng.choice(('min', 'max', 'nominal', 'per unit', 'approx')) for _ in range(3))),
+                ]
+            }
+        })
+    fields = [
+        _field('tenderTitle', 'Supply and installation of industrial equipment'),
+        _field('customer', 'Example Procurement Agency'),
+        _field('deadline', '2026-12-31'),
+        _field('budget', '1 250 000 EUR'),
+        {'Name': 'techSpecs', 'List': spec_rows},
+    ]
+    return {'Transaction': {'Documents': [{'ExtractedData': {'RootObject': {'Fields': fields}}}]}}
+
+
+def extracted_data(rows, seed=0):
+    """Returns what parse_abbyy_response produces for abbyy_result(rows, seed)."""
+    rng = random.Random(seed)
+    spec_rows = []
+    for index in range(rows):
+        spec_rows.append({
+            'parameter': f"Parameter {index}",
+            'value': str(rng.randint(1, 100000)),
+            'unit': rng.choice(('mm', 'kg', 'kW', 'pcs', 'm2')),
+            'notes': ' '.join(rng.choice(('min', 'max', 'nominal', 'per unit', 'approx')) for _ in range(3)),
+        })
+    return {
+        'tenderTitle': 'Supply and installation of industrial equipment',
+        'customer': 'Example Procurement Agency',
+        'deadline': '2026-12-31',
+        'budget': '1 250 000 EUR',
+        'techSpecs': spec_rows,
+    }
+
+
+def gemini_response(rows, seed=0):
+    """Returns a generateContent response whose text part is a JSON analysis with `rows` line items."""
+    rng = random.Random(seed)
+    analysis = {
+        'proposal': {
+            'title': 'Proposal',
+            'line_items': [
+                {'item': f"Item {index}", 'cost': rng.randint(100, 10000), 'notes': 'Included in scope'}
+                for index in range(rows)
+            ],
+        }
+    }
+    return {
+        'candidates': [{
+            'content': {'parts': [{'text': json.dumps(analysis, indent=2)}], 'role': 'model'},
+            'finishReason': 'STOP',
+        }],
+        'usageMetadata': {'promptTokenCount': rows * 20, 'candidatesTokenCount': rows * 15},
+    }
+
+
+def upload_bytes(size, seed=0):
+    """Returns `size` bytes of incompressible, PDF-like content."""
+    rng = random.Random(seed)
+    return b'%PDF-1.7\n' + rng.randbytes(max(size - 9, 0))
@@ -0,0 +1,273 @@
+# benchmarks/run.py
+"""
+Micro-benchmarks for the CPU-bound stages of the analysis pipeline.
+
+Runs fully offline: every input is synthetic (see payloads.py) and nothing
+touches Vault, ABBYY, Gemini, Redis or the Django settings.
+
+    python -m benchmarks.run                     # run and compare with baseline.json
+    python -m benchmarks.run --quick             # skip the largest inputs
+    python -m benchmarks.run --filter parse      # only benchmarks whose name contains 'parse'
+    python -m benchmarks.run --update-baseline   # record the current numbers as the baseline
+    python -m benchmarks.run --fail-on-regression  # exit with status 1 on regressions (e.g. in CI)
+
+Each case reports the best per-call time over several repeats and the peak
+memory allocated during one call (tracemalloc), and cases that are slower or
+use more memory than the baseline allows are listed. Timings are absolute, so
+they are only comparable with a baseline recorded on the same machine; the
+run therefore only fails on regressions with --fail-on-regression, which is
+meant for a machine that recorded its own baseline.
+"""
+import argparse
+import base64
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import yaml
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from api import json_codec  # noqa: E402
+from api.abbyy_extractor import AbbyyExtractor  # noqa: E402
+from api.prompting import render_prompt as render_budgeted_prompt  # noqa: E402
+from api.utils import parse_abbyy_response, parse_gemini_response  # noqa: E402
+from benchmarks import payloads  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+ROWS = (10, 100, 1000, 10000, 100000)
+UPLOAD_SIZES = (10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 50 * 1024 * 1024)
+QUICK_MAX_ROWS = 10000
+QUICK_MAX_UPLOAD_SIZE = 1024 * 1024
+
+# Token budgeting as in api.prompting; large enough that nothing is truncated
+MODEL_CONFIG = {'id': 'benchmark', 'max_prompt_tokens': 10 ** 8, 'chars_per_token': 4}
+
+# Differences below these floors are treated as noise
+TIME_NOISE_FLOOR = 50e-6
+MEMORY_NOISE_FLOOR = 64 * 1024
+
+
+def _load_prompt_template(doc_type_id='tender_spec'):
+    with open(BASE_DIR / 'config.yaml', 'r') as f:
+        config_data = yaml.safe_load(f)
+    doc_type = next(dt for dt in config_data['document_types'] if dt['id'] == doc_type_id)
+    with open(BASE_DIR / doc_type['prompt_template'], 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _load_abbyy_extractor(doc_type_id='tender_spec'):
+    with open(BASE_DIR / 'config.yaml', 'r') as f:
+        config_data = yaml.safe_load(f)
+    doc_type = next(dt for dt in config_data['document_types'] if dt['id'] == doc_type_id)
+    return AbbyyExtractor(doc_type.get('abbyy_fields'))
+
+
+def render_prompt(template, extracted_data):
+    """The original pretty-printed prompt rendering, kept as a reference point."""
+    return template.format(extracted_data=json.dumps(extracted_data, indent=2), manual_rag_text='Budget is fixed.')
+
+
+def _task_payloads(rows):
+    return payloads.extracted_data(rows), json.dumps(payloads.gemini_response(rows)).encode('utf-8')
+
+
+def task_json(dumps, loads):
+    """
+    The JSON work of one analysis task: the prompt, the Gemini reply and its
+    analysis text, then the result as encoded for Celery, the result store
+    and the API response, and decoded once by the status endpoint.
+    """
+    def run(task_payloads):
+        extracted_data, gemini_body = task_payloads
+        dumps(extracted_data)
+        response_data = loads(gemini_body)
+        analysis = loads(response_data['candidates'][0]['content']['parts'][0]['text'])
+        result = {'status': 'SUCCESS', 'extracted_data': extracted_data, 'analysis': analysis}
+        for _ in range(3):
+            encoded = dumps(result)
+        return loads(encoded)
+    return run
+
+
+class Benchmark:
+    """A function benchmarked over a range of input sizes. `setup(size)` builds the argument."""
+    def __init__(self, name, func, setup, sizes, quick_max):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.sizes = sizes
+        self.quick_max = quick_max
+
+    def cases(self, quick=False):
+        for size in self.sizes:
+            if quick and size > self.quick_max:
+                continue
+            yield f"{self.name}[{size}]", size
+
+
+def _benchmarks():
+    template = _load_prompt_template()
+    extractor = _load_abbyy_extractor()
+    return [
+        Benchmark('parse_abbyy_response', parse_abbyy_response, payloads.abbyy_result, ROWS, QUICK_MAX_ROWS),
+        Benchmark(
+            'extract_abbyy_result', extractor.extract, lambda rows: json.dumps(payloads.abbyy_result(rows)).encode('utf-8'),
+            ROWS, QUICK_MAX_ROWS,
+        ),
+        Benchmark('parse_gemini_response', parse_gemini_response, payloads.gemini_response, ROWS, QUICK_MAX_ROWS),
+        Benchmark(
+            'render_prompt', lambda data: render_prompt(template, data), payloads.extracted_data,
+            ROWS, QUICK_MAX_ROWS,
+        ),
+        Benchmark(
+            'render_prompt_compact',
+            lambda data: render_budgeted_prompt(template, data, 'Budget is fixed.', MODEL_CONFIG, encoding='compact', measure_baseline=False),
+            payloads.extracted_data, ROWS, QUICK_MAX_ROWS,
+        ),
+        Benchmark(
+            'render_prompt_tabular',
+            lambda data: render_budgeted_prompt(template, data, 'Budget is fixed.', MODEL_CONFIG, encoding='tabular', measure_baseline=False),
+            payloads.extracted_data, ROWS, QUICK_MAX_ROWS,
+        ),
+        # Compare the two to see the CPU saved per task by api.json_codec (orjson when installed)
+        Benchmark(
+            'task_json_stdlib', task_json(lambda obj: json.dumps(obj).encode('utf-8'), json.loads), _task_payloads,
+            ROWS, QUICK_MAX_ROWS,
+        ),
+        Benchmark(
+            'task_json_codec', task_json(json_codec.dumps_bytes, json_codec.loads), _task_payloads,
+            ROWS, QUICK_MAX_ROWS,
+        ),
+        Benchmark('b64encode', base64.b64encode, payloads.upload_bytes, UPLOAD_SIZES, QUICK_MAX_UPLOAD_SIZE),
+        Benchmark(
+            'b64decode', base64.b64decode, lambda size: base64.b64encode(payloads.upload_bytes(size)),
+            UPLOAD_SIZES, QUICK_MAX_UPLOAD_SIZE,
+        ),
+    ]
+
+
+def measure(func, arg, repeat=5, min_batch_seconds=0.05):
+    """Returns (best seconds per call, peak bytes allocated by one call)."""
+    # Warm up, then pick a loop count that makes each timed batch long enough to be stable
+    started = time.perf_counter()
+    func(arg)
+    single = time.perf_counter() - started
+    loops = max(1, min(1000, int(min_batch_seconds / max(single, 1e-9))))
+
+    best = float('inf')
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(loops):
+                func(arg)
+            best = min(best, (time.perf_counter() - started) / loops)
+    finally:
+        gc.enable()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+    }
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """Returns a list of human-readable regression descriptions."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        time_limit = previous['seconds'] * (1 + time_tolerance)
+        if current['seconds'] > time_limit and current['seconds'] - previous['seconds'] > TIME_NOISE_FLOOR:
+            regressions.append(
+                f"{name}: {current['seconds'] * 1000:.3f} ms vs baseline {previous['seconds'] * 1000:.3f} ms"
+            )
+        memory_limit = previous['peak_bytes'] * (1 + memory_tolerance)
+        if current['peak_bytes'] > memory_limit and current['peak_bytes'] - previous['peak_bytes'] > MEMORY_NOISE_FLOOR:
+            regressions.append(
+                f"{name}: peak {current['peak_bytes'] / 1024:.0f} KiB vs baseline {previous['peak_bytes'] / 1024:.0f} KiB"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help="Only run benchmarks whose name contains this string.")
+    parser.add_argument('--quick', action='store_true', help="Skip the largest input sizes.")
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help="Write the results as the new baseline.")
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help="Allowed slowdown, as a fraction (default 0.5).")
+    parser.add_argument('--memory-tolerance', type=float, default=0.1, help="Allowed peak memory growth (default 0.1).")
+    parser.add_argument('--json', type=Path, help="Also write the results to this file.")
+    parser.add_argument(
+        '--fail-on-regression', action='store_true',
+        help="Exit with status 1 when a case regresses against the baseline.",
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    for benchmark in _benchmarks():
+        if args.filter not in benchmark.name:
+            continue
+        for case_name, size in benchmark.cases(quick=args.quick):
+            arg = benchmark.setup(size)
+            seconds, peak_bytes = measure(benchmark.func, arg)
+            del arg
+            results[case_name] = {'seconds': seconds, 'peak_bytes': peak_bytes}
+            print(f"{case_name:<40} {seconds * 1000:>12.3f} ms {peak_bytes / 1024:>12.0f} KiB peak")
+
+    if args.json:
+        args.json.write_text(json.dumps({'machine': machine_info(), 'results': results}, indent=2) + '\n')
+
+    if args.update_baseline:
+        stored = {}
+        if args.baseline.exists():
+            stored = json.loads(args.baseline.read_text()).get('results', {})
+        stored.update(results)
+        args.baseline.write_text(
+            json.dumps({'machine': machine_info(), 'results': dict(sorted(stored.items()))}, indent=2) + '\n'
+        )
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get('machine') != machine_info():
+        print(f"WARNING: Baseline was recorded on {baseline.get('machine')}; timings may not be comparable.")
+
+    regressions = compare(results, baseline.get('results', {}), args.time_tolerance, args.memory_tolerance)
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1 if args.fail_on_regression else 0
+    print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,5 @@
 // src/components/FullAnalyzer.js (Final Multi-Purpose Version)
-import React, { useState, useEffect, useRef } from 'react';
+import React, { useState, useEffect } from 'react';
 import jsPDF from 'jspdf';
 
 function FullAnalyzer({ vaultToken }) {
@@ -15,7 +15,6 @@ function FullAnalyzer({ vaultToken }) {
   const [loadingMessage, setLoadingMessage] = useState('');
   const [error, setError] = useState(null);
   const [taskId, setTaskId] = useState(null);
-  const intervalRef = useRef(null);
 
   // Fetch the configuration on component load
   useEffect(() => {
@@ -78,38 +77,102 @@ function FullAnalyzer({ vaultToken }) {
     }
   };
 
-  // useEffect for polling the task status
+  // useEffect for following the task status. The server pushes stage changes
+  // over Server-Sent Events; if streaming isn't available we long-poll instead.
   useEffect(() => {
     if (!taskId) {
-      clearInterval(intervalRef.current);
       return;
     }
-    intervalRef.current = setInterval(async () => {
-      try {
-        const response = await fetch(`http://localhost:8000/api/task-status/${taskId}/`, {
-          headers: { 'Authorization': `Bearer ${vaultToken}` }
-        });
+    const controller = new AbortController();
+    const headers = { 'Authorization': `Bearer ${vaultToken}` };
+    const stageMessages = {
+      QUEUED: 'Document submitted. Waiting for a worker...',
+      OCR: 'Extracting data from the document...',
+      LLM: 'Generating the analysis...',
+    };
+
+    // Returns true once the task has finished (successfully or not)
+    const handleStatus = (data) => {
+      const taskStatus = data.status ? data.status.toUpperCase() : '';
+      if (taskStatus === 'SUCCESS') {
+        setAnalysis(data.result);
+        setIsLoading(false);
+        setTaskId(null);
+        return true;
+      }
+      if (taskStatus === 'FAILURE') {
+        const errorMessage = data.error?.exc_message || JSON.stringify(data.error);
+        setError(`Analysis failed: ${errorMessage}`);
+        setIsLoading(false);
+        setTaskId(null);
+        return true;
+      }
+      if (taskStatus === 'LLM' && data.info?.output_tokens) {
+        setLoadingMessage(`${stageMessages.LLM} (${data.info.output_tokens} tokens so far)`);
+      } else if (taskStatus === 'LLM' && data.info?.chunks) {
+        setLoadingMessage(`${stageMessages.LLM} (${data.info.chunks_done} of ${data.info.chunks} parts done)`);
+      } else if (stageMessages[taskStatus]) {
+        setLoadingMessage(stageMessages[taskStatus]);
+      }
+      return false;
+    };
+
+    const streamEvents = async () => {
+      const response = await fetch(`http://localhost:8000/api/task-events/${taskId}/`, {
+        headers: { ...headers, 'Accept': 'text/event-stream' },
+        signal: controller.signal,
+      });
+      if (!response.ok || !response.body) throw new Error('Streaming unavailable');
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) return false;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const event of events) {
+          const dataLine = event.split('\n').find(line => line.startsWith('data: '));
+          if (dataLine && handleStatus(JSON.parse(dataLine.slice(6)))) return true;
+        }
+      }
+    };
+
+    const longPoll = async () => {
+      let since = '';
+      while (true) {
+        const response = await fetch(
+          `http://localhost:8000/api/task-status/${taskId}/?wait=20&since=${encodeURIComponent(since)}`,
+          { headers, signal: controller.signal }
+        );
         const data = await response.json();
-        if (data.status && data.status.toUpperCase() === 'SUCCESS') {
-          clearInterval(intervalRef.current);
-          setAnalysis(data.result);
-          setIsLoading(false);
-          setTaskId(null);
-        } else if (data.status && data.status.toUpperCase() === 'FAILURE') {
-          clearInterval(intervalRef.current);
-          const errorMessage = data.error?.exc_message || JSON.stringify(data.error);
-          setError(`Analysis failed: ${errorMessage}`);
+        if (handleStatus(data)) return;
+        since = data.status || '';
+      }
+    };
+
+    const follow = async () => {
+      try {
+        // The stream closes after ~25 s without finishing; reconnect until done,
+        // waiting as long as the server's retry: hint asks
+        while (await streamEvents() === false) {
+          await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+      } catch (err) {
+        if (controller.signal.aborted) return;
+        try {
+          await longPoll();
+        } catch (pollErr) {
+          if (controller.signal.aborted) return;
+          setError("Polling failed: Could not check task status.");
           setIsLoading(false);
           setTaskId(null);
         }
-      } catch (err) {
-        clearInterval(intervalRef.current);
-        setError("Polling failed: Could not check task status.");
-        setIsLoading(false);
-        setTaskId(null);
       }
-    }, 5000);
-    return () => clearInterval(intervalRef.current);
+    };
+    follow();
+    return () => controller.abort();
   }, [taskId, vaultToken]);
 
   // --- UPDATED AND DYNAMIC PDF DOWNLOAD FUNCTION ---
@@ -10,12 +10,24 @@ if 'celery' in sys.argv[0]:
 
 import os
 from celery import Celery
+from celery.signals import worker_init
+from api.json_codec import register_celery_serializer
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gemini_project.settings')
 
+# Celery's task and result serializer (see CELERY_TASK_SERIALIZER in settings.py)
+register_celery_serializer()
+
 app = Celery('gemini_project')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@worker_init.connect
+def _apply_queue_settings(sender=None, **kwargs):
+    # A worker started with -Q <stage> takes its concurrency from config.yaml (before its pool is created)
+    from api.scheduling import apply_queue_settings
+    apply_queue_settings(sender, list(sender.app.amqp.queues.consume_from or ()))
@@ -10,4 +10,17 @@ VAULT_ADDR = os.getenv('VAULT_ADDR')
 
 # Reads the Vault token for the backend service. For dev, this can be the root token.
 # In production, this should be a token with limited privileges obtained via a secure auth method like AppRole.
-VAULT_TOKEN = os.getenv('VAULT_TOKEN')
\ No newline at end of file
+VAULT_TOKEN = os.getenv('VAULT_TOKEN')
+
+# --- Vault Secret Cache ---
+# How long a KV secret is served from memory before it is read from Vault again.
+# A non-zero lease_duration returned by Vault takes precedence. Set to 0 to disable caching.
+VAULT_SECRET_CACHE_TTL = int(os.getenv('VAULT_SECRET_CACHE_TTL', '300'))
+
+# Secrets are refreshed in the background this many seconds before they expire.
+VAULT_SECRET_REFRESH_AHEAD = int(os.getenv('VAULT_SECRET_REFRESH_AHEAD', '30'))
+
+# --- Application Configuration ---
+# Path to an alternative config.yaml (e.g. one pointing at the load-test stand-ins).
+# Defaults to config.yaml in the project root.
+ANALYZER_CONFIG_PATH = os.getenv('ANALYZER_CONFIG_PATH')
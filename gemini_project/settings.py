@@ -11,11 +11,16 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from kombu import Queue
 from .vault_utils import vault_client
+from .config import ANALYZER_CONFIG_PATH
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# config.yaml with document types, models and provider endpoints (overridable via env)
+ANALYZER_CONFIG_PATH = Path(ANALYZER_CONFIG_PATH) if ANALYZER_CONFIG_PATH else BASE_DIR / 'config.yaml'
+
 # --- Fetch secrets dynamically from Hashicorp Vault ---
 SECRET_MOUNT_PATH = 'kv' 
 SECRET_PATH = 'users/mark.christian' 
@@ -152,9 +157,59 @@ CORS_ALLOW_HEADERS = [
     'x-vault-token',  # <-- This is the important addition
 ]
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'django-db'
-CELERY_ACCEPT_CONTENT = ['json']
-CELERY_TASK_SERIALIZER = 'json'
-CELERY_RESULT_SERIALIZER = 'json'
\ No newline at end of file
+# 'docjson' is api.json_codec (orjson when installed), registered in gemini_project/celery.py.
+# Plain 'json' is still accepted for messages queued by older workers.
+CELERY_ACCEPT_CONTENT = ['docjson', 'json']
+CELERY_TASK_SERIALIZER = 'docjson'
+CELERY_RESULT_SERIALIZER = 'docjson'
+# Each pipeline stage has its own queue (see api/scheduling.py), so it can get its
+# own workers, e.g. `celery -A gemini_project worker -Q ocr`; concurrency per queue
+# comes from the 'queues' section of config.yaml. Housekeeping stays on 'celery'.
+CELERY_TASK_QUEUES = [Queue(name) for name in ('celery', 'ingest', 'ocr', 'parse', 'llm')]  # A worker without -Q consumes all
+CELERY_TASK_ROUTES = {
+    'api.tasks.process_document_analysis': {'queue': 'ingest'},
+    'api.tasks.process_batch_transaction': {'queue': 'ingest'},
+    'api.tasks.poll_abbyy_transaction': {'queue': 'ocr'},
+    'api.tasks.poll_batch_transaction': {'queue': 'ocr'},
+    'api.tasks.parse_abbyy_result': {'queue': 'parse'},
+    'api.tasks.parse_batch_results': {'queue': 'parse'},
+    'api.tasks.run_llm_stage': {'queue': 'llm'},
+    'api.tasks.analyze_batch_document': {'queue': 'llm'},
+    'api.tasks.finalize_batch_group': {'queue': 'llm'},
+}
+# Message priorities 0 (first) to 9 (last), one Redis list per step
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': list(range(10)),
+    'sep': ':',
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Old results are deleted by api.tasks.expire_task_results, using the retention
+# in the 'result_store' section of config.yaml, instead of Celery's daily cleanup
+CELERY_RESULT_EXPIRES = None
+# Periodic housekeeping (run `celery -A gemini_project beat` alongside the workers)
+CELERY_BEAT_SCHEDULE = {
+    'collect-blob-garbage': {
+        'task': 'api.tasks.collect_blob_garbage',
+        'schedule': 3600.0,
+    },
+    'expire-task-results': {
+        'task': 'api.tasks.expire_task_results',
+        'schedule': 3600.0,
+    },
+}
@@ -1,6 +1,96 @@
 # gemini_project/vault_utils.py
+import threading
+import time
 import hvac
-from .config import VAULT_ADDR, VAULT_TOKEN
+from .config import VAULT_ADDR, VAULT_TOKEN, VAULT_SECRET_CACHE_TTL, VAULT_SECRET_REFRESH_AHEAD
+
+
+class SecretCache:
+    """
+    Caches whole KV secrets (every key at a path) so that several keys from the
+    same path cost a single Vault read. Entries live for `ttl` seconds, or the
+    Vault lease when that is shorter, and are refreshed in the
+    background shortly before they expire. Concurrent misses for the same path
+    wait on one in-flight fetch instead of all hitting Vault.
+    """
+    def __init__(self, fetch, ttl=300, refresh_ahead=30):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, mount_point, secret_path):
+        key = (mount_point, secret_path)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry['expires_at']:
+            if now >= entry['refresh_at']:
+                self._refresh_in_background(key)
+            return entry['data']
+        return self._load(key)
+
+    def invalidate(self, mount_point=None, secret_path=None):
+        """Drops one cached path, or every path when called without arguments."""
+        with self._lock:
+            if mount_point is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((mount_point, secret_path), None)
+
+    def _load(self, key):
+        with self._lock:
+            inflight = self._inflight.get(key)
+            is_leader = inflight is None
+            if is_leader:
+                inflight = {'done': threading.Event(), 'data': None, 'error': None}
+                self._inflight[key] = inflight
+
+        if not is_leader:
+            inflight['done'].wait()
+            if inflight['error'] is not None:
+                raise inflight['error']
+            # Not read from _entries: an invalidate() may already have dropped it
+            return inflight['data']
+
+        try:
+            data, lease_duration = self.fetch(*key)
+            # A lease (KV v1 defaults to 768h) may shorten the configured ttl, never extend it
+            lifetime = min(lease_duration, self.ttl) if lease_duration else self.ttl
+            now = time.monotonic()
+            self._entries[key] = {
+                'data': data,
+                'expires_at': now + lifetime,
+                'refresh_at': now + max(lifetime - self.refresh_ahead, lifetime / 2),
+            }
+            inflight['data'] = data
+            return data
+        except Exception as e:
+            inflight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight['done'].set()
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            # Invalidated meanwhile (the next get() loads it again), or already being loaded
+            if entry is None or key in self._inflight:
+                return
+            # Push refresh_at forward so only one refresh is started per entry
+            entry['refresh_at'] = entry['expires_at']
+
+        def refresh():
+            try:
+                self._load(key)
+            except Exception as e:
+                print(f"WARNING: Background refresh of Vault secret '{key[1]}' failed: {e}")
+
+        threading.Thread(target=refresh, daemon=True).start()
+
 
 class VaultClient:
     """
@@ -10,22 +100,39 @@ class VaultClient:
         self.client = hvac.Client(url=VAULT_ADDR, token=VAULT_TOKEN)
         if not self.client.is_authenticated():
             raise Exception("Vault authentication failed. Check VAULT_ADDR and VAULT_TOKEN.")
+        self.secret_cache = SecretCache(
+            self._read_secret,
+            ttl=VAULT_SECRET_CACHE_TTL,
+            refresh_ahead=VAULT_SECRET_REFRESH_AHEAD,
+        )
+
+    def _read_secret(self, mount_point, secret_path):
+        response = self.client.secrets.kv.v2.read_secret_version(
+            path=secret_path,
+            mount_point=mount_point # Pass the custom mount point here
+        )
+        return response['data']['data'], response.get('lease_duration') or 0
 
     # --- UPDATED FUNCTION ---
     def get_secret(self, secret_path, secret_key, mount_point='kv'):
         """
         Fetches a specific key from a secret path in Vault's KVv2 engine,
-        allowing for a custom mount point.
+        allowing for a custom mount point. The whole secret is cached, so other
+        keys from the same path are served without another Vault read.
         """
         try:
-            response = self.client.secrets.kv.v2.read_secret_version(
-                path=secret_path,
-                mount_point=mount_point # Pass the custom mount point here
-            )
-            return response['data']['data'][secret_key]
+            if VAULT_SECRET_CACHE_TTL > 0:
+                secret_data = self.secret_cache.get(mount_point, secret_path)
+            else:
+                secret_data, _ = self._read_secret(mount_point, secret_path)
+            return secret_data[secret_key]
         except (hvac.exceptions.InvalidPath, KeyError) as e:
             print(f"ERROR: Could not find secret '{secret_key}' at path '{secret_path}' on mount point '{mount_point}'. Error: {e}")
             return None
+        except (hvac.exceptions.Forbidden, hvac.exceptions.Unauthorized):
+            # Our token lost access; don't keep serving secrets it can no longer read
+            self.secret_cache.invalidate()
+            raise
 
 # Create a single, reusable instance for the application
-vault_client = VaultClient()
\ No newline at end of file
+vault_client = VaultClient()
@@ -0,0 +1,246 @@
+# loadtest/drive.py
+"""
+Drives `analyze/` and `task-status/` at a fixed arrival rate and reports
+throughput, end-to-end latency percentiles, broker queue depth and Celery
+worker saturation.
+
+    python -m loadtest.drive --token loadtest --rate 2 --duration 120
+
+Requests arrive open-loop (a new analysis every 1/rate seconds, whether or not
+earlier ones finished), so an overloaded deployment shows up as growing
+latency and queue depth instead of a silently lower request rate. Each
+upload is unique by default so the OCR and LLM caches don't hide the
+pipeline's real cost.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks import payloads
+
+TERMINAL_STATES = ('SUCCESS', 'FAILURE')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+class Recorder:
+    """Thread-safe collection of per-analysis outcomes."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submit_seconds = []
+        self.end_to_end_seconds = []
+        self.outcomes = {}
+
+    def record(self, outcome, submit_seconds=None, end_to_end_seconds=None):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if submit_seconds is not None:
+                self.submit_seconds.append(submit_seconds)
+            if end_to_end_seconds is not None:
+                self.end_to_end_seconds.append(end_to_end_seconds)
+
+
+class ClusterMonitor(threading.Thread):
+    """Samples broker queue depth and worker saturation until stopped."""
+    def __init__(self, broker_url, queues, interval):
+        super().__init__(daemon=True)
+        self.broker_url = broker_url
+        self.queues = queues
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.queue_depths = []
+        self.saturations = []
+        self.scheduled = []
+
+    def run(self):
+        import redis
+        from celery import Celery
+
+        client = redis.Redis.from_url(self.broker_url)
+        app = Celery(broker=self.broker_url)
+        while not self.stopped.is_set():
+            try:
+                # The broker keeps one list per priority step: 'llm', 'llm:1', ... 'llm:9'
+                self.queue_depths.append(sum(
+                    client.llen(queue if priority == 0 else f"{queue}:{priority}")
+                    for queue in self.queues for priority in range(10)
+                ))
+            except redis.RedisError as e:
+                print(f"WARNING: Could not read queue depth: {e}")
+            try:
+                inspect = app.control.inspect(timeout=1.0)
+                stats = inspect.stats() or {}
+                active = inspect.active() or {}
+                scheduled = inspect.scheduled() or {}
+                capacity = sum(worker.get('pool', {}).get('max-concurrency', 0) for worker in stats.values())
+                busy = sum(len(tasks) for tasks in active.values())
+                if capacity:
+                    self.saturations.append(busy / capacity)
+                # Countdown-scheduled tasks (ABBYY polls) wait in the workers, not in the queue
+                self.scheduled.append(sum(len(tasks) for tasks in scheduled.values()))
+            except Exception as e:
+                print(f"WARNING: Could not inspect workers: {e}")
+            self.stopped.wait(self.interval)
+
+
+def run_analysis(session, args, recorder, upload):
+    headers = {'Authorization': f"Bearer {args.token}"}
+    started = time.monotonic()
+    try:
+        response = session.post(
+            f"{args.url}/analyze/",
+            headers=headers,
+            files={'document': ('loadtest.pdf', upload, 'application/pdf')},
+            data={
+                'doc_type_id': args.doc_type,
+                'model_id': args.model,
+                'ragText': 'Load test run.',
+                'bypass_cache': 'true' if args.bypass_cache else 'false',
+            },
+            timeout=60,
+        )
+    except requests.RequestException:
+        recorder.record('submit_error')
+        return
+    submit_seconds = time.monotonic() - started
+    if response.status_code != 202:
+        recorder.record(f"submit_http_{response.status_code}", submit_seconds)
+        return
+    task_id = response.json()['task_id']
+
+    # Long-poll task-status: each call returns as soon as the stage changes
+    last_status = None
+    deadline = started + args.timeout
+    while time.monotonic() < deadline:
+        params = {'wait': min(25, max(1, int(deadline - time.monotonic())))}
+        if last_status:
+            params['since'] = last_status
+        try:
+            status_response = session.get(f"{args.url}/task-status/{task_id}/", headers=headers, params=params, timeout=40)
+            last_status = status_response.json().get('status')
+        except (requests.RequestException, ValueError):
+            time.sleep(1)
+            continue
+        if last_status in TERMINAL_STATES:
+            outcome = 'success' if last_status == 'SUCCESS' else 'failure'
+            recorder.record(outcome, submit_seconds, time.monotonic() - started)
+            return
+    recorder.record('timeout', submit_seconds)
+
+
+def _format_ms(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds is not None else "n/a"
+
+
+def report(args, recorder, monitor, elapsed):
+    completed = recorder.outcomes.get('success', 0)
+    latencies = recorder.end_to_end_seconds
+    summary = {
+        'target_rate': args.rate,
+        'duration_seconds': elapsed,
+        'outcomes': recorder.outcomes,
+        'throughput_per_second': completed / elapsed if elapsed else 0,
+        'end_to_end_seconds': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+        },
+        'submit_seconds': {
+            'p50': percentile(recorder.submit_seconds, 0.50),
+            'p99': percentile(recorder.submit_seconds, 0.99),
+        },
+        'queue_depth': {
+            'mean': sum(monitor.queue_depths) / len(monitor.queue_depths) if monitor.queue_depths else None,
+            'max': max(monitor.queue_depths) if monitor.queue_depths else None,
+        },
+        'scheduled_tasks_max': max(monitor.scheduled) if monitor.scheduled else None,
+        'worker_saturation': {
+            'mean': sum(monitor.saturations) / len(monitor.saturations) if monitor.saturations else None,
+            'max': max(monitor.saturations) if monitor.saturations else None,
+        },
+    }
+
+    print("\n--- Load test results ---")
+    print(f"Target rate:        {args.rate}/s for {elapsed:.0f}s")
+    print(f"Outcomes:           {recorder.outcomes}")
+    print(f"Throughput:         {summary['throughput_per_second']:.2f} analyses/s")
+    e2e = summary['end_to_end_seconds']
+    print(f"End-to-end latency: p50 {_format_ms(e2e['p50'])}, p95 {_format_ms(e2e['p95'])}, p99 {_format_ms(e2e['p99'])}")
+    print(f"Submit latency:     p50 {_format_ms(summary['submit_seconds']['p50'])}, p99 {_format_ms(summary['submit_seconds']['p99'])}")
+    print(f"Queue depth:        mean {summary['queue_depth']['mean']}, max {summary['queue_depth']['max']}")
+    print(f"Scheduled polls:    max {summary['scheduled_tasks_max']}")
+    saturation = summary['worker_saturation']
+    if saturation['mean'] is not None:
+        print(f"Worker saturation:  mean {saturation['mean']:.0%}, max {saturation['max']:.0%}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000/api', help="Base URL of the API.")
+    parser.add_argument('--token', default=os.getenv('VAULT_TOKEN', 'loadtest'), help="Vault token for the Authorization header.")
+    parser.add_argument('--rate', type=float, default=1.0, help="New analyses per second.")
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds to keep submitting.")
+    parser.add_argument('--timeout', type=float, default=900.0, help="Give up on an analysis after this many seconds.")
+    parser.add_argument('--doc-type', default='tender_spec')
+    parser.add_argument('--model', default='gemini-1.5-flash-latest')
+    parser.add_argument('--file-size', type=int, default=512 * 1024, help="Bytes per synthetic upload.")
+    parser.add_argument('--reuse-file', action='store_true', help="Upload identical bytes every time (exercises the caches).")
+    parser.add_argument('--no-bypass-cache', dest='bypass_cache', action='store_false')
+    parser.add_argument('--broker-url', default='redis://localhost:6379/0')
+    parser.add_argument('--queues', default='celery,ingest,ocr,parse,llm', help="Comma-separated broker queues to measure.")
+    parser.add_argument('--sample-interval', type=float, default=2.0)
+    parser.add_argument('--max-clients', type=int, default=500, help="Upper bound on concurrent in-flight analyses.")
+    parser.add_argument('--json', help="Also write the summary to this file.")
+    args = parser.parse_args(argv)
+    args.url = args.url.rstrip('/')
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=args.max_clients)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    recorder = Recorder()
+    monitor = ClusterMonitor(args.broker_url, [queue for queue in args.queues.split(',') if queue], args.sample_interval)
+    monitor.start()
+
+    base_upload = payloads.upload_bytes(args.file_size)
+    interval = 1.0 / args.rate
+    started = time.monotonic()
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=args.max_clients) as executor:
+        while time.monotonic() - started < args.duration:
+            # Append a random tail so every upload has a distinct content hash
+            upload = base_upload if args.reuse_file else base_upload + random.randbytes(16)
+            executor.submit(run_analysis, session, args, recorder, upload)
+            submitted += 1
+            next_at = started + submitted * interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+        print(f"Submitted {submitted} analyses; waiting for them to finish...")
+    elapsed = time.monotonic() - started
+
+    monitor.stopped.set()
+    summary = report(args, recorder, monitor, elapsed)
+    return 0 if summary['outcomes'].get('success', 0) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
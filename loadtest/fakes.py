@@ -0,0 +1,374 @@
+# loadtest/fakes.py
+"""
+Local stand-ins for the external services the pipeline talks to, speaking
+just the subset of each API the code uses:
+
+- Vault: token lookup / lookup-self and KV v2 reads
+- ABBYY Vantage: token exchange and the transactions API
+- Gemini: generateContent and streamGenerateContent (SSE)
+- OpenAI: chat completions, optionally streamed
+
+Latency, error rates and ABBYY processing times are configurable, so a local
+Django + Celery deployment can be load-tested without touching production.
+
+    python -m loadtest.fakes --abbyy-processing 8 --llm-latency 4 --error-rate 0.01
+
+The command writes a config.yaml pointing at the fakes and prints the
+environment to start the web server and the workers with.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import yaml
+
+from benchmarks import payloads
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+class Behaviour:
+    """How a fake service responds: base latency with jitter, and an injected error rate."""
+    def __init__(self, latency=0.0, jitter=0.5, error_rate=0.0, error_status=503):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self, extra=0.0):
+        base = self.latency + extra
+        if base > 0:
+            time.sleep(max(0.0, random.uniform(base * (1 - self.jitter), base * (1 + self.jitter))))
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class EventStream:
+    """A server-sent events response: each event is sent as a `data:` line, `interval` seconds apart."""
+    def __init__(self, events, interval=0.0):
+        self.events = events
+        self.interval = interval
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Routes requests to `server.routes`, a list of (method, compiled path regex, handler)."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        path = self.path.split('?', 1)[0]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        service = self.server.service
+        service.behaviour.delay()
+        if service.behaviour.should_fail():
+            return self._send(service.behaviour.error_status, {'error': 'Injected failure'})
+
+        for route_method, pattern, handler in service.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                status, payload = handler(self, body, **match.groupdict())
+                if isinstance(payload, EventStream):
+                    return self._send_events(status, payload)
+                return self._send(status, payload)
+        self._send(404, {'error': f'No fake route for {method} {path}'})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, status, stream):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in stream.events:
+            data = event if isinstance(event, str) else json.dumps(event)
+            chunk = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(chunk):x}\r\n".encode('ascii') + chunk + b"\r\n")
+            self.wfile.flush()
+            time.sleep(stream.interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class FakeService:
+    name = None
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.routes = []
+        self.server = None
+
+    def route(self, method, pattern, handler):
+        self.routes.append((method, re.compile(pattern), handler))
+
+    def start(self, host, port):
+        self.server = ThreadingHTTPServer((host, port), FakeHandler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+
+class FakeVault(FakeService):
+    name = 'vault'
+
+    def __init__(self, behaviour, secrets):
+        super().__init__(behaviour)
+        self.secrets = secrets
+        token_data = {'data': {'ttl': 3600, 'policies': ['default'], 'display_name': 'loadtest'}}
+        self.route('GET', r'/v1/auth/token/lookup-self', lambda request, body: (200, token_data))
+        self.route('POST', r'/v1/auth/token/lookup', lambda request, body: (200, token_data))
+        self.route('GET', r'/v1/(?P<mount>[^/]+)/data/(?P<path>.+)', self.read_secret)
+
+    def read_secret(self, request, body, mount, path):
+        return 200, {'data': {'data': self.secrets, 'metadata': {'version': 1}}, 'lease_duration': 0}
+
+
+class FakeAbbyy(FakeService):
+    name = 'abbyy'
+
+    def __init__(self, behaviour, processing_seconds, seconds_per_mb, rows, transactions_endpoint):
+        super().__init__(behaviour)
+        self.processing_seconds = processing_seconds
+        self.seconds_per_mb = seconds_per_mb
+        self.rows = rows
+        self.transactions = {}
+        self.lock = threading.Lock()
+        self.result = payloads.abbyy_result(rows)
+
+        base = re.escape(transactions_endpoint)
+        self.route('POST', r'/auth2/connect/token', self.token)
+        self.route('POST', base, self.create)
+        self.route('POST', base + r'/(?P<transaction_id>[^/]+)/files', self.add_file)
+        self.route('POST', base + r'/(?P<transaction_id>[^/]+)/start', self.start_processing)
+        self.route('GET', base + r'/(?P<transaction_id>[^/]+)', self.status)
+        self.route('GET', base + r'/(?P<transaction_id>[^/]+)/files/(?P<file_id>[^/]+)/download', self.download)
+
+    def token(self, request, body):
+        return 200, {'access_token': uuid.uuid4().hex, 'expires_in': 3600, 'token_type': 'Bearer'}
+
+    def create(self, request, body):
+        transaction_id = str(uuid.uuid4())
+        with self.lock:
+            self.transactions[transaction_id] = {'files': [], 'ready_at': None}
+        return 200, {'transactionId': transaction_id}
+
+    def add_file(self, request, body, transaction_id):
+        match = re.search(rb'filename="([^"]*)"', body[:4096])
+        file_name = match.group(1).decode('utf-8', 'replace') if match else 'document'
+        with self.lock:
+            self.transactions[transaction_id]['files'].append({'name': file_name, 'size': len(body)})
+        return 200, {}
+
+    def start_processing(self, request, body, transaction_id):
+        with self.lock:
+            transaction = self.transactions[transaction_id]
+            megabytes = sum(f['size'] for f in transaction['files']) / (1024 * 1024)
+            seconds = self.processing_seconds + self.seconds_per_mb * megabytes
+            transaction['ready_at'] = time.time() + random.uniform(seconds * 0.7, seconds * 1.3)
+        return 200, {}
+
+    def status(self, request, body, transaction_id):
+        with self.lock:
+            transaction = self.transactions.get(transaction_id)
+        if not transaction:
+            return 404, {'error': 'Unknown transaction'}
+        if not transaction['ready_at'] or time.time() < transaction['ready_at']:
+            return 200, {'id': transaction_id, 'status': 'Processing'}
+        documents = [
+            {'resultFiles': [{'fileId': f"{index}"}], 'sourceFiles': [{'name': f['name']}]}
+            for index, f in enumerate(transaction['files'])
+        ]
+        return 200, {'id': transaction_id, 'status': 'Processed', 'documents': documents}
+
+    def download(self, request, body, transaction_id, file_id):
+        return 200, self.result
+
+
+def _llm_delay(behaviour, body, seconds_per_1k_chars):
+    behaviour.delay(extra=seconds_per_1k_chars * len(body) / 1000)
+
+
+# Streamed responses are sent in pieces of this many characters, this far apart
+STREAM_PIECE_CHARS = 64
+STREAM_PIECE_INTERVAL = 0.01
+
+
+def _pieces(text):
+    return [text[start:start + STREAM_PIECE_CHARS] for start in range(0, len(text), STREAM_PIECE_CHARS)]
+
+
+class FakeGemini(FakeService):
+    name = 'gemini'
+
+    def __init__(self, behaviour, seconds_per_1k_chars, rows):
+        super().__init__(behaviour)
+        self.seconds_per_1k_chars = seconds_per_1k_chars
+        self.response = payloads.gemini_response(rows)
+        self.text = self.response['candidates'][0]['content']['parts'][0]['text']
+        self.route('POST', r'/v1beta/models/(?P<model>[^/:]+):generateContent', self.generate)
+        self.route('POST', r'/v1beta/models/(?P<model>[^/:]+):streamGenerateContent', self.stream)
+
+    def generate(self, request, body, model):
+        _llm_delay(Behaviour(jitter=0.3), body, self.seconds_per_1k_chars)
+        return 200, self.response
+
+    def stream(self, request, body, model):
+        _llm_delay(Behaviour(jitter=0.3), body, self.seconds_per_1k_chars)
+        events = [
+            {
+                'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]}, 'index': 0}],
+                'usageMetadata': {'promptTokenCount': len(body) // 4, 'candidatesTokenCount': (index + 1) * STREAM_PIECE_CHARS // 4},
+            }
+            for index, piece in enumerate(_pieces(self.text))
+        ]
+        return 200, EventStream(events, STREAM_PIECE_INTERVAL)
+
+
+class FakeOpenAI(FakeService):
+    name = 'openai'
+
+    def __init__(self, behaviour, seconds_per_1k_chars, rows):
+        super().__init__(behaviour)
+        self.seconds_per_1k_chars = seconds_per_1k_chars
+        self.content = payloads.gemini_response(rows)['candidates'][0]['content']['parts'][0]['text']
+        self.route('POST', r'/v1/chat/completions', self.complete)
+        self.route('GET', r'/v1/models/(?P<model>[^/]+)', self.model)
+
+    def model(self, request, body, model):
+        return 200, {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'loadtest'}
+
+    def complete(self, request, body):
+        _llm_delay(Behaviour(jitter=0.3), body, self.seconds_per_1k_chars)
+        request_data = json.loads(body or b'{}')
+        model = request_data.get('model', 'gpt-fake')
+        usage = {'prompt_tokens': len(body) // 4, 'completion_tokens': len(self.content) // 4,
+                 'total_tokens': (len(body) + len(self.content)) // 4}
+        if request_data.get('stream'):
+            return 200, self.stream(model, usage, request_data.get('stream_options', {}).get('include_usage'))
+        return 200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.content},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        }
+
+    def stream(self, model, usage, include_usage):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def chunk(choices, usage=None):
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': model, 'choices': choices, 'usage': usage}
+
+        events = [chunk([{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])]
+        events += [chunk([{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]) for piece in _pieces(self.content)]
+        events.append(chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        if include_usage:
+            events.append(chunk([], usage))
+        events.append('[DONE]')
+        return EventStream(events, STREAM_PIECE_INTERVAL)
+
+
+def vault_secrets(config_data):
+    """Every Vault key the app reads: the ones named in config.yaml plus those settings.py loads."""
+    secrets = {key: f"loadtest-{key}" for key in ('django_secret_key', 'abbyy_client_id', 'abbyy_client_secret', 'gemini_api_key')}
+    for provider in config_data.get('providers', {}).values():
+        for option, key in provider.items():
+            if option.endswith('_vault_key'):
+                secrets[key] = f"loadtest-{key}"
+    return secrets
+
+
+def write_config(config_data, urls, path):
+    """Writes a copy of config.yaml whose provider endpoints point at the fakes."""
+    config_data = json.loads(json.dumps(config_data))
+    config_data['api_endpoints']['abbyy']['base_url'] = urls['abbyy']
+    config_data['api_endpoints']['google_gemini']['base_url'] = urls['gemini']
+    with open(path, 'w') as f:
+        yaml.safe_dump(config_data, f, sort_keys=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=18200, help="Vault, ABBYY, Gemini and OpenAI use consecutive ports.")
+    parser.add_argument('--config', type=Path, default=BASE_DIR / 'config.yaml', help="config.yaml to derive from.")
+    parser.add_argument('--output-dir', type=Path, default=None, help="Where to write the derived config.yaml.")
+    parser.add_argument('--vault-latency', type=float, default=0.005)
+    parser.add_argument('--abbyy-latency', type=float, default=0.05, help="Per-request latency of the ABBYY API.")
+    parser.add_argument('--abbyy-processing', type=float, default=5.0, help="Seconds from start to Processed.")
+    parser.add_argument('--abbyy-seconds-per-mb', type=float, default=1.0)
+    parser.add_argument('--llm-latency', type=float, default=3.0, help="Base generation time of the LLM fakes.")
+    parser.add_argument('--llm-seconds-per-1k-chars', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of ABBYY and LLM requests answered with a 503.")
+    parser.add_argument('--rows', type=int, default=200, help="techSpecs rows in ABBYY results / line items in LLM answers.")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r') as f:
+        config_data = yaml.safe_load(f)
+
+    services = [
+        FakeVault(Behaviour(args.vault_latency), vault_secrets(config_data)),
+        FakeAbbyy(
+            Behaviour(args.abbyy_latency, error_rate=args.error_rate),
+            args.abbyy_processing, args.abbyy_seconds_per_mb, args.rows,
+            config_data['api_endpoints']['abbyy']['transactions_endpoint'],
+        ),
+        FakeGemini(Behaviour(args.llm_latency, error_rate=args.error_rate), args.llm_seconds_per_1k_chars, args.rows),
+        FakeOpenAI(Behaviour(args.llm_latency, error_rate=args.error_rate), args.llm_seconds_per_1k_chars, args.rows),
+    ]
+    urls = {service.name: service.start(args.host, args.base_port + offset) for offset, service in enumerate(services)}
+
+    output_dir = args.output_dir or Path(tempfile.mkdtemp(prefix='docanalyzer-loadtest-'))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    config_path = output_dir / 'config.yaml'
+    write_config(config_data, urls, config_path)
+
+    for name, url in urls.items():
+        print(f"Fake {name:<7} listening on {url}")
+    print("\nStart the web server and the Celery workers with:\n")
+    print(f"  export VAULT_ADDR={urls['vault']}")
+    print("  export VAULT_TOKEN=loadtest")
+    print(f"  export ANALYZER_CONFIG_PATH={config_path}")
+    print(f"  export OPENAI_BASE_URL={urls['openai']}/v1")
+    print("\nThen drive load with: python -m loadtest.drive --token loadtest --rate 2 --duration 120")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())